@@ -0,0 +1,71 @@
+import json
+from datetime import timezone
+from heapq import merge
+
+import core
+from timerclasses import *
+
+# Agenda and iCalendar export built on the lazy occurrences() generators of the timer classes.
+# Nothing is expanded up front: the agenda merges one pending occurrence per timer,
+# the .ics export writes each timer's occurrences as they are generated.
+
+ICS_LINE_LIMIT = 75  # octets per line before folding, RFC 5545
+
+
+def timers_from_rows(rows):
+    # rows = iterable of (ID, type, comment, last clicked, JSON data), yields (ID, timertype, timer object)
+    for objid, timertype, comment, lastclicked, data in rows:
+        yield objid, timertype, core.make_timer(timertype, comment, lastclicked, json.loads(data))
+
+
+def timer_occurrences(objid, timertype, timer, start, end):
+    for occurrence in timer.occurrences(start, end):
+        yield occurrence, objid, timertype, timer.comment
+
+
+def agenda(timers, start, end):
+    # timers = iterable of (ID, timertype, timer object)
+    # yields (timestamp, ID, timertype, comment) of every deadline in [start, end) in time order
+    return merge(*(timer_occurrences(objid, timertype, timer, start, end) for objid, timertype, timer in timers))
+
+
+def ics_text(text):
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def ics_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def ics_line(line):
+    # folds lines longer than ICS_LINE_LIMIT octets, continuation lines start with a space
+    encoded = line.encode()
+    if len(encoded) <= ICS_LINE_LIMIT:
+        return line + "\r\n"
+    parts = []
+    limit = ICS_LINE_LIMIT
+    while encoded:
+        cut = min(limit, len(encoded))
+        # never split a multi-byte character
+        while cut < len(encoded) and encoded[cut] & 0xC0 == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode())
+        encoded = encoded[cut:]
+        limit = ICS_LINE_LIMIT - 1
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def export_ics(timers, output, start, end):
+    # writes every deadline in [start, end) as an event, returns number of events
+    # timers = iterable of (ID, timertype, timer object), output = text file object
+    stamp = ics_time(time_int())
+    output.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//sfmartiz//To-do list//EN\r\n")
+    count = 0
+    for objid, timertype, timer in timers:
+        summary = ics_line(f"SUMMARY:{ics_text(timer.comment)}")
+        for occurrence in timer.occurrences(start, end):
+            output.write(f"BEGIN:VEVENT\r\nUID:{objid}-{occurrence}@todo\r\nDTSTAMP:{stamp}\r\n"
+                         f"DTSTART:{ics_time(occurrence)}\r\n{summary}CATEGORIES:{timertype}\r\nEND:VEVENT\r\n")
+            count += 1
+    output.write("END:VCALENDAR\r\n")
+    return count
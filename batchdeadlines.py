@@ -0,0 +1,368 @@
+import numpy as np
+
+from timerclasses import *
+from core import schedule_fields
+from recurrence import compile_rule, intern_rule, rule_texts
+
+# Evaluates last/next deadlines of a whole timer set in one numpy pass per timer type.
+# Timer parameters are kept in typed arrays grouped by timertype, rows are
+# added and removed in place so the arrays never have to be rebuilt from the timers dict.
+# Timers are located through arrays indexed by ID, so IDs have to be small
+# non-negative integers like the database row IDs.
+
+# parameter columns kept for every timer type as (name, dtype), read back as int64
+group_columns = {
+    "Daily": (("base", np.int32),),                         # seconds after local midnight
+    "Weekly": (("base", np.int32),),                        # seconds after local monday midnight
+    "Weekday": (("mask", np.int8), ("base", np.int32)),     # bitmask of weekdays, seconds after local midnight
+    "Monthly": (("day", np.int8), ("base", np.int32)),      # day of month, seconds after local midnight
+    "Custom": (("start", np.int64), ("interval", np.int64), ("unit", np.int8)),  # unit = index in unit_names
+    "Once": (("start", np.int64),),
+    "Rule": (("rule", np.int32),)                           # position in recurrence.rule_texts
+}
+unit_names = tuple(unit_seconds)
+# number of selected days of every Weekday mask
+mask_days = np.array([bin(mask).count("1") for mask in range(128)], dtype=np.int64)
+
+
+def args_params(timertype, args):
+    # group column values from the argument list stored in the Data column
+    match timertype:
+        case "Daily":
+            return (args[0]*HOUR + args[1]*MINUTE,)
+        case "Weekly":
+            return (args[0]*DAY + args[1]*HOUR + args[2]*MINUTE,)
+        case "Weekday":
+            mask = 0
+            for entry in args[0]:
+                mask |= 1 << entry
+            return (mask, args[1]*HOUR + args[2]*MINUTE)
+        case "Monthly":
+            return (args[0], args[1]*HOUR + args[2]*MINUTE)
+        case "Custom":
+            return (args[0], args[1] * unit_seconds[args[2]], unit_names.index(args[2]))
+        case "Once":
+            return (args[0],)
+        case "Rule":
+            return (intern_rule(args[0]),)
+
+
+def params_args(timertype, params):
+    # inverse of args_params, the argument list as stored in the Data column
+    match timertype:
+        case "Daily":
+            return [params[0] // HOUR, params[0] % HOUR // MINUTE]
+        case "Weekly":
+            return [params[0] // DAY, params[0] % DAY // HOUR, params[0] % HOUR // MINUTE]
+        case "Weekday":
+            return [[day for day in range(7) if params[0] >> day & 1], params[1] // HOUR, params[1] % HOUR // MINUTE]
+        case "Monthly":
+            return [params[0], params[1] // HOUR, params[1] % HOUR // MINUTE]
+        case "Custom":
+            unit = unit_names[params[2]]
+            return [params[0], params[1] // unit_seconds[unit], unit]
+        case "Once":
+            return [params[0]]
+        case "Rule":
+            return [rule_texts[params[0]]]
+
+
+class TimerGroup:
+    def __init__(self, columns, capacity=16):
+        self.size = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.lastclicked = np.zeros(capacity, dtype=np.int64)
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in columns}
+
+    def _grow(self, minimum=0):
+        capacity = max(len(self.ids) * 2, minimum, 16)
+        self.ids = np.resize(self.ids, capacity)
+        self.lastclicked = np.resize(self.lastclicked, capacity)
+        for name, column in self.columns.items():
+            self.columns[name] = np.resize(column, capacity)
+
+    def append(self, objid):
+        # returns the new row
+        if self.size == len(self.ids):
+            self._grow()
+        self.ids[self.size] = objid
+        self.size += 1
+        return self.size - 1
+
+    def extend(self, ids, lastclicked, params):
+        # bulk append, params = list of column value tuples, returns the new rows
+        return self.extend_columns(ids, lastclicked, list(zip(*params)))
+
+    def extend_columns(self, ids, lastclicked, columns):
+        # bulk append with the values given per column, in the order of self.columns
+        count = len(ids)
+        if self.size + count > len(self.ids):
+            self._grow(self.size + count)
+        rows = slice(self.size, self.size + count)
+        self.ids[rows] = ids
+        self.lastclicked[rows] = lastclicked
+        for column, values in zip(self.columns.values(), columns):
+            column[rows] = values
+        self.size += count
+        return np.arange(rows.start, rows.stop)
+
+    def set(self, row, lastclicked, params):
+        self.lastclicked[row] = lastclicked
+        for column, value in zip(self.columns.values(), params):
+            column[row] = value
+
+    def params(self, row):
+        return [column[row].item() for column in self.columns.values()]
+
+    def remove(self, row):
+        # moves the last row into the freed slot, returns the ID of the moved timer or None
+        self.size -= 1
+        if row == self.size:
+            return None
+        self.ids[row] = self.ids[self.size]
+        self.lastclicked[row] = self.lastclicked[self.size]
+        for column in self.columns.values():
+            column[row] = column[self.size]
+        return int(self.ids[row])
+
+    def column(self, name):
+        return self.columns[name][:self.size].astype(np.int64, copy=False)
+
+
+def periodic_last(currtime, phase, period):
+    # last timestamp <= currtime that is congruent to phase modulo period
+    return currtime - (currtime - phase) % period
+
+
+def monthly_deadline(year, month, day, base):
+    # UTC deadline arrays of Monthly timers in the given months, clamped to the last day of short months
+    clampedday = np.minimum(day, days_in_month(year, month))
+    return localzone.to_utc_array((days_from_civil(year, month, 1) + clampedday - 1)*DAY + base)
+
+
+def bracket(currtime, period, period_deadline):
+    # (last deadline <= currtime, next deadline > currtime) arrays, same as LocalTimer.deadlines
+    # period = number of the local period containing currtime, shared by all timers of the group
+    current = period_deadline(period)
+    passed = current <= currtime
+    return np.where(passed, current, period_deadline(period - 1)), np.where(passed, period_deadline(period + 1), current)
+
+
+class DeadlineBatch:
+    def __init__(self, timers=None):
+        self.groups = {timertype: TimerGroup(group_columns[timertype]) for timertype in timertypes}
+        self.grouplist = list(self.groups.values())
+        # indexed by ID: position of timertype in timertypes (-1 = no such timer) and row in its group
+        self.typecodes = np.full(16, -1, dtype=np.int8)
+        self.rows = np.zeros(16, dtype=np.int32)
+        self.count = 0
+        if timers:
+            for objid, entry in timers.items():
+                self.update(objid, entry)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, objid):
+        return 0 <= objid < len(self.typecodes) and self.typecodes[objid] >= 0
+
+    def _reserve(self, objid):
+        if objid < 0:
+            raise ValueError(f"Invalid timer ID {objid}")
+        if objid >= len(self.typecodes):
+            capacity = max(objid + 1, len(self.typecodes) * 2)
+            self.typecodes = np.concatenate((self.typecodes, np.full(capacity - len(self.typecodes), -1, np.int8)))
+            self.rows = np.resize(self.rows, capacity)
+
+    def timertype(self, objid):
+        return timertypes[self.typecodes[objid]]
+
+    def locate(self, objid):
+        # (group, row) of a stored timer
+        return self.grouplist[self.typecodes[objid]], int(self.rows[objid])
+
+    def update(self, objid, entry):
+        # entry = [timertype, object], same as in the timers dict
+        timertype, timerobject = entry
+        self.set_args(objid, timertype, timerobject.extraargs, timerobject.lastclicked)
+
+    def set_args(self, objid, timertype, args, lastclicked=0):
+        self._reserve(objid)
+        typecode = timertypes.index(timertype)
+        if self.typecodes[objid] != typecode:
+            self.discard(objid)
+            self.typecodes[objid] = typecode
+            self.rows[objid] = self.groups[timertype].append(objid)
+            self.count += 1
+        self.groups[timertype].set(self.rows[objid], lastclicked, args_params(timertype, args))
+
+    def lastclicked_by_id(self):
+        # last clicked times of all timers in one array indexed by ID
+        result = np.zeros(len(self.typecodes), dtype=np.int64)
+        for group in self.grouplist:
+            result[group.ids[:group.size]] = group.lastclicked[:group.size]
+        return result
+
+    def set_last_clicked(self, objid, lastclicked):
+        group, row = self.locate(objid)
+        group.lastclicked[row] = lastclicked
+
+    def set_last_clicked_many(self, objids, lastclicked):
+        objids = np.asarray(objids, dtype=np.int64)
+        typecodes = self.typecodes[objids]
+        for typecode, group in enumerate(self.grouplist):
+            group.lastclicked[self.rows[objids[typecodes == typecode]]] = lastclicked
+
+    def discard(self, objid):
+        if objid not in self:
+            return
+        group, row = self.locate(objid)
+        movedid = group.remove(row)
+        if movedid is not None:
+            self.rows[movedid] = row
+        self.typecodes[objid] = -1
+        self.count -= 1
+
+    def _evaluate_group(self, timertype, group, currtime):
+        # local wall-clock deadlines go through the same transition table as the timer classes
+        today = localzone.local_day(currtime)
+        match timertype:
+            case "Daily":
+                base = group.column("base")
+                return bracket(currtime, today, lambda period: localzone.to_utc_array(period*DAY + base))
+            case "Weekly":
+                base = group.column("base")
+                return bracket(currtime, (today + 3) // 7,
+                               lambda period: localzone.to_utc_array((period*7 - 3)*DAY + base))
+            case "Weekday":
+                mask = group.column("mask")
+                base = group.column("base")
+                weekstart = today - weekday(today)
+                last = np.full(group.size, np.iinfo(np.int64).min)
+                first = np.full(group.size, np.iinfo(np.int64).max)
+                for entry in range(7):
+                    selected = (mask >> entry) & 1 == 1
+                    daylast, daynext = bracket(currtime, 0, lambda weeks: localzone.to_utc_array(
+                        (weekstart + weeks*7 + entry)*DAY + base))
+                    last = np.where(selected, np.maximum(last, daylast), last)
+                    first = np.where(selected, np.minimum(first, daynext), first)
+                return last, first
+            case "Monthly":
+                day = group.column("day")
+                base = group.column("base")
+                year, month, _ = civil_from_days(today)
+
+                def period_deadline(period):
+                    newyear, newmonth = divmod(period, 12)
+                    return monthly_deadline(newyear + 1970, newmonth + 1, day, base)
+                return bracket(currtime, (year - 1970)*12 + month - 1, period_deadline)
+            case "Custom":
+                interval = group.column("interval")
+                last = periodic_last(currtime, group.column("start"), interval)
+                return last, last + interval
+            case "Once":
+                start = group.column("start")
+                return start, start
+            case "Rule":
+                # timers with the same rule have the same deadlines, each rule is evaluated once
+                rules, positions = np.unique(group.column("rule"), return_inverse=True)
+                deadlines = np.array([compile_rule(rule_texts[rule]).deadlines(currtime) for rule in rules.tolist()],
+                                     dtype=np.int64).reshape(-1, 2)
+                return deadlines[positions, 0], deadlines[positions, 1]
+
+    def _deadline_index(self, timertype, group, timestamps):
+        # deadline_index() of the timer classes for every row of the group at its own timestamp
+        match timertype:
+            case "Custom":
+                return (timestamps - group.column("start")) // group.column("interval")
+            case "Once":
+                return (timestamps >= group.column("start")).astype(np.int64)
+            case "Rule":
+                return np.fromiter((compile_rule(rule_texts[rule]).deadline_index(timestamp) for rule, timestamp
+                                    in zip(group.column("rule").tolist(), timestamps.tolist())),
+                                   dtype=np.int64, count=group.size)
+
+        base = group.column("base")
+        localday = localzone.to_local_array(timestamps) // DAY
+        match timertype:
+            case "Daily":
+                return localday - (localzone.to_utc_array(localday*DAY + base) > timestamps)
+            case "Weekly":
+                period = (localday + 3) // 7
+                return period - (localzone.to_utc_array((period*7 - 3)*DAY + base) > timestamps)
+            case "Weekday":
+                mask = group.column("mask")
+                weeks, today = np.divmod(localday + 3, 7)
+                index = weeks*mask_days[mask] + mask_days[mask & ((2 << today) - 1)]
+                selected = (mask >> today) & 1 == 1
+                return index - (selected & (localzone.to_utc_array(localday*DAY + base) > timestamps))
+            case "Monthly":
+                year, month, _ = civil_from_days(localday)
+                period = (year - 1970)*12 + month - 1
+                return period - (monthly_deadline(year, month, group.column("day"), base) > timestamps)
+
+    def backlog(self, currtime=None):
+        # returns (ids, backlog) arrays, same counts as the backlog() method of the timer classes
+        if currtime is None:
+            currtime = time_int()
+        ids, backlogs = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for timertype, group in self.groups.items():
+            if group.size == 0:
+                continue
+            lastclicked = group.lastclicked[:group.size]
+            clicked = lastclicked > 0
+            now = self._deadline_index(timertype, group, np.full(group.size, currtime, dtype=np.int64))
+            since = self._deadline_index(timertype, group, np.where(clicked, np.minimum(lastclicked, currtime), currtime))
+            # never completed tasks count once, every deadline but a future one-time deadline has passed
+            unclicked = now if timertype == "Once" else 1
+            ids.append(group.ids[:group.size])
+            backlogs.append(np.where(clicked, now - since, unclicked))
+        return np.concatenate(ids), np.concatenate(backlogs)
+
+    def evaluate(self, currtime=None):
+        # returns (ids, lastclicked, lastdeadline, nextdeadline) arrays for all timers
+        if currtime is None:
+            currtime = time_int()
+        ids, lastclicked, lastdeadlines, nextdeadlines = [], [], [], []
+        for timertype, group in self.groups.items():
+            if group.size == 0:
+                continue
+            last, nxt = self._evaluate_group(timertype, group, currtime)
+            ids.append(group.ids[:group.size])
+            lastclicked.append(group.lastclicked[:group.size])
+            lastdeadlines.append(last)
+            nextdeadlines.append(nxt)
+        if not ids:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty, empty
+        return np.concatenate(ids), np.concatenate(lastclicked), \
+            np.concatenate(lastdeadlines), np.concatenate(nextdeadlines)
+
+    def ordered(self, currtime=None, show_complete=False):
+        # ids sorted by remaining time, same order and filter as the task list
+        # returns list of (ID, lastdeadline, remaining seconds)
+        if currtime is None:
+            currtime = time_int()
+        ids, lastclicked, last, nxt = self.evaluate(currtime)
+        remaining = np.maximum(nxt - currtime, 0)
+        if not show_complete:
+            keep = lastclicked < last
+            ids, last, remaining = ids[keep], last[keep], remaining[keep]
+        order = np.lexsort((ids, remaining))
+        return list(zip(ids[order].tolist(), last[order].tolist(), remaining[order].tolist()))
+
+
+def schedule_rows(entries, currtime=None):
+    # core.SCHEDULE_COLUMNS values for a list of (timertype, args), deadlines evaluated in one batch
+    batch = DeadlineBatch()
+    for position, (timertype, args) in enumerate(entries):
+        batch.set_args(position, timertype, args)
+    ids, lastclicked, last, nxt = batch.evaluate(currtime)
+
+    lastdeadlines = np.empty(len(entries), dtype=np.int64)
+    nextdeadlines = np.empty(len(entries), dtype=np.int64)
+    lastdeadlines[ids] = last
+    nextdeadlines[ids] = nxt
+    return [(*schedule_fields(timertype, args), lastdeadline, nextdeadline)
+            for (timertype, args), lastdeadline, nextdeadline
+            in zip(entries, lastdeadlines.tolist(), nextdeadlines.tolist())]
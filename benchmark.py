@@ -0,0 +1,309 @@
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+from os import environ, makedirs
+from os.path import exists, join as joinpath
+from time import perf_counter
+
+import core
+import snapshot
+import storage
+from options import default_settings
+from batchdeadlines import DeadlineBatch, schedule_rows
+from deadlineindex import DeadlineIndex
+from timerstore import TimerStore
+from todolists import FIRST_PAGE
+from timerclasses import *
+
+# Benchmark suite for the scheduling hot paths on synthetic timers.db fixtures.
+#   python benchmark.py                                   # 1k, 10k and 100k timers
+#   python benchmark.py --sizes 1000,1000000 --output new.json --compare old.json
+# Widget benchmarks need a display, e.g. run under xvfb-run, and are skipped otherwise.
+# Results are written as JSON, --compare reports every timing that got slower than --threshold.
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+SAMPLE_SIZE = 10000  # timers per type used for the per-call deadline benchmarks
+SYNTHETIC_RULES = ("FREQ=MONTHLY;BYDAY=2TU;BYHOUR=18", "FREQ=MONTHLY;BYDAY=MO,TU,WE,TH,FR;BYSETPOS=-1;BYHOUR=17",
+                   "FREQ=WEEKLY;INTERVAL=3;BYDAY=MO,TH;BYHOUR=9;DTSTART=20220502",
+                   "FREQ=YEARLY;BYMONTH=2;BYMONTHDAY=29;BYHOUR=12", "FREQ=DAILY;BYDAY=MO,TU,WE,TH,FR;EXDATE=20221226")
+
+
+def synthetic_args(generator, timertype, currtime):
+    match timertype:
+        case "Daily":
+            return [generator.randrange(24), generator.randrange(60)]
+        case "Weekly":
+            return [generator.randrange(7), generator.randrange(24), generator.randrange(60)]
+        case "Weekday":
+            # working days, weekends and random sets
+            randomdays = sorted(generator.sample(range(7), generator.randint(1, 7)))
+            days = generator.choice(([0, 1, 2, 3, 4], [5, 6], randomdays))
+            return [days, generator.randrange(24), generator.randrange(60)]
+        case "Monthly":
+            # a third of them on days that need month-end clamping
+            day = generator.choice((generator.randint(1, 28), generator.randint(29, 31)))
+            return [day, generator.randrange(24), generator.randrange(60)]
+        case "Custom":
+            units = generator.choice(time_measurements)
+            return [currtime - generator.randrange(365*DAY), generator.randint(1, 48), units]
+        case "Once":
+            return [currtime + generator.randrange(-30*DAY, 90*DAY)]
+        case "Rule":
+            # a handful of rules shared by many timers, like real task lists
+            return [generator.choice(SYNTHETIC_RULES)]
+
+
+def synthetic_rows(count, seed=0):
+    # (type, comment, last clicked, args) rows with a mix of all timer types and completion states
+    generator = random.Random(seed)
+    currtime = time_int()
+    for number in range(count):
+        timertype = generator.choice(timertypes)
+        # never, just now or some time ago
+        lastclicked = generator.choice((0, currtime - generator.randrange(HOUR),
+                                        currtime - generator.randrange(90*DAY)))
+        yield timertype, f"Task {number}", lastclicked, synthetic_args(generator, timertype, currtime)
+
+
+def generate_fixture(path, count, seed=0, batchsize=10000):
+    database = storage.SqliteStorage(path)
+    rows = synthetic_rows(count, seed)
+    while True:
+        batch = [row for _, row in zip(range(batchsize), rows)]
+        if not batch:
+            break
+        schedules = schedule_rows([(timertype, args) for timertype, comment, lastclicked, args in batch])
+        database.add_timers([(timertype, comment, lastclicked, json.dumps(args))
+                             for timertype, comment, lastclicked, args in batch], schedules)
+        database.commit()
+    database.close()
+
+
+def fixture(directory, count, seed=0):
+    path = joinpath(directory, f"timers-{count}-{seed}.db")
+    if not exists(path):
+        print(f"Generating {path}", file=sys.stderr)
+        generate_fixture(path, count, seed)
+    return path
+
+
+def timed(function, repeat=1):
+    # best of repeat runs, the one least disturbed by the rest of the system
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def cold_start(backend, path):
+    # separate interpreter, so module imports are part of the measurement
+    script = ("import time; start = time.perf_counter(); import storage, core; "
+              f"database = storage.open_storage({backend!r}, {path!r}); "
+              "core.hydrate(database.load_timers()); database.load_settings(); "
+              "print(time.perf_counter() - start)")
+    return float(subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout)
+
+
+def bench_storage(path, backends, actions=100):
+    results = {}
+    for backend in backends:
+        database = storage.open_storage(backend, path)
+        results[f"{backend}.load_hydrate"] = timed(lambda: core.hydrate(database.load_timers()), 3)
+        results[f"{backend}.load_store"] = timed(lambda: TimerStore.load(database.load_timers()), 3)
+        # what a list without a snapshot loads before it is shown, see todolists.OpenList
+        results[f"{backend}.load_first_page"] = timed(lambda: TimerStore.load(database.urgent_timers(FIRST_PAGE)), 3)
+        counter = database.change_counter()
+        snapshotpath = snapshot.snapshot_path(path)
+        snapshot.save(TimerStore.load(database.load_timers()), snapshotpath, counter)
+        results[f"{backend}.load_snapshot"] = timed(lambda: snapshot.load(snapshotpath, counter), 3)
+        ids = [row[0] for row in database.due_timers(limit=actions)]
+
+        # per action latency of the GUI's click handler, restored afterwards
+        def click():
+            database.set_last_clicked(random.choice(ids), time_int())
+            database.commit()
+        results[f"{backend}.click_commit"] = timed(lambda: [click() for _ in range(actions)]) / actions
+        for objid in ids:
+            database.set_last_clicked(objid, 0)
+        database.commit()
+        database.close()
+
+        results[f"{backend}.cold_start"] = cold_start(backend, path)
+    return results
+
+
+def bench_deadlines(timers):
+    # seconds per single call, per timer type
+    currtime = time_int()
+    results = {}
+    for timertype in timertypes:
+        sample = [timer for kind, timer in timers.values() if kind == timertype][:SAMPLE_SIZE]
+        if not sample:
+            continue
+        for method in ("nextdeadline", "lastdeadline", "remaining_delta"):
+            calls = [getattr(timer, method) for timer in sample]
+            results[f"{timertype}.{method}"] = timed(lambda: [call(currtime) for call in calls], 3) / len(sample)
+        remaining = timed(lambda: [timer.remaining_str() for timer in sample], 3)
+        results[f"{timertype}.remaining_str"] = remaining / len(sample)
+    return results
+
+
+def bench_populate(timers, store):
+    currtime = time_int()
+    results = {}
+
+    def legacy():
+        # the original sort and filter of populate()
+        sortedtimers = sorted(timers.items(), key=lambda x: x[1][1].remaining_delta(currtime))
+        return [x for x in sortedtimers if x[1][1].lastclicked < x[1][1].lastdeadline(currtime)]
+    results["legacy_sort_filter"] = timed(legacy, 3)
+
+    results["batch.build"] = timed(lambda: DeadlineBatch(timers))
+    batch = DeadlineBatch(timers)
+    results["batch.ordered"] = timed(lambda: batch.ordered(currtime), 5)
+
+    results["index.build"] = timed(lambda: DeadlineIndex(store, currtime))
+    index = DeadlineIndex(store, currtime)
+    results["index.ordered"] = timed(lambda: index.ordered(currtime), 5)
+    entries = index.ordered(currtime, True)
+    results["index.by_backlog"] = timed(lambda: index.by_backlog(entries, currtime), 5)
+    # one simulated hour of refresh ticks, only rolled over timers are re-keyed
+    results["index.refresh_hour"] = timed(lambda: [index.refresh(currtime + minute*MINUTE) for minute in range(60)])
+    return results
+
+
+def bench_widgets(store):
+    if not environ.get("DISPLAY") and sys.platform.startswith("linux"):
+        return {"skipped": "no display, run under xvfb-run"}
+    from tkinter import Tk, PhotoImage
+    from tasklist import TaskList
+
+    window = Tk()
+    window.geometry("300x350")
+    images = {f"{name}{size}": PhotoImage(width=16, height=16)
+              for name in ("check", "cross", "trash", "edit") for size in ("", "32")}
+    index = DeadlineIndex(store)
+
+    def describe(entry):
+        objid, lastdeadline, nextdeadline = entry
+        timer = store[objid]
+        return objid, timer.comment, timer.remaining_str(max(0, nextdeadline - time_int())), False, ""
+
+    noop = lambda objid: None
+    tasklist = TaskList(window, images, dict(default_settings), describe, noop, noop, noop, noop)
+    tasklist.pack(fill="both", expand=True)
+    window.update()
+
+    def render():
+        tasklist.render(index.ordered(show_complete=True))
+        window.update_idletasks()
+
+    def scroll():
+        tasklist.scroll("scroll", 1, "pages")
+        window.update_idletasks()
+
+    results = {"first_render": timed(render), "render": timed(render, 10),
+               "scroll_page": timed(lambda: [scroll() for _ in range(20)]) / 20}
+    window.destroy()
+    return results
+
+
+def run_suite(sizes, backends, directory, seed):
+    results = {}
+    for count in sizes:
+        path = fixture(directory, count, seed)
+        print(f"Benchmarking {count} timers", file=sys.stderr)
+        results[str(count)] = {"storage": bench_storage(path, backends)}
+
+        database = storage.SqliteStorage(path)
+        rows = database.load_timers()
+        database.close()
+        timers = core.hydrate(rows)
+        store = TimerStore.load(rows)
+        results[str(count)]["deadlines"] = bench_deadlines(timers)
+        results[str(count)]["populate"] = bench_populate(timers, store)
+        results[str(count)]["widgets"] = bench_widgets(store)
+    return results
+
+
+def flatten(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}/")
+        elif isinstance(value, float):
+            yield f"{prefix}{key}", value
+
+
+def compare(old, new, threshold):
+    # returns list of (name, old seconds, new seconds) that got slower by more than threshold
+    oldvalues = dict(flatten(old["results"]))
+    regressions = []
+    for name, value in flatten(new["results"]):
+        if name in oldvalues and oldvalues[name] > 0 and value > oldvalues[name] * (1 + threshold):
+            regressions.append((name, oldvalues[name], value))
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scheduling hot paths on synthetic databases.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="comma separated timer counts")
+    parser.add_argument("--backends", default="sqlite,orm", help="storage backends for the load benchmarks")
+    parser.add_argument("--fixtures", help="directory to keep generated databases in (default: temporary)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown ratio (default: %(default)s)")
+    options = parser.parse_args()
+
+    sizes = [int(size) for size in options.sizes.split(",")]
+    backends = [backend for backend in options.backends.split(",") if backend]
+
+    if options.fixtures:
+        makedirs(options.fixtures, exist_ok=True)
+        results = run_suite(sizes, backends, options.fixtures, options.seed)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            results = run_suite(sizes, backends, directory, options.seed)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": options.seed,
+        "results": results
+    }
+
+    for name, value in flatten(results):
+        print(f"{name:60}{value*1000:>12.3f}ms")
+
+    if options.output:
+        with open(options.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    if options.compare:
+        with open(options.compare) as source:
+            regressions = compare(json.load(source), report, options.threshold)
+        for name, oldvalue, newvalue in regressions:
+            print(f"REGRESSION {name}: {oldvalue*1000:.3f}ms -> {newvalue*1000:.3f}ms", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
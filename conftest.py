@@ -0,0 +1,87 @@
+import time
+from time import localtime
+
+import pytest
+
+import batchdeadlines
+import recurrence
+import timerclasses
+from timerclasses import DAY, time_measurements
+from tztable import MAX_OFFSET, TransitionTable
+
+# Shared by the test_*.py modules: time zones to run the date arithmetic in, localtime() based
+# answers to check it against, and random timers. Run the tests with python -m pytest.
+
+# DST at night, at midnight, by 30 minutes, and none
+ZONES = ("Europe/Berlin", "America/New_York", "America/Santiago", "Australia/Lord_Howe", "Asia/Kolkata", "UTC")
+START = 1609459200  # 2021-01-01 UTC
+END = 1798761600  # 2027-01-01 UTC
+
+
+@pytest.fixture(params=ZONES)
+def zone(request, monkeypatch):
+    # the process runs in the zone for the test, tables built before keep the zone they were built for
+    monkeypatch.setenv("TZ", request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.fixture
+def zonetables(zone, monkeypatch):
+    # a transition table for the zone in every module converting local times, no rules compiled for another zone
+    table = TransitionTable()
+    for module in (timerclasses, batchdeadlines, recurrence):
+        monkeypatch.setattr(module, "localzone", table)
+    recurrence.compile_rule.cache_clear()
+    yield zone
+    recurrence.compile_rule.cache_clear()
+
+
+def brute_to_utc(local):
+    # the first UTC timestamp showing local on the clock, times skipped by a change resolve with the offset before it
+    # a timestamp showing local is less than a day away from it, so it has one of the offsets sampled here
+    offsets = {localtime(local + delta).tm_gmtoff for delta in (-MAX_OFFSET, 0, MAX_OFFSET)}
+    matches = [local - offset for offset in offsets if localtime(local - offset).tm_gmtoff == offset]
+    if matches:
+        return min(matches)
+    return local - localtime(local - MAX_OFFSET).tm_gmtoff
+
+
+def transitions(start=START, end=END):
+    # the second every offset change in [start, end) starts at
+    changes = []
+    previous = localtime(start).tm_gmtoff
+    for ts in range(start, end, 60*60):
+        if localtime(ts).tm_gmtoff != previous:
+            low = ts - 60*60
+            while ts - low > 1:
+                middle = (low + ts) // 2
+                if localtime(middle).tm_gmtoff == previous:
+                    low = middle
+                else:
+                    ts = middle
+            changes.append(ts)
+            previous = localtime(ts).tm_gmtoff
+    return changes
+
+
+def random_args(rng, timertype, around):
+    # argument list of a random timer with deadlines near the timestamp around
+    match timertype:
+        case "Daily":
+            return [rng.randrange(24), rng.randrange(60)]
+        case "Weekly":
+            return [rng.randrange(7), rng.randrange(24), rng.randrange(60)]
+        case "Weekday":
+            return [sorted(rng.sample(range(7), rng.randint(1, 7))), rng.randrange(24), rng.randrange(60)]
+        case "Monthly":
+            return [rng.randint(1, 31), rng.randrange(24), rng.randrange(60)]
+        case "Custom":
+            return [rng.randrange(around - 100*DAY, around + 100*DAY), rng.randint(1, 50), rng.choice(time_measurements)]
+        case "Once":
+            return [rng.randrange(around - 100*DAY, around + 400*DAY)]
+        case "Rule":
+            return [rng.choice(["FREQ=DAILY;BYHOUR=9", "FREQ=MONTHLY;BYDAY=2TU;BYHOUR=10", "FREQ=WEEKLY;BYDAY=MO,TH",
+                                "FREQ=MONTHLY;BYMONTHDAY=-1;BYHOUR=2;BYMINUTE=30"])]
@@ -0,0 +1,414 @@
+import hashlib
+import json
+import re
+
+import recurrence
+from timerclasses import *
+
+# GUI-free core: timer construction, input validation and the timers.db schema
+# created by db.py. Safe to import without a display and without paying for
+# SQLAlchemy, used by the command line interface and storage backends.
+
+DATABASE = "timers.db"
+DATE_FORMAT = "%Y-%m-%d %H:%M"
+
+# typed copies of the schedule in the Data column plus the materialized deadlines,
+# recomputed by schedule_values() whenever a row is written or its deadline passed
+SCHEDULE_COLUMNS = ("Hour", "Minute", "Day", "Weekday_Mask", "Start_Time", "Interval",
+                    "Last_Deadline", "Next_Deadline")
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS "Timers" (
+        id INTEGER NOT NULL,
+        "Type" VARCHAR,
+        "Comment" VARCHAR,
+        "Last_Clicked" INTEGER,
+        "Data" VARCHAR,
+        "Hour" INTEGER,
+        "Minute" INTEGER,
+        "Day" INTEGER,
+        "Weekday_Mask" INTEGER,
+        "Start_Time" INTEGER,
+        "Interval" INTEGER,
+        "Last_Deadline" INTEGER,
+        "Next_Deadline" INTEGER,
+        "Tags" VARCHAR,
+        "Uid" VARCHAR,
+        "Def_Stamp" INTEGER,
+        "Click_Stamp" INTEGER,
+        "Seq" INTEGER,
+        PRIMARY KEY (id))""",
+    """CREATE TABLE IF NOT EXISTS "Settings" (
+        "Name" VARCHAR NOT NULL,
+        "Value" BOOLEAN,
+        "Stamp" INTEGER,
+        "Seq" INTEGER,
+        PRIMARY KEY ("Name"))""",
+    # append-only log of completions, never read back by the program itself
+    """CREATE TABLE IF NOT EXISTS "History" (
+        id INTEGER NOT NULL,
+        "Timer" INTEGER NOT NULL,
+        "Clicked" INTEGER NOT NULL,
+        "Deadline" INTEGER NOT NULL,
+        "Missed" INTEGER NOT NULL,
+        PRIMARY KEY (id))""",
+    # per timer aggregates of the history, updated in place on every completion
+    """CREATE TABLE IF NOT EXISTS "Stats" (
+        "Timer" INTEGER NOT NULL,
+        "Completions" INTEGER NOT NULL,
+        "On_Time" INTEGER NOT NULL,
+        "Streak" INTEGER NOT NULL,
+        "Best_Streak" INTEGER NOT NULL,
+        "Lateness_Sum" INTEGER NOT NULL,
+        PRIMARY KEY ("Timer"))"""
+)
+
+INDEXES = (
+    'CREATE INDEX IF NOT EXISTS "ix_Timers_Last_Deadline" ON "Timers" ("Last_Deadline")',
+    'CREATE INDEX IF NOT EXISTS "ix_Timers_Next_Deadline" ON "Timers" ("Next_Deadline")'
+)
+
+# full-text index over comments and tags, external content read from Timers and kept in sync by triggers
+# on every write to the two columns, whichever program or backend makes it
+SEARCH_SCHEMA = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS "Search" USING fts5("Comment", "Tags", content="Timers", content_rowid="id")',
+    """CREATE TRIGGER IF NOT EXISTS "Search_Insert" AFTER INSERT ON "Timers" BEGIN
+        INSERT INTO "Search" (rowid, "Comment", "Tags") VALUES (new.id, new."Comment", new."Tags");
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS "Search_Delete" AFTER DELETE ON "Timers" BEGIN
+        INSERT INTO "Search" ("Search", rowid, "Comment", "Tags") VALUES ('delete', old.id, old."Comment", old."Tags");
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS "Search_Update" AFTER UPDATE OF "Comment", "Tags" ON "Timers" BEGIN
+        INSERT INTO "Search" ("Search", rowid, "Comment", "Tags") VALUES ('delete', old.id, old."Comment", old."Tags");
+        INSERT INTO "Search" (rowid, "Comment", "Tags") VALUES (new.id, new."Comment", new."Tags");
+    END"""
+)
+SEARCH = 'SELECT rowid FROM "Search" WHERE "Search" MATCH ?'
+
+# counter of changes to the timer data the GUI keeps in memory (deadline columns don't count),
+# bumped by triggers for every changed row, validates the startup snapshot (snapshot.py)
+CHANGES_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS "Meta" (
+        "Name" VARCHAR NOT NULL,
+        "Value" INTEGER,
+        PRIMARY KEY ("Name"))""",
+    'INSERT OR IGNORE INTO "Meta" ("Name", "Value") VALUES (\'changes\', 0)',
+    """CREATE TRIGGER IF NOT EXISTS "Changes_Insert" AFTER INSERT ON "Timers" BEGIN
+        UPDATE "Meta" SET "Value" = "Value" + 1 WHERE "Name" = 'changes';
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS "Changes_Delete" AFTER DELETE ON "Timers" BEGIN
+        UPDATE "Meta" SET "Value" = "Value" + 1 WHERE "Name" = 'changes';
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS "Changes_Update" AFTER UPDATE OF "Type", "Comment", "Last_Clicked", "Data"
+        ON "Timers" BEGIN
+        UPDATE "Meta" SET "Value" = "Value" + 1 WHERE "Name" = 'changes';
+    END"""
+)
+SELECT_CHANGES = 'SELECT "Value" FROM "Meta" WHERE "Name" = \'changes\''
+# a no-op write taking the database write lock, so the counter can't change until the commit
+LOCK_CHANGES = 'UPDATE "Meta" SET "Value" = "Value" WHERE "Name" = \'changes\''
+
+# version stamps for syncing between machines (sync.py), kept up to date by triggers on every write:
+# Uid = ID of a timer on every machine, Def_Stamp and Click_Stamp = stamps of the last change to the
+# definition (type, comment, data) and to Last_Clicked, Seq = value of the "seq" counter in Meta at the
+# last local change, "todo.py sync" sends everything above the "exported" value. Deleted timers leave
+# a row in "Deleted". Stamps are milliseconds << 16 | low bits of the machine ID, unique and ordered.
+SYNC_COLUMNS = (("Timers", "Uid", "VARCHAR"), ("Timers", "Def_Stamp", "INTEGER"), ("Timers", "Click_Stamp", "INTEGER"),
+                ("Timers", "Seq", "INTEGER"), ("Settings", "Stamp", "INTEGER"), ("Settings", "Seq", "INTEGER"))
+STAMP_NOW = ("((CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER) << 16)"
+             " | ((SELECT \"Value\" FROM \"Meta\" WHERE \"Name\" = 'machine') & 65535))")
+NEXT_SEQ = 'UPDATE "Meta" SET "Value" = "Value" + 1 WHERE "Name" = \'seq\''
+CURRENT_SEQ = '(SELECT "Value" FROM "Meta" WHERE "Name" = \'seq\')'
+SYNC_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS "Deleted" (
+        "Uid" VARCHAR NOT NULL,
+        "Stamp" INTEGER,
+        "Seq" INTEGER,
+        PRIMARY KEY ("Uid"))""",
+    # bytes of every other machine's change file that were already imported
+    """CREATE TABLE IF NOT EXISTS "Sync_Peers" (
+        "File" VARCHAR NOT NULL,
+        "Offset" INTEGER,
+        PRIMARY KEY ("File"))""",
+    "INSERT OR IGNORE INTO \"Meta\" (\"Name\", \"Value\") VALUES ('machine', random() & 4611686018427387903)",
+    'INSERT OR IGNORE INTO "Meta" ("Name", "Value") VALUES (\'seq\', 1)',
+    'INSERT OR IGNORE INTO "Meta" ("Name", "Value") VALUES (\'exported\', 0)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS "ix_Timers_Uid" ON "Timers" ("Uid")',
+    'CREATE INDEX IF NOT EXISTS "ix_Timers_Seq" ON "Timers" ("Seq")',
+    'CREATE INDEX IF NOT EXISTS "ix_Deleted_Seq" ON "Deleted" ("Seq")',
+    f"""CREATE TRIGGER IF NOT EXISTS "Sync_Insert" AFTER INSERT ON "Timers" BEGIN
+        {NEXT_SEQ};
+        UPDATE "Timers" SET "Uid" = COALESCE(new."Uid", lower(hex(randomblob(16)))), "Def_Stamp" = {STAMP_NOW},
+            "Click_Stamp" = {STAMP_NOW}, "Seq" = {CURRENT_SEQ} WHERE id = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS "Sync_Definition" AFTER UPDATE OF "Type", "Comment", "Data" ON "Timers"
+        WHEN new."Type" IS NOT old."Type" OR new."Comment" IS NOT old."Comment" OR new."Data" IS NOT old."Data" BEGIN
+        {NEXT_SEQ};
+        UPDATE "Timers" SET "Def_Stamp" = MAX(COALESCE(old."Def_Stamp", 0) + 1, {STAMP_NOW}), "Seq" = {CURRENT_SEQ}
+            WHERE id = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS "Sync_Clicked" AFTER UPDATE OF "Last_Clicked" ON "Timers"
+        WHEN new."Last_Clicked" IS NOT old."Last_Clicked" BEGIN
+        {NEXT_SEQ};
+        UPDATE "Timers" SET "Click_Stamp" = MAX(COALESCE(old."Click_Stamp", 0) + 1, {STAMP_NOW}), "Seq" = {CURRENT_SEQ}
+            WHERE id = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS "Sync_Delete" AFTER DELETE ON "Timers" BEGIN
+        {NEXT_SEQ};
+        INSERT OR REPLACE INTO "Deleted" ("Uid", "Stamp", "Seq") VALUES (old."Uid", {STAMP_NOW}, {CURRENT_SEQ});
+    END""",
+    # inserted settings are defaults and stay at stamp 0, only changes are synced
+    f"""CREATE TRIGGER IF NOT EXISTS "Sync_Setting" AFTER UPDATE OF "Value" ON "Settings"
+        WHEN new."Value" IS NOT old."Value" BEGIN
+        {NEXT_SEQ};
+        UPDATE "Settings" SET "Stamp" = MAX(COALESCE(old."Stamp", 0) + 1, {STAMP_NOW}), "Seq" = {CURRENT_SEQ}
+            WHERE "Name" = new."Name";
+    END"""
+)
+
+TAG_PATTERN = re.compile(r"#(\w+)")
+
+UPDATE_SCHEDULE = ('UPDATE "Timers" SET ' + ", ".join(f'"{column}" = ?' for column in SCHEDULE_COLUMNS)
+                   + ' WHERE id = ?')
+
+
+def make_timer(timertype, comment, lastclicked, args):
+    return timerclass_dict[timertype](comment, lastclicked, args)
+
+
+def hydrate(rows):
+    # rows = iterable of (ID, type, comment, last clicked, JSON data)
+    timers = {}  # ID: [timertype, object]
+    for objid, timertype, comment, lastclicked, data in rows:
+        timers[objid] = [timertype, make_timer(timertype, comment, lastclicked, json.loads(data))]
+    return timers
+
+
+def schedule_fields(timertype, args):
+    # typed schedule columns, the ones that don't apply to the timer type stay NULL
+    hour = minute = day = mask = start = interval = None
+    match timertype:
+        case "Daily":
+            hour, minute = args
+        case "Weekly" | "Monthly":
+            day, hour, minute = args
+        case "Weekday":
+            mask = sum(1 << entry for entry in args[0])
+            hour, minute = args[1], args[2]
+        case "Custom":
+            start, interval = args[0], args[1] * unit_seconds[args[2]]
+        case "Once":
+            start = args[0]
+    return hour, minute, day, mask, start, interval
+
+
+def schedule_values(timertype, data, currtime=None):
+    # values for SCHEDULE_COLUMNS
+    args = json.loads(data)
+    timer = make_timer(timertype, "", 0, args)
+    return (*schedule_fields(timertype, args), timer.lastdeadline(currtime), timer.nextdeadline(currtime))
+
+
+def completion(timertype, timer, clicked):
+    # (deadline, missed deadlines) of completing timer at clicked for the History table,
+    # None if it was already completed since its last deadline
+    # recurring tasks become due at a deadline and miss every following one,
+    # a one-time task misses its only deadline by being completed after it
+    backlog = timer.backlog(clicked)
+    if timertype == "Once":
+        return timer.lastdeadline(clicked), backlog
+    if backlog == 0:
+        return None
+    return timer.lastdeadline(clicked), backlog - 1
+
+
+def stats_summary(completions, ontime, streak, beststreak, latenesssum):
+    # Stats row values -> (completions, share completed on time, streak, best streak, mean lateness in seconds)
+    # the lateness sum only holds the completions that weren't on time, it is averaged over those,
+    # None if there were none
+    if completions == 0:
+        return 0, 0.0, streak, beststreak, None
+    late = completions - ontime
+    return completions, ontime / completions, streak, beststreak, latenesssum // late if late else None
+
+
+def shift_args(timertype, args, delta):
+    # argument list with the deadlines moved by delta seconds
+    # times of day wrap around within their day or week, Monthly days stay within 1-31, Rule days stay the same
+    match timertype:
+        case "Custom" | "Once":
+            return [max(0, args[0] + delta), *args[1:]]
+        case "Daily":
+            base = (args[0]*HOUR + args[1]*MINUTE + delta) % DAY
+            return [base // HOUR, base % HOUR // MINUTE]
+        case "Weekly":
+            base = (args[0]*DAY + args[1]*HOUR + args[2]*MINUTE + delta) % WEEK
+            return [base // DAY, base % DAY // HOUR, base % HOUR // MINUTE]
+        case "Weekday":
+            moved = [(day*DAY + args[1]*HOUR + args[2]*MINUTE + delta) % WEEK for day in args[0]]
+            base = moved[0] % DAY
+            return [sorted(entry // DAY for entry in moved), base // HOUR, base % HOUR // MINUTE]
+        case "Monthly":
+            total = min(max((args[0] - 1)*DAY + args[1]*HOUR + args[2]*MINUTE + delta, 0), 31*DAY - MINUTE)
+            base = total % DAY
+            return [total // DAY + 1, base // HOUR, base % HOUR // MINUTE]
+        case "Rule":
+            return [recurrence.shift_rule(args[0], delta)]
+
+
+def comment_tags(comment):
+    # "#tags" of a comment for the Tags column, lowercase, without "#", space separated
+    return " ".join(sorted({tag.lower() for tag in TAG_PATTERN.findall(comment or "")}))
+
+
+def search_query(text):
+    # FTS5 query for search box text: every word is a prefix match on comments and tags,
+    # "#tag" only matches tags, all words have to match
+    terms = []
+    for word in text.split():
+        if word.startswith("#"):
+            tag = word[1:].replace('"', '""')
+            if tag:
+                terms.append(f'"Tags" : "{tag}"')
+        else:
+            terms.append('"{}" *'.format(word.replace('"', '""')))
+    return " AND ".join(terms)
+
+
+def upgrade_schema(cursor):
+    # adds the schedule columns, tags, indexes and the search index to databases created before they existed
+    existing = {row[1] for row in cursor.execute('PRAGMA table_info("Timers")')}
+    for column in SCHEDULE_COLUMNS:
+        if column not in existing:
+            cursor.execute(f'ALTER TABLE "Timers" ADD COLUMN "{column}" INTEGER')
+    if "Tags" not in existing:
+        cursor.execute('ALTER TABLE "Timers" ADD COLUMN "Tags" VARCHAR')
+    for statement in INDEXES:
+        cursor.execute(statement)
+
+    currtime = time_int()
+    rows = cursor.execute('SELECT id, "Type", "Data" FROM "Timers" WHERE "Next_Deadline" IS NULL').fetchall()
+    cursor.executemany(UPDATE_SCHEDULE, [(*schedule_values(timertype, data, currtime), objid)
+                                         for objid, timertype, data in rows])
+    rows = cursor.execute('SELECT id, "Comment" FROM "Timers" WHERE "Tags" IS NULL').fetchall()
+    cursor.executemany('UPDATE "Timers" SET "Tags" = ? WHERE id = ?',
+                       [(comment_tags(comment), objid) for objid, comment in rows])
+
+    for statement in CHANGES_SCHEMA:
+        cursor.execute(statement)
+
+    for table, column, columntype in SYNC_COLUMNS:
+        if column not in {row[1] for row in cursor.execute(f'PRAGMA table_info("{table}")')}:
+            cursor.execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {columntype}')
+    # timers from before sync get their Uid from their content, so copies of the same database agree on it
+    rows = cursor.execute('SELECT id, "Type", "Comment", "Data" FROM "Timers" WHERE "Uid" IS NULL').fetchall()
+    cursor.executemany('UPDATE "Timers" SET "Uid" = ?, "Def_Stamp" = 0, "Click_Stamp" = 0, "Seq" = 1 WHERE id = ?',
+                       [(legacy_uid(*row), row[0]) for row in rows])
+    for statement in SYNC_SCHEMA:
+        cursor.execute(statement)
+
+    indexed = cursor.execute('SELECT 1 FROM sqlite_master WHERE name = \'Search\'').fetchone()
+    for statement in SEARCH_SCHEMA:
+        cursor.execute(statement)
+    if not indexed:
+        cursor.execute('INSERT INTO "Search" ("Search") VALUES (\'rebuild\')')
+
+
+def legacy_uid(objid, timertype, comment, data):
+    return hashlib.sha1(f"{objid}\0{timertype}\0{comment}\0{data}".encode()).hexdigest()[:32]
+
+
+def check_range(value, unit, rangemin, rangemax):
+    # rangemax = -1 means no upper bound
+    if rangemax == -1:
+        if value < rangemin:
+            raise ValueError(f"Reset {unit} needs to be at least {rangemin}")
+    else:
+        if value not in range(rangemin, rangemax+1):
+            raise ValueError(f"Reset {unit} value outside of {rangemin}-{rangemax} range")
+    return value
+
+
+def check_number(value, unit, rangemin, rangemax):
+    if len(value) > 0:
+        for char in value:
+            if char not in "0123456789":
+                raise ValueError(f"Non-number value in reset {unit} field.")
+
+        return check_range(int(value), unit, rangemin, rangemax)
+    else:
+        raise ValueError(f"No argument for reset {unit}")
+
+
+def validate_args(timertype, args):
+    # checks a decoded Data column with the same rules as the entry window, raises ValueError
+    if timertype not in timerclass_dict:
+        raise ValueError(f"Unknown timer type \"{timertype}\"")
+    if not isinstance(args, list | tuple):
+        raise ValueError("Timer data has to be a list")
+
+    def number(value, unit, rangemin, rangemax):
+        if type(value) is not int:
+            raise ValueError(f"Non-number value in reset {unit} field.")
+        return check_range(value, unit, rangemin, rangemax)
+
+    expected = {"Daily": 2, "Weekly": 3, "Weekday": 3, "Monthly": 3, "Custom": 3, "Once": 1, "Rule": 1}[timertype]
+    if len(args) != expected:
+        raise ValueError(f"{timertype} timer needs {expected} data values, got {len(args)}")
+
+    match timertype:
+        case "Daily":
+            number(args[0], "hour", 0, 23)
+            number(args[1], "minute", 0, 59)
+        case "Weekly":
+            number(args[0], "weekday", 0, 6)
+            number(args[1], "hour", 0, 23)
+            number(args[2], "minute", 0, 59)
+        case "Weekday":
+            if not isinstance(args[0], list) or len(args[0]) == 0:
+                raise ValueError("Not a single weekday was selected.")
+            for entry in args[0]:
+                number(entry, "weekday", 0, 6)
+            number(args[1], "hour", 0, 23)
+            number(args[2], "minute", 0, 59)
+        case "Monthly":
+            number(args[0], "day", 1, 31)
+            number(args[1], "hour", 0, 23)
+            number(args[2], "minute", 0, 59)
+        case "Custom":
+            number(args[0], "start time", 0, -1)
+            number(args[1], "interval", 1, -1)
+            if args[2] not in time_measurements:
+                raise ValueError(f"Unknown interval unit \"{args[2]}\"")
+        case "Once":
+            number(args[0], "end time", 0, -1)
+        case "Rule":
+            if not isinstance(args[0], str):
+                raise ValueError("Recurrence rule has to be text")
+            recurrence.compile_rule(args[0])
+    return args
+
+
+def parse_date(text, description="date"):
+    try:
+        return int(datetime.strptime(text, DATE_FORMAT).timestamp())
+    except ValueError:
+        raise ValueError(f"Invalid {description} format\nExample: {datetime.strftime(now(), DATE_FORMAT)}")
+
+
+def parse_duration(text):
+    # "90m", "2h", "1d12h" -> seconds
+    units = {"d": DAY, "h": HOUR, "m": MINUTE, "s": 1}
+    total = 0
+    number = ""
+    for char in text.strip().lower():
+        if char.isdigit():
+            number += char
+        elif char in units and number:
+            total += int(number) * units[char]
+            number = ""
+        else:
+            raise ValueError(f"Invalid duration \"{text}\", use e.g. 90m, 2h or 1d12h")
+    if number:
+        raise ValueError(f"Missing unit in duration \"{text}\", use e.g. 90m, 2h or 1d12h")
+    return total
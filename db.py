@@ -1,6 +1,8 @@
 from sqlalchemy import Column, Integer, String, Boolean, create_engine
 from sqlalchemy.ext.declarative import declarative_base
 
+from core import schedule_values, comment_tags
+
 Base = declarative_base()
 
 
@@ -11,24 +13,77 @@ class Timers(Base):
     comment = Column("Comment", String)
     last_clicked = Column("Last_Clicked", Integer)
     data = Column("Data", String)
+    # derived from type and data, see core.SCHEDULE_COLUMNS
+    hour = Column("Hour", Integer)
+    minute = Column("Minute", Integer)
+    day = Column("Day", Integer)
+    weekday_mask = Column("Weekday_Mask", Integer)
+    start_time = Column("Start_Time", Integer)
+    interval = Column("Interval", Integer)
+    last_deadline = Column("Last_Deadline", Integer, index=True)
+    next_deadline = Column("Next_Deadline", Integer, index=True)
+    tags = Column("Tags", String)  # "#tags" of the comment, see core.comment_tags
+    # sync version stamps, only ever written by the triggers in core.SYNC_SCHEMA and by sync.py
+    uid = Column("Uid", String)
+    def_stamp = Column("Def_Stamp", Integer)
+    click_stamp = Column("Click_Stamp", Integer)
+    seq = Column("Seq", Integer)
 
     def __init__(self, type, comment, last_clicked, data):
         self.type = type
         self.comment = comment
         self.last_clicked = last_clicked
         self.data = data
+        self.update_schedule()
+
+    def update_schedule(self, currtime=None):
+        # derived columns, the schedule from type and data and the tags from the comment
+        self.tags = comment_tags(self.comment)
+        (self.hour, self.minute, self.day, self.weekday_mask, self.start_time, self.interval,
+         self.last_deadline, self.next_deadline) = schedule_values(self.type, self.data, currtime)
 
 
 class Settings(Base):
     __tablename__ = "Settings"
     name = Column("Name", String, primary_key=True)
     value = Column("Value", Boolean)
+    stamp = Column("Stamp", Integer)
+    seq = Column("Seq", Integer)
 
     def __init__(self, name, value):
         self.name = name
         self.value = value
 
 
+class History(Base):
+    __tablename__ = "History"
+    id = Column(Integer, primary_key=True)
+    timer = Column("Timer", Integer, nullable=False)
+    clicked = Column("Clicked", Integer, nullable=False)
+    deadline = Column("Deadline", Integer, nullable=False)
+    missed = Column("Missed", Integer, nullable=False)
+
+    def __init__(self, timer, clicked, deadline, missed):
+        self.timer = timer
+        self.clicked = clicked
+        self.deadline = deadline
+        self.missed = missed
+
+
+class Stats(Base):
+    __tablename__ = "Stats"
+    timer = Column("Timer", Integer, primary_key=True)
+    completions = Column("Completions", Integer, nullable=False)
+    on_time = Column("On_Time", Integer, nullable=False)
+    streak = Column("Streak", Integer, nullable=False)
+    best_streak = Column("Best_Streak", Integer, nullable=False)
+    lateness_sum = Column("Lateness_Sum", Integer, nullable=False)
+
+    def __init__(self, timer):
+        self.timer = timer
+        self.completions = self.on_time = self.streak = self.best_streak = self.lateness_sum = 0
+
+
 def initialize_db():
     engine = create_engine("sqlite:///timers.db")
     Base.metadata.create_all(engine)
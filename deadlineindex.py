@@ -0,0 +1,169 @@
+from bisect import bisect_right, insort
+import numpy as np
+
+from timerclasses import *
+
+# Timers ordered by next deadline, kept in sync with the TimerStore it is built on.
+# Only timers whose deadline passed since the last refresh get re-keyed,
+# everything else keeps its position in the sorted list.
+# Timers completed for their current deadline are kept apart from the pending ones, clicks and
+# rollovers re-key them anyway, so the task list only walks the part it shows.
+
+# rebuild the whole index in one batch pass if at least this share of entries rolled over
+REBUILD_RATIO = 8
+
+
+class DeadlineIndex:
+    def __init__(self, timers, currtime=None):
+        # timers = TimerStore, its arrays are evaluated directly
+        self.timers = timers
+        self.entries = []  # sorted [(nextdeadline, ID)]
+        self.keys = {}  # ID: nextdeadline
+        self.lastdeadlines = {}  # ID: lastdeadline
+        self.pending = []  # sorted [(nextdeadline, ID)] of the timers not completed for their last deadline
+        self.completed = set()  # IDs of the others
+        self.rebuild(currtime)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def rebuild(self, currtime=None):
+        if currtime is None:
+            currtime = time_int()
+        ids, lastclicked, last, nxt = self.timers.evaluate(currtime)
+        order = np.lexsort((ids, nxt))
+        done = (lastclicked >= last)[order].tolist()
+        ids, last, nxt = ids[order].tolist(), last[order].tolist(), nxt[order].tolist()
+
+        self.entries = list(zip(nxt, ids))
+        self.keys = dict(zip(ids, nxt))
+        self.lastdeadlines = dict(zip(ids, last))
+        self.pending = [entry for entry, completed in zip(self.entries, done) if not completed]
+        self.completed = {objid for objid, completed in zip(ids, done) if completed}
+
+    def add_all(self, timers, currtime=None):
+        # adds every timer of a TimerStore that was merged into self.timers, one batch evaluation
+        # and a merge of two sorted runs instead of an insort per timer
+        if currtime is None:
+            currtime = time_int()
+        ids, lastclicked, last, nxt = timers.evaluate(currtime)
+        done = (lastclicked >= last).tolist()
+        ids, last, nxt = ids.tolist(), last.tolist(), nxt.tolist()
+        self.entries += sorted(zip(nxt, ids))
+        self.entries.sort()
+        self.keys.update(zip(ids, nxt))
+        self.lastdeadlines.update(zip(ids, last))
+        self.pending += sorted((key, objid) for key, objid, completed in zip(nxt, ids, done) if not completed)
+        self.pending.sort()
+        self.completed.update(objid for objid, completed in zip(ids, done) if completed)
+
+    def _remove(self, objid):
+        key = self.keys.pop(objid)
+        del self.lastdeadlines[objid]
+        position = bisect_right(self.entries, (key, objid)) - 1
+        del self.entries[position]
+        if objid in self.completed:
+            self.completed.remove(objid)
+        else:
+            del self.pending[bisect_right(self.pending, (key, objid)) - 1]
+
+    def _insert(self, objid, currtime):
+        timer = self.timers[objid].timer()
+        key = timer.nextdeadline(currtime)
+        self.keys[objid] = key
+        self.lastdeadlines[objid] = timer.lastdeadline(currtime)
+        insort(self.entries, (key, objid))
+        if timer.lastclicked >= self.lastdeadlines[objid]:
+            self.completed.add(objid)
+        else:
+            insort(self.pending, (key, objid))
+
+    def update(self, objid, currtime=None):
+        # call after adding, editing, clicking or unchecking timers[objid]
+        if currtime is None:
+            currtime = time_int()
+        if objid in self.keys:
+            self._remove(objid)
+        self._insert(objid, currtime)
+
+    def discard(self, objid):
+        # call after deleting timers[objid]
+        if objid in self.keys:
+            self._remove(objid)
+
+    def update_many(self, objids, currtime=None):
+        # update() for a whole selection, one batch rebuild if it is a large share of the index
+        if len(objids) * REBUILD_RATIO >= len(self.entries):
+            self.rebuild(currtime)
+            return
+        for objid in objids:
+            self.update(objid, currtime)
+
+    def discard_many(self, objids):
+        if len(objids) * REBUILD_RATIO >= len(self.entries):
+            self.rebuild()
+            return
+        for objid in objids:
+            self.discard(objid)
+
+    def refresh(self, currtime=None):
+        # re-key timers whose next deadline has passed
+        if currtime is None:
+            currtime = time_int()
+        expired = bisect_right(self.entries, (currtime, float("inf")))
+
+        # one-time timers keep their deadline forever, they just stay at the front
+        stale = [objid for key, objid in self.entries[:expired] if self.timers.timertype(objid) != "Once"]
+        if not stale:
+            return 0
+
+        if len(stale) * REBUILD_RATIO >= len(self.entries):
+            self.rebuild(currtime)
+        else:
+            self.entries[:expired] = [entry for entry in self.entries[:expired]
+                                      if self.timers.timertype(entry[1]) == "Once"]
+            expired = bisect_right(self.pending, (currtime, float("inf")))
+            self.pending[:expired] = [entry for entry in self.pending[:expired]
+                                      if self.timers.timertype(entry[1]) == "Once"]
+            for objid in stale:
+                del self.keys[objid]
+                self.completed.discard(objid)
+                self._insert(objid, currtime)
+        return len(stale)
+
+    def next_rollover(self, currtime=None):
+        # earliest deadline still in the future, None if there is none
+        if currtime is None:
+            currtime = time_int()
+        position = bisect_right(self.entries, (currtime, float("inf")))
+        if position < len(self.entries):
+            return self.entries[position][0]
+        return None
+
+    def ordered(self, currtime=None, show_complete=False, only=None):
+        # ids sorted by next deadline, filtered the same way as the task list
+        # only = set of IDs to restrict the result to, e.g. search results
+        # returns list of (ID, lastdeadline, nextdeadline)
+        if currtime is None:
+            currtime = time_int()
+        self.refresh(currtime)
+
+        entries = self.entries if show_complete else self.pending
+        if only is not None and len(only) < len(entries):
+            # a small subset is sorted on its own instead of walking the whole index
+            entries = sorted((self.keys[objid], objid) for objid in only
+                             if objid in self.keys and (show_complete or objid not in self.completed))
+        elif only is not None:
+            entries = [entry for entry in entries if entry[1] in only]
+
+        lastdeadlines = self.lastdeadlines
+        return [(objid, lastdeadlines[objid], key) for key, objid in entries]
+
+    def by_backlog(self, entries, currtime=None):
+        # entries returned by ordered() re-sorted by missed deadlines, most first,
+        # timers with the same count keep their deadline order
+        ids, backlog = self.timers.backlog(currtime)
+        counts = np.zeros(len(self.timers.typecodes), dtype=np.int64)
+        counts[ids] = backlog
+        keys = counts[[entry[0] for entry in entries]]
+        return [entries[position] for position in np.argsort(-keys, kind="stable").tolist()]
@@ -0,0 +1,134 @@
+import importlib.util
+import json
+import logging
+import subprocess
+import sys
+from collections import namedtuple
+from os import environ
+from shutil import which
+
+from timerclasses import *
+from timingwheel import TimingWheel
+
+# Fires callbacks when timer deadlines pass. Every timer is armed in a timing wheel
+# at its next deadline and re-armed at the following one after firing, so a
+# dispatch only touches the timers that actually became due.
+#   dispatcher = DueDispatcher(timers)
+#   dispatcher.register(lambda event: print(event.comment))
+#   dispatcher.dispatch()  # call at dispatcher.next_event() or later
+
+log = logging.getLogger(__name__)
+
+# missed = the task wasn't completed before this deadline
+DueEvent = namedtuple("DueEvent", ("objid", "timertype", "comment", "deadline", "missed"))
+
+
+class DueDispatcher:
+    def __init__(self, timers, currtime=None):
+        # timers = TimerStore
+        if currtime is None:
+            currtime = time_int()
+        self.timers = timers
+        self.callbacks = []
+        self.wheel = TimingWheel(currtime)
+        self.arm_all(timers, currtime)
+
+    def arm_all(self, timers, currtime=None):
+        # arms every timer of a TimerStore in one batch evaluation, e.g. a page of timers just added to self.timers
+        if currtime is None:
+            currtime = time_int()
+        ids, lastclicked, last, nxt = timers.evaluate(currtime)
+        for objid, deadline in zip(ids.tolist(), nxt.tolist()):
+            if deadline > currtime:
+                self.wheel.insert(objid, deadline)
+
+    def register(self, callback):
+        # callback(event) is called with a DueEvent for every passed deadline
+        self.callbacks.append(callback)
+
+    def arm(self, objid, currtime=None):
+        # call after adding or editing timers[objid]
+        if currtime is None:
+            currtime = time_int()
+        deadline = self.timers[objid].nextdeadline(currtime)
+        if deadline > currtime:
+            self.wheel.insert(objid, deadline)
+        else:
+            self.wheel.remove(objid)
+
+    def cancel(self, objid):
+        self.wheel.remove(objid)
+
+    def next_event(self):
+        # timestamp dispatch() should run at, None if no deadline is armed
+        return self.wheel.next_expiry()
+
+    def dispatch(self, currtime=None):
+        # fires callbacks for every deadline up to currtime, returns the events
+        if currtime is None:
+            currtime = time_int()
+        events = []
+        for objid, deadline in self.wheel.advance(currtime):
+            if objid not in self.timers:
+                continue
+            timer = self.timers.timer(objid)
+            timertype = self.timers.timertype(objid)
+            events.append(DueEvent(objid, timertype, timer.comment, deadline,
+                                   timer.lastclicked < timer.lastdeadline(deadline - 1)))
+            if timertype != "Once":
+                # deadlines missed while the program wasn't running are skipped, not fired in bulk
+                self.wheel.insert(objid, timer.nextdeadline(max(deadline, currtime)))
+
+        for event in events:
+            for callback in self.callbacks:
+                try:
+                    callback(event)
+                except Exception as error:
+                    log.warning(f"Deadline callback {callback!r} failed for id {event.objid}: {error}")
+        return events
+
+
+def event_environment(event):
+    # the event as TODO_* environment variables for shell hooks
+    return {**environ, "TODO_ID": str(event.objid), "TODO_TYPE": event.timertype, "TODO_COMMENT": event.comment,
+            "TODO_DEADLINE": str(event.deadline), "TODO_MISSED": "1" if event.missed else "0"}
+
+
+def shell_hook(command):
+    # callback running command through the shell without waiting for it
+    def run(event):
+        subprocess.Popen(command, shell=True, env=event_environment(event),
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+    return run
+
+
+def python_hook(spec):
+    # "module:function" or "path/to/file.py:function", imported once
+    location, separator, name = spec.rpartition(":")
+    if not separator or not location or not name:
+        raise ValueError(f"Invalid hook \"{spec}\", use module:function")
+    if location.endswith(".py"):
+        modulespec = importlib.util.spec_from_file_location("todo_due_hook", location)
+        module = importlib.util.module_from_spec(modulespec)
+        modulespec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(location)
+    return getattr(module, name)
+
+
+def desktop_notifier():
+    # callback showing a desktop notification with the platform's own tool, None if there is none
+    if sys.platform == "darwin" and which("osascript"):
+        def notify(title, text):
+            # AppleScript string literals escape quotes and backslashes the same way as JSON
+            script = f"display notification {json.dumps(text)} with title {json.dumps(title)}"
+            subprocess.Popen(["osascript", "-e", script])
+    elif which("notify-send"):
+        def notify(title, text):
+            subprocess.Popen(["notify-send", "--app-name=To-do list", title, text])
+    else:
+        return None
+
+    def callback(event):
+        notify("Deadline missed" if event.missed else "Deadline passed", event.comment)
+    return callback
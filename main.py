@@ -1,13 +1,21 @@
 from tkinter import *
-from tkinter import ttk, messagebox
-from os import listdir
+from tkinter import ttk, messagebox, simpledialog
+from os import listdir, makedirs
 from os.path import join as joinpath
-from sqlalchemy.orm import sessionmaker
+from itertools import islice
+from time import perf_counter
 import json
 import logging
 
-import db
+import agenda
+import core
+import perfstats
+import storage
+from writebehind import WriteBehind
 from timerclasses import *
+from todolists import ListCache, OpenList, DEFAULT_LIST, LISTS_DIRECTORY, list_names, check_list_name
+from dueevents import DueDispatcher, shell_hook, python_hook, desktop_notifier
+from tasklist import TaskList
 from options import *
 
 custom_formatter = logging.Formatter("%(asctime)s\t%(levelname)s\t%(message)s")
@@ -23,6 +31,11 @@ console_handler = logging.StreamHandler()
 console_handler.setFormatter(custom_formatter)
 log.addHandler(console_handler)
 
+# periodic performance records, goes through the handlers above regardless of the main log level
+stats_log = log.getChild("stats")
+stats_log.setLevel(logging.INFO)
+
+launched = perf_counter()
 log.info(f"Program launched")
 
 mainwindow = Tk()
@@ -30,12 +43,13 @@ mainwindow = Tk()
 # load every .png file from img directory into a dictionary under its filename without extension
 imgnames = [filename[:-4] for filename in listdir("img") if filename[-4:] == ".png"]
 images = {}
-for filename in imgnames:
-    try:
-        loadedimage = PhotoImage(file=joinpath("img", f"{filename}.png"))
-        images[filename] = loadedimage
-    except:
-        log.warning(f"Failed to load image \"{filename}.png\"")
+with perfstats.timed("startup.images"):
+    for filename in imgnames:
+        try:
+            loadedimage = PhotoImage(file=joinpath("img", f"{filename}.png"))
+            images[filename] = loadedimage
+        except:
+            log.warning(f"Failed to load image \"{filename}.png\"")
 log.info(f"Successfully loaded {len(images)} images out of {len(imgnames)} files.")
 
 mainwindow.title("To-do list")
@@ -46,43 +60,78 @@ if "icon" in images:
 else:
     log.warning("Couldn't load \"icon.png\", using default tkinter icon for all windows.")
 
-timers = {}  # ID: [timertype, object]
+# as a client of "todo.py serve" the database is wherever the server runs
+if storage_backend != "remote" and core.DATABASE not in listdir():
+    log.warning(f"File \"{core.DATABASE}\" not found! Initializing new database...")
 
-if "timers.db" in listdir():
-    engine = db.create_engine("sqlite:///timers.db")
-    Session = sessionmaker(bind=engine)
-    db_session = Session()
+with perfstats.timed("startup.database"):
+    # settings live in timers.db whichever list is shown, written through a writer thread of their own
+    settings_database = WriteBehind(lambda: storage.open_storage(storage_backend))
+    stored_settings = settings_database.load_settings()
+log.info(f"Using \"{storage_backend}\" storage backend.")
 
-    for entry in db_session.query(db.Timers).all():
-        newobject = timerclass_dict[entry.type](entry.comment, entry.last_clicked, json.loads(entry.data))
-        timers[entry.id] = [entry.type, newobject]
+user_settings.update(stored_settings)
 
-    settings_query = db_session.query(db.Settings).all()
+if len(user_settings) > len(stored_settings):
+    log.info("Database out of date, adding new settings.")
+    missing = [(key, value) for key, value in user_settings.items() if key not in stored_settings]
+    for key, value in missing:
+        log.debug(f"Adding \"{key}\" to settings database")
+    settings_database.add_settings(missing)
 
-    for entry in settings_query:
-        user_settings[entry.name] = entry.value
-    
-    if len(user_settings) > len(settings_query):
-        log.info("Database out of date, adding new settings.")
-        for entry in user_settings.keys():
-            if entry not in [x.name for x in settings_query]:
-                log.debug(f"Adding \"{entry}\" to settings database")
-                db_session.add(db.Settings(entry, user_settings[entry]))
-        db_session.commit()
-    
-else:
-    log.warning("File \"timers.db\" not found! Initializing new database...")
-    engine = db.initialize_db()
-    Sessionclass = sessionmaker(bind=engine)
-    db_session = Sessionclass()
+notifier = desktop_notifier()
+if notifier is None:
+    log.info("No desktop notification tool found, missed deadlines are only shown in the list.")
+
+# the optional user hook is imported once and shared by the dispatchers of all lists
+try:
+    python_callback = python_hook(due_python_hook) if due_python_hook else None
+except Exception as error:
+    # arbitrary user code, anything may go wrong while importing it
+    log.warning(f"Failed to load deadline hook \"{due_python_hook}\": {error}")
+    python_callback = None
+
+logging.getLogger("dueevents").addHandler(file_handler)
+
+
+def make_dispatcher(timers):
+    # callbacks fired whenever a deadline of a loaded list passes, every timer is re-armed at its following deadline
+    dispatcher = DueDispatcher(timers)
+    dispatcher.register(lambda event: log.info(f"Deadline passed, id {event.objid}, missed: {event.missed}"))
+    if notifier is not None:
+        def notify_missed(event):
+            if user_settings["notify_due"] and event.missed:
+                notifier(event)
+        dispatcher.register(notify_missed)
+    if due_shell_hook:
+        dispatcher.register(shell_hook(due_shell_hook))
+    if python_callback is not None:
+        dispatcher.register(python_callback)
+    return dispatcher
+
+
+# only the shown list and the few viewed before it are kept in memory, see todolists.py
+lists = ListCache(lambda name: OpenList(name, storage_backend, make_dispatcher), LOADED_LISTS)
+
+# the shown list, its parts are module globals so the handlers below always work on the current one
+current = timers = database = deadlines = dispatcher = None
+
+
+def activate_list(name):
+    global current, timers, database, deadlines, dispatcher
+    current = lists.get(name)
+    timers, database = current.timers, current.database
+    deadlines, dispatcher = current.deadlines, current.dispatcher
+    mainwindow.title("To-do list" if name == DEFAULT_LIST else f"To-do list - {name}")
+
+
+with perfstats.timed("startup.list"):
+    activate_list(DEFAULT_LIST)
 
-    for entry in user_settings.items():
-        db_session.add(db.Settings(*entry))
-    db_session.commit()
 
-log.debug(f"Database currently holds {len(timers)} entries.")
+def allocate_id():
+    return current.allocate_id()
 
-timerwidgets = []
 
 window_height = min(max(100, len(timers)*43), 350)
 log.debug(f"Starting window height: {window_height} ({len(timers)} entries)")
@@ -92,6 +141,7 @@ mainwindow.geometry(f"300x{window_height}")
 class NewEntryWindow(Toplevel):
     def __init__(self, parent, timers, editID):
         super().__init__(parent)
+        self.listname = current.name
         if editID == -1:
             self.title("Add new timer")
         else:
@@ -107,7 +157,7 @@ class NewEntryWindow(Toplevel):
         self.oldindex = IntVar(self, 0)
         self.descrentry = StringVar(self)
         self.allframes = []
-        self.datepicker = StringVar(self, datetime.strftime(now(), "%Y-%m-%d %H:%M"))
+        self.datepicker = StringVar(self, datetime.strftime(now(), core.DATE_FORMAT))
         self.intervalpicker = StringVar(self, "1")
         self.measurementpicker = StringVar(self, time_measurements[-1])
         self.weekdaypicker = []
@@ -115,6 +165,7 @@ class NewEntryWindow(Toplevel):
         self.daypicker = StringVar(self, "1")
         self.hourpicker = StringVar(self, "0")
         self.minutepicker = StringVar(self, "0")
+        self.rulepicker = StringVar(self, "FREQ=WEEKLY;BYDAY=MO;BYHOUR=9")
 
         Label(self, text="Timer type").grid(row=0, column=0)
         typepicker = ttk.Combobox(self, textvariable=self.currtype, state="readonly", values=timertypes)
@@ -216,6 +267,19 @@ class NewEntryWindow(Toplevel):
         Button(once_frame, text=confirm, command=lambda: self.add_timer(timers, editID, "Once"), width=15
                ).grid(row=3, column=0, columnspan=3)
         self.allframes.append(once_frame)
+
+        rule_frame = Frame(self)
+        Label(rule_frame, text="Resets by a recurrence rule, e.g. every 2nd Tuesday at 18:00:"
+              ).grid(row=0, column=0, columnspan=3)
+        Label(rule_frame, text="FREQ=MONTHLY;BYDAY=2TU;BYHOUR=18").grid(row=1, column=0, columnspan=3)
+        Label(rule_frame, text="Description").grid(row=2, column=0)
+        Entry(rule_frame, textvariable=self.descrentry).grid(row=2, column=1, columnspan=2, sticky=W+E)
+        Label(rule_frame, text="Rule").grid(row=3, column=0)
+        Entry(rule_frame, textvariable=self.rulepicker).grid(row=3, column=1, columnspan=2, sticky=W+E)
+
+        Button(rule_frame, text=confirm, command=lambda: self.add_timer(timers, editID, "Rule"), width=15
+               ).grid(row=4, column=0, columnspan=3)
+        self.allframes.append(rule_frame)
         # DYNAMIC FRAMES END
 
     def changed_dropdown(self, event):
@@ -227,8 +291,11 @@ class NewEntryWindow(Toplevel):
         self.oldindex.set(currselectionindex)
 
     def add_timer(self, timers, editID, timertype):
+        # the window belongs to the list shown when it was opened, which may have been switched or released since
+        switch_list(self.listname)
+        timers = current.timers
         if editID != -1:
-            if not db_session.query(db.Timers).get(editID):
+            if editID not in timers:
                 self.destroy()
                 err("Attempting to edit a timer that has already been deleted!")
 
@@ -237,7 +304,7 @@ class NewEntryWindow(Toplevel):
             if len(comment) == 0:
                 err("Task description is empty!\nThis check may be disabled in options.")
 
-        if not timertype in ("Custom","Once"):
+        if not timertype in ("Custom","Once","Rule"):
             hours = self.hourpicker.get()
             hours = self.handle_number(hours, "hour", 0, 23)
             
@@ -261,59 +328,52 @@ class NewEntryWindow(Toplevel):
                 
                 args = (days, hours, minutes)
             case "Custom":
-                try:
-                    newtime = datetime.strptime(self.datepicker.get(), "%Y-%m-%d %H:%M")
-                except:
-                    err(f"Invalid starting date format\nExample: {datetime.strftime(now(), '%Y-%m-%d %H:%M')}")
+                newtime = self.handle_date(self.datepicker.get(), "starting date")
                 
                 interval = self.intervalpicker.get()
                 interval = self.handle_number(interval, "interval", 1, -1)
 
-                args = (int(newtime.timestamp()), interval, self.measurementpicker.get())
+                args = (newtime, interval, self.measurementpicker.get())
             case "Once":
-                try:
-                    newtime = datetime.strptime(self.datepicker.get(), "%Y-%m-%d %H:%M")
-                except:
-                    err(f"Invalid end date format\nExample: {datetime.strftime(now(), '%Y-%m-%d %H:%M')}")
+                newtime = self.handle_date(self.datepicker.get(), "end date")
 
-                args = (int(newtime.timestamp()),)
+                args = (newtime,)
+            case "Rule":
+                args = (self.handle_rule(self.rulepicker.get().strip()),)
 
 
         if editID == -1:
-            newdbentry = db.Timers(timertype, comment, 0, json.dumps(args))
-            db_session.add(newdbentry)
-            db_session.flush()
-            editID = newdbentry.id
+            editID = allocate_id()
+            database.add_timer(timertype, comment, 0, json.dumps(args), editID)
         else:
-            db_entry = db_session.query(db.Timers).get(editID)
-            db_entry.type = timertype
-            db_entry.comment = self.descrentry.get()
-            db_entry.data = json.dumps(args)
-            
-        db_session.commit()
-        timers[editID] = [timertype, timerclass_dict[timertype](comment, 0, args)]
-        
+            database.update_timer(editID, timertype, comment, json.dumps(args))
+
+        timers.add(editID, timertype, comment, 0, args)
+        deadlines.update(editID)
+        dispatcher.arm(editID)
+        if search_filter is not None:
+            update_search_filter()
+
         populate()
         self.destroy()
 
     def handle_number(self, value, unit, rangemin, rangemax):
-        if len(value) > 0:
-            for char in value:
-                if char not in "01234356789":
-                    err(f"Non-number value in reset {unit} field.")
-            
-            value = int(value)
-
-            if rangemax == -1:
-                if value < rangemin:
-                    err(f"Reset {unit} needs to be at least {rangemin}")
-            else:
-                if value not in range(rangemin, rangemax+1):
-                    err(f"Reset {unit} value outside of {rangemin}-{rangemax} range")
-        else:
-            err(f"No argument for reset {unit}")
-        
-        return value
+        try:
+            return core.check_number(value, unit, rangemin, rangemax)
+        except ValueError as error:
+            err(str(error))
+
+    def handle_rule(self, value):
+        try:
+            return core.validate_args("Rule", [value])[0]
+        except ValueError as error:
+            err(str(error))
+
+    def handle_date(self, value, description):
+        try:
+            return core.parse_date(value, description)
+        except ValueError as error:
+            err(str(error))
 
 
 def err(description):
@@ -332,28 +392,58 @@ def addnew():
     NewEntryWindow(mainwindow, timers, -1)
 
 
+# single tasks and selections go through the same bulk functions:
+# one set-based database change and one populate() no matter how many tasks are affected
+
 def task_finished(objid):
-    log.debug(f"Task finished, id {objid}")
-    if timers[objid][0] == "Once":
-        delete_timer(objid)
-    else:
-        timers[objid][1].lastclicked = time_int()
+    finish_tasks([objid])
+
+
+def finish_tasks(objids):
+    log.debug(f"Tasks finished, ids {objids}")
+    clicked = time_int()
+    records = []
+    for objid in objids:
+        record = core.completion(timers.timertype(objid), timers.timer(objid), clicked)
+        if record is not None:
+            records.append((objid, clicked, *record))
+    if records:
+        database.record_completions(records)
+
+    recurring = [objid for objid in objids if timers.timertype(objid) != "Once"]
+    if recurring:
+        timers.set_last_clicked_many(recurring, clicked)
+        deadlines.update_many(recurring)
+        database.set_last_clicked_many(recurring, clicked)
+    remove_timers([objid for objid in objids if timers.timertype(objid) == "Once"])
+    populate()
 
-        db_entry = db_session.query(db.Timers).get(objid)
-        db_entry.last_clicked = time_int()
-        db_session.commit()
 
-        populate()
+def uncheck_task(objid):
+    uncheck_tasks([objid])
 
 
-def uncheck_task(objid):
-    log.debug(f"Task restarted manually, id {objid}")
-    timers[objid][1].lastclicked = 0
-    
-    db_entry = db_session.query(db.Timers).get(objid)
-    db_entry.last_clicked = 0
-    db_session.commit()
-    
+def uncheck_tasks(objids):
+    log.debug(f"Tasks restarted manually, ids {objids}")
+    timers.set_last_clicked_many(objids, 0)
+    deadlines.update_many(objids)
+    database.set_last_clicked_many(objids, 0)
+    populate()
+
+
+def shift_tasks(objids, delta):
+    # moves the deadlines of the tasks by delta seconds, see core.shift_args
+    log.debug(f"Shifting deadlines of ids {objids} by {delta} s")
+    rows = []
+    for objid in objids:
+        timer = timers[objid]
+        timertype, comment = timer.timertype, timer.comment
+        args = core.shift_args(timertype, timer.extraargs, delta)
+        timers.add(objid, timertype, comment, timer.lastclicked, args)
+        dispatcher.arm(objid)
+        rows.append((objid, timertype, comment, json.dumps(args)))
+    deadlines.update_many(objids)
+    database.update_timers(rows)
     populate()
 
 
@@ -362,11 +452,11 @@ def edit_timer(objid):
     # no populate on initial call!
     subwindow = NewEntryWindow(mainwindow, timers, objid)
     
-    subwindow.currtype.set(timers[objid][0])
-    subwindow.descrentry.set(timers[objid][1].comment)
-    args = timers[objid][1].extraargs
+    subwindow.currtype.set(timers[objid].timertype)
+    subwindow.descrentry.set(timers[objid].comment)
+    args = timers[objid].extraargs
 
-    match timers[objid][0]:
+    match timers[objid].timertype:
         case "Daily":
             subwindow.hourpicker.set(args[0])
             subwindow.minutepicker.set(args[1])
@@ -384,94 +474,508 @@ def edit_timer(objid):
             subwindow.hourpicker.set(args[1])
             subwindow.minutepicker.set(args[2])
         case "Custom":
-            oldtime = datetime.fromtimestamp(args[0]).strftime("%Y-%m-%d %H:%M")
+            oldtime = datetime.fromtimestamp(args[0]).strftime(core.DATE_FORMAT)
             subwindow.datepicker.set(oldtime)
             subwindow.intervalpicker.set(args[1])
             subwindow.measurementpicker.set(args[2])
         case "Once":
-            oldtime = datetime.fromtimestamp(args[0]).strftime("%Y-%m-%d %H:%M")
+            oldtime = datetime.fromtimestamp(args[0]).strftime(core.DATE_FORMAT)
             subwindow.datepicker.set(oldtime)
+        case "Rule":
+            subwindow.rulepicker.set(args[0])
     
     subwindow.changed_dropdown(None)
 
 
 def delete_timer(objid):
-    log.debug(f"Deleting task with id {objid}")
-    db_session.delete(db_session.query(db.Timers).get(objid))
-    db_session.commit()
-    del timers[objid]
+    delete_timers([objid])
+
+
+def delete_timers(objids):
+    log.debug(f"Deleting tasks with ids {objids}")
+    remove_timers(objids)
     populate()
 
 
-def autopopulate():
+def remove_timers(objids):
+    # deletes without refreshing the window
+    if not objids:
+        return
+    current.remove(objids)
+
+
+def selected_tasks():
+    return sorted(tasklist.selected)
+
+
+def finish_selected():
+    if tasklist.selected:
+        finish_tasks(selected_tasks())
+
+
+def uncheck_selected():
+    if tasklist.selected:
+        uncheck_tasks(selected_tasks())
+
+
+def delete_selected():
+    if not tasklist.selected:
+        return
+    if messagebox.askyesno("Delete", f"Delete {len(tasklist.selected)} selected tasks?"):
+        delete_timers(selected_tasks())
+
+
+def shift_selected():
+    if not tasklist.selected:
+        return
+    text = simpledialog.askstring("Shift deadlines", "Move deadlines of the selected tasks by\n"
+                                  "(e.g. 1d, 2h30m, -15m):", parent=mainwindow)
+    if not text:
+        return
+    text = text.strip()
+    sign = -1 if text.startswith("-") else 1
+    try:
+        delta = sign * core.parse_duration(text.lstrip("-+"))
+    except ValueError as error:
+        err(str(error))
+    shift_tasks(selected_tasks(), delta)
+
+
+def when_done(future, callback):
+    # calls callback(future) on the Tk thread once a WriteBehind.request() is answered,
+    # the event loop keeps running while the writer is busy with queued commits
+    if future.done():
+        callback(future)
+    else:
+        mainwindow.after(int(READ_POLL_INTERVAL*1000), when_done, future, callback)
+
+
+# IDs matching the search box, None = no search, the list is filtered before anything gets evaluated or drawn
+search_filter = None
+search_job = None
+
+
+def update_search_filter():
+    # the search runs after the queued writes, the list is redrawn with its result
+    global search_filter
+    text = searchtext.get().strip()
+    if not text:
+        search_filter = None
+        return
+    when_done(database.request("search", text), lambda future: search_done(future, text, database))
+
+
+def search_done(future, text, source):
+    global search_filter
+    if source is not database or text != searchtext.get().strip():
+        # the list was switched or the text edited since, a newer search is on its way
+        return
+    try:
+        search_filter = set(future.result())
+    except Exception as error:
+        log.warning(f"Search for \"{text}\" failed: {error}")
+        search_filter = set()
     populate()
-    mainwindow.after(60000, autopopulate)
+
+
+def run_search():
+    global search_job
+    search_job = None
+    update_search_filter()
+    populate()
+
+
+def schedule_search(*args):
+    # searches as you type, once typing pauses for SEARCH_DELAY
+    global search_job
+    if search_job is not None:
+        mainwindow.after_cancel(search_job)
+    search_job = mainwindow.after(int(SEARCH_DELAY*1000), run_search)
+
+
+def update_selection_menu():
+    count = len(tasklist.selected)
+    mainmenu.entryconfig(selection_menu_index, label=f"Selection ({count})" if count else "Selection")
+
+
+refresh_job = None
+
+
+def schedule_refresh():
+    # arm a single timer for the next moment the window content changes:
+    # a visible remaining time label ticking over or any deadline rolling over
+    global refresh_job
+    if refresh_job is not None:
+        mainwindow.after_cancel(refresh_job)
+        refresh_job = None
+
+    exacttime = time_orig()
+    currtime = int(exacttime)
+    delay = MAX_REFRESH_DELAY
+
+    nextrollover = deadlines.next_rollover(currtime)
+    if nextrollover is not None:
+        delay = min(delay, nextrollover - currtime)
+    for entry in lists.loaded.values():
+        nextevent = entry.dispatcher.next_event()
+        if nextevent is not None:
+            delay = min(delay, max(0, nextevent - currtime))
+
+    if user_settings["show_remain"]:
+        for objid, lastdeadline, nextdeadline in tasklist.visible_items():
+            if user_settings["show_complete"] and timers[objid].lastclicked > lastdeadline:
+                continue
+            timeleft = nextdeadline - currtime
+            if timeleft > 0:
+                delay = min(delay, label_change_delay(timeleft))
+
+    # fire just after the second boundary so time_int() already shows the new value
+    milliseconds = max(0, int((currtime + delay - exacttime) * 1000)) + 5
+    log.debug(f"Next refresh in {milliseconds} ms")
+    refresh_job = mainwindow.after(milliseconds, populate)
+
+
+def describe_task(entry):
+    objid, lastdeadline, nextdeadline = entry
+    timer = timers[objid]
+    completed = user_settings["show_complete"] and timer.lastclicked > lastdeadline
+    currtime = time_int()
+    status = "Completed!" if completed else timer.remaining_str(max(0, nextdeadline - currtime))
+    backlog = ""
+    if user_settings["show_backlog"]:
+        # closed form per timer type, cheap even for timers ignored for years
+        missed = timer.backlog(currtime)
+        backlog = f"{missed} missed" if missed else ""
+    return objid, timer.comment, status, completed, backlog
 
 
 def populate():
-    while len(timerwidgets) > 0:
-        item = timerwidgets[0]
-        
-        timerwidgets.remove(item)
-        item.destroy()
-        del item
-    
-    sortedtimers = sorted(timers.items(), key=lambda x: x[1][1].remaining_delta())
+    start = perf_counter()
+    currtime = time_int()
+    with perfstats.timed("dispatch"):
+        # deadline events keep firing for every loaded list, not just the shown one
+        for entry in lists.loaded.values():
+            entry.dispatcher.dispatch(currtime)
+    with perfstats.timed("populate.refresh"):
+        rekeyed = deadlines.refresh(currtime)
+        if rekeyed:
+            # keep the materialized deadline columns current for other readers of the database
+            database.refresh_deadlines(currtime)
+    perfstats.count("deadlines.rekeyed", rekeyed)
+
+    # [(ID, lastdeadline, nextdeadline)], only rolled-over timers get re-keyed
+    with perfstats.timed("populate.ordered"):
+        sortedtimers = deadlines.ordered(currtime, user_settings["show_complete"], search_filter)
+        if user_settings["sort_backlog"]:
+            sortedtimers = deadlines.by_backlog(sortedtimers, currtime)
+
+    with perfstats.timed("populate.render"):
+        if len(sortedtimers) == 0 and current.loading:
+            tasklist.render([], "Loading tasks...")
+        elif len(timers) == 0:
+            tasklist.render([], "No timers added!\nClick \"New Entry\" to begin.")
+        elif search_filter is not None and len(sortedtimers) == 0:
+            tasklist.render([], "No tasks match the search.")
+        elif len(sortedtimers) == 0:
+            tasklist.render([], "All tasks finished. Good job!")
+        else:
+            # widgets are only created and patched for the rows that fit in the window
+            tasklist.render(sortedtimers)
 
-    size = "32" if user_settings["show_remain"] else "" 
+    schedule_refresh()
+    watch_writer()
+    perfstats.record("populate", perf_counter() - start)
 
-    if not user_settings["show_complete"]:
-        sortedtimers = list(filter(lambda x: x[1][1].lastclicked < x[1][1].lastdeadline(), sortedtimers))
 
-    if len(timers) == 0:
-        line1 = Label(mainwindow, text="No timers added!")
-        line1.pack()
+hydrate_job = None
 
-        line2 = Label(mainwindow, text="Click \"New Entry\" to begin.")
-        line2.pack()
-        
-        timerwidgets.append(line1)
-        timerwidgets.append(line2)
-    
-    elif len(sortedtimers) == 0:
-        line1 = Label(mainwindow, text="All tasks finished. Good job!")
-        line1.pack()
-        
-        timerwidgets.append(line1)
-    
+
+def hydrate_lists():
+    # one page of timers per event loop slice: the shown list first, then the other loaded ones
+    # the page is read on the writer thread, hydrate_job stays set until it is added
+    global hydrate_job
+    loading = [entry for entry in lists.loaded.values() if entry.loading]
+    if not loading:
+        hydrate_job = None
+        return
+    entry = current if current.loading else loading[0]
+    when_done(entry.request_page(), lambda future: add_page(entry, future))
+
+
+def add_page(entry, future):
+    global hydrate_job
+    hydrate_job = None
+    if lists.loaded.get(entry.name) is not entry:
+        # released while the page was read
+        schedule_hydrate()
+        return
+    try:
+        rows = future.result()
+    except Exception as error:
+        # the list stays partly loaded, the next list switch tries again
+        log.error(f"Failed to load timers of list \"{entry.name}\": {error}")
+        return
+    with perfstats.timed("hydrate.page"):
+        entry.add_page(rows)
+    if entry is current and not current.loading:
+        # later pages are mostly below the visible rows, the list is redrawn once it is complete
+        log.debug(f"List \"{current.name}\" loaded, {len(timers)} entries.")
+        populate()
+    schedule_hydrate()
+
+
+def schedule_hydrate():
+    global hydrate_job
+    if hydrate_job is None and any(entry.loading for entry in lists.loaded.values()):
+        hydrate_job = mainwindow.after(1, hydrate_lists)
+
+
+writer_job = None
+
+
+def watch_writer():
+    # reports failed background writes, only polls while the writer has something queued
+    global writer_job
+    if writer_job is not None:
+        mainwindow.after_cancel(writer_job)
+        writer_job = None
+    for writer in (settings_database, database):
+        failed = writer.errors()
+        if failed:
+            lost = sum(count for error, count in failed)
+            path = core.DATABASE if writer is settings_database else current.path
+            messagebox.showerror("Error", f"Failed to save {lost} changes to \"{path}\":\n{failed[-1][0]}\n"
+                                          "They are kept in the open window, but lost when it's closed.")
+    if settings_database.pending() or database.pending():
+        writer_job = mainwindow.after(int(WRITER_POLL_INTERVAL*1000), watch_writer)
+
+
+def quit_program():
+    # the window closes right away, the remaining writes are committed before the process exits
+    log.info("Closing, waiting for pending database writes.")
+    mainwindow.withdraw()
+    for name, error, count in lists.close():
+        log.error(f"Lost {count} changes of list \"{name}\" on exit: {error}")
+    settings_database.close()
+    for error, count in settings_database.errors():
+        log.error(f"Lost {count} settings changes on exit: {error}")
+    mainwindow.destroy()
+
+
+class DiagnosticsWindow(Toplevel):
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.title("Diagnostics")
+        self.geometry("480x360")
+
+        columns = ("count", "mean", "p95", "max")
+        self.table = ttk.Treeview(self, columns=columns)
+        self.table.heading("#0", text="Measurement")
+        self.table.column("#0", width=160)
+        for column in columns:
+            self.table.heading(column, text=column if column == "count" else f"{column} (ms)")
+            self.table.column(column, width=70, anchor=E)
+        self.table.pack(fill=BOTH, expand=True)
+
+        bottom = Frame(self)
+        self.uptimelabel = Label(bottom)
+        self.uptimelabel.pack(side=LEFT)
+        Button(bottom, text="Reset", command=self.reset).pack(side=RIGHT)
+        Button(bottom, text="Write to log", command=log_stats_record).pack(side=RIGHT)
+        bottom.pack(fill=X)
+
+        self.refresh_job = None
+        self.refresh()
+
+    def refresh(self):
+        snapshot = perfstats.snapshot()
+        self.table.delete(*self.table.get_children())
+        for name, summary in snapshot["timings"].items():
+            values = [summary["count"]] + [f"{summary[key]*1000:.2f}" for key in ("mean", "p95", "max")]
+            self.table.insert("", END, text=name, values=values)
+        for name, value in snapshot["counters"].items():
+            self.table.insert("", END, text=name, values=(value, "", "", ""))
+        self.uptimelabel.config(text=f"Uptime: {format_remaining(int(snapshot['uptime']))}")
+        self.refresh_job = self.after(1000, self.refresh)
+
+    def reset(self):
+        perfstats.reset()
+        self.after_cancel(self.refresh_job)
+        self.refresh()
+
+    def destroy(self):
+        global diagnostics_window
+        diagnostics_window = None
+        if self.refresh_job is not None:
+            self.after_cancel(self.refresh_job)
+        super().destroy()
+
+
+class AgendaWindow(Toplevel):
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.title("Agenda")
+        self.geometry("360x400")
+
+        self.table = ttk.Treeview(self, columns=("task",))
+        self.table.heading("#0", text="Deadline")
+        self.table.column("#0", width=130)
+        self.table.heading("task", text="Task")
+        scrollbar = Scrollbar(self, command=self.table.yview)
+        self.table.config(yscrollcommand=scrollbar.set)
+        self.morebutton = Button(self, text="Show more", command=self.load_page)
+        self.morebutton.pack(side=BOTTOM, fill=X)
+        scrollbar.pack(side=RIGHT, fill=Y)
+        self.table.pack(fill=BOTH, expand=True)
+
+        # occurrences are generated page by page, never for the whole range at once
+        currtime = time_int()
+        self.occurrences = agenda.agenda(((objid, timers.timertype(objid), timers.timer(objid)) for objid in timers),
+                                         currtime, currtime + AGENDA_DAYS*DAY)
+        self.load_page()
+
+    def load_page(self):
+        added = 0
+        for timestamp, objid, timertype, comment in islice(self.occurrences, AGENDA_PAGE):
+            self.table.insert("", END, text=datetime.fromtimestamp(timestamp).strftime(core.DATE_FORMAT),
+                              values=(comment,))
+            added += 1
+        if added < AGENDA_PAGE:
+            self.morebutton.config(state=DISABLED, text=f"End of the next {AGENDA_DAYS} days")
+
+
+def open_agenda():
+    AgendaWindow(mainwindow)
+
+
+class StatsWindow(Toplevel):
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.title("Statistics")
+        self.geometry("560x360")
+
+        columns = ("completions", "ontime", "streak", "best", "lateness")
+        headings = ("Done", "On time", "Streak", "Best", "Mean lateness")
+        self.table = ttk.Treeview(self, columns=columns)
+        self.table.heading("#0", text="Task")
+        self.table.column("#0", width=180)
+        for column, heading in zip(columns, headings):
+            self.table.heading(column, text=heading)
+            self.table.column(column, width=90 if column == "lateness" else 60, anchor=E)
+        scrollbar = Scrollbar(self, command=self.table.yview)
+        self.table.config(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=RIGHT, fill=Y)
+        self.table.pack(fill=BOTH, expand=True)
+
+        # one pre-aggregated row per timer, the history itself is never scanned,
+        # the rows are filled in once the database writer answers
+        when_done(database.request("load_stats"), lambda future: self.fill(future, timers))
+
+    def fill(self, future, listtimers):
+        if not self.winfo_exists():
+            return
+        stats = future.result()
+        for objid in listtimers:
+            if objid not in stats:
+                continue
+            completions, ontime, streak, beststreak, lateness = core.stats_summary(*stats[objid])
+            self.table.insert("", END, text=listtimers.comment(objid),
+                              values=(completions, f"{ontime:.0%}", streak, beststreak,
+                                      "-" if lateness is None else format_remaining(lateness)))
+
+
+def open_stats():
+    StatsWindow(mainwindow)
+
+
+diagnostics_window = None
+lag_job = None
+stats_job = None
+
+
+def open_diagnostics():
+    global diagnostics_window
+    if diagnostics_window is None:
+        diagnostics_window = DiagnosticsWindow(mainwindow)
+        update_probes()
     else:
-        for entry in sortedtimers:
-            itemframe = Frame(mainwindow)
-            if user_settings["show_border"]:
-                itemframe.config(highlightbackground="black", highlightthickness=1)
-            
-            labelframe = Frame(itemframe)
-
-            if user_settings["show_complete"] and entry[1][1].lastclicked > entry[1][1].lastdeadline():
-                Button(itemframe, image=images[f"cross{size}"], command=lambda objid=entry[0]: uncheck_task(objid)
-                       ).pack(side=LEFT)
-            else:
-                Button(itemframe, image=images[f"check{size}"], command=lambda objid=entry[0]: task_finished(objid)
-                       ).pack(side=LEFT)
-
-            if user_settings["show_delete"]:
-                Button(itemframe, image=images[f"trash{size}"], command=lambda objid=entry[0]: delete_timer(objid)
-                       ).pack(side=RIGHT)
-            if user_settings["show_edit"]:
-                Button(itemframe, image=images[f"edit{size}"], command=lambda objid=entry[0]: edit_timer(objid)
-                       ).pack(side=RIGHT)
-
-            Label(labelframe, text=entry[1][1].comment).pack(anchor=W)
-            if user_settings["show_remain"]:
-                if user_settings["show_complete"] and entry[1][1].lastclicked > entry[1][1].lastdeadline():
-                    Label(labelframe, text="Completed!").pack(anchor=W)
-                else:
-                    Label(labelframe, text=entry[1][1].remaining_str()).pack(anchor=W)
-            labelframe.pack(side=LEFT, expand=True, fill=X)
-
-            timerwidgets.append(itemframe)
-            itemframe.pack(fill=X)
+        diagnostics_window.lift()
+
+
+def probe_lag(expected):
+    # how late the event loop runs a timer, stalls in any callback show up here
+    global lag_job
+    now_perf = perf_counter()
+    perfstats.record("eventloop.lag", max(0.0, now_perf - expected))
+    lag_job = None
+    update_probes()
+
+
+def log_stats_record():
+    stats_log.info(f"perfstats {json.dumps(perfstats.snapshot())}")
+
+
+def log_stats_periodic():
+    global stats_job
+    stats_job = None
+    if user_settings["log_stats"]:
+        log_stats_record()
+    update_probes()
+
+
+def update_probes():
+    # the lag probe wakes the event loop every second, so it only runs while someone looks at the numbers
+    global lag_job, stats_job
+    if lag_job is None and (diagnostics_window is not None or user_settings["log_stats"]):
+        lag_job = mainwindow.after(LAG_PROBE_INTERVAL*1000, probe_lag, perf_counter() + LAG_PROBE_INTERVAL)
+    if stats_job is None and user_settings["log_stats"]:
+        stats_job = mainwindow.after(STATS_LOG_INTERVAL*1000, log_stats_periodic)
+
+
+def switch_list(name):
+    if name == current.name:
+        return
+    log.info(f"Switching to list \"{name}\"")
+    with perfstats.timed("list.switch"):
+        activate_list(name)
+    listvar.set(name)
+    tasklist.clear_selection()
+    update_search_filter()
+    populate()
+    schedule_hydrate()
+
+
+def new_list():
+    name = simpledialog.askstring("New list", "Name of the new list:", parent=mainwindow)
+    if not name:
+        return
+    try:
+        name = check_list_name(name)
+    except ValueError as error:
+        err(str(error))
+    makedirs(LISTS_DIRECTORY, exist_ok=True)
+    switch_list(name)
+
+
+def update_lists_menu():
+    # the lists directory is read each time the menu opens, so lists added meanwhile show up
+    lists_menu.delete(0, END)
+    for name in list_names():
+        lists_menu.add_radiobutton(label=name, value=name, variable=listvar, command=lambda name=name: switch_list(name))
+    lists_menu.add_separator()
+    lists_menu.add_command(label="New list...", command=new_list)
+
+
+searchframe = Frame(mainwindow)
+Label(searchframe, text="Search").pack(side=LEFT)
+searchtext = StringVar(mainwindow)
+searchtext.trace_add("write", schedule_search)
+Entry(searchframe, textvariable=searchtext).pack(side=LEFT, fill=X, expand=True)
+searchframe.pack(fill=X)
 
+tasklist = TaskList(mainwindow, images, user_settings, describe_task,
+                    task_finished, uncheck_task, edit_timer, delete_timer, schedule_refresh, update_selection_menu)
+tasklist.pack(fill=BOTH, expand=True)
 
 mainmenu = Menu(mainwindow)
 uioptions_menu = Menu(mainwindow, tearoff=0)
@@ -479,6 +983,24 @@ mainwindow.config(menu=mainmenu)
 
 mainmenu.add_command(label="New entry", command=addnew)
 mainmenu.add_cascade(label="UI options", menu=uioptions_menu)
+listvar = StringVar(mainwindow, current.name)
+lists_menu = Menu(mainwindow, tearoff=0, postcommand=update_lists_menu)
+if storage_backend != "remote":
+    # a server serves a single database, its clients only have that list
+    mainmenu.add_cascade(label="Lists", menu=lists_menu)
+selection_menu = Menu(mainwindow, tearoff=0)
+selection_menu.add_command(label="Select all", command=tasklist.select_all)
+selection_menu.add_command(label="Clear selection", command=tasklist.clear_selection)
+selection_menu.add_separator()
+selection_menu.add_command(label="Complete", command=finish_selected)
+selection_menu.add_command(label="Uncheck", command=uncheck_selected)
+selection_menu.add_command(label="Shift deadlines...", command=shift_selected)
+selection_menu.add_command(label="Delete", command=delete_selected)
+mainmenu.add_cascade(label="Selection", menu=selection_menu)
+selection_menu_index = mainmenu.index(END)
+mainmenu.add_command(label="Agenda", command=open_agenda)
+mainmenu.add_command(label="Statistics", command=open_stats)
+mainmenu.add_command(label="Diagnostics", command=open_diagnostics)
 
 
 def update_settings():
@@ -487,11 +1009,11 @@ def update_settings():
             log.debug(f"Changing setting \"{key}\", new value: {value.get()}")
             user_settings[key] = value.get()
 
-            db_entry = db_session.query(db.Settings).get(key)
-            db_entry.value = user_settings[key]
-            db_session.commit()
+            settings_database.set_setting(key, user_settings[key])
 
+    tasklist.reset()
     populate()
+    update_probes()
 
 
 settingswidgets = {}
@@ -501,5 +1023,10 @@ for key, value in settings_names.items():
     settingswidgets[key] = tempvar
     uioptions_menu.add_checkbutton(label=value, variable=tempvar, command=update_settings)
 
-autopopulate()
+populate()
+mainwindow.update_idletasks()
+perfstats.record("startup.first_paint", perf_counter() - launched)
+schedule_hydrate()
+update_probes()
+mainwindow.protocol("WM_DELETE_WINDOW", quit_program)
 mainwindow.mainloop()
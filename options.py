@@ -1,3 +1,5 @@
+from os import environ
+
 master_settings_config = [
     #FORMAT:
     #[internal name,    GUI display name,           default value]
@@ -6,7 +8,11 @@ master_settings_config = [
     ["show_delete",     "Show delete buttons",      True],
     ["show_complete",   "Show completed tasks",     False],
     ["show_border",     "Show borders",             False],
-    ["allow_blank",     "Allow blank entries",      False]
+    ["allow_blank",     "Allow blank entries",      False],
+    ["log_stats",       "Log performance stats",    False],
+    ["notify_due",      "Notify on missed deadlines", False],
+    ["show_backlog",    "Show missed deadline count", False],
+    ["sort_backlog",    "Sort by missed deadlines", False]
     ]
 
 default_settings = {}
@@ -18,3 +24,35 @@ for entry in master_settings_config:
     settings_names[entry[0]] = entry[1]
 
 user_settings = default_settings.copy()
+
+# upper bound for the refresh timer in seconds, catches clock jumps after suspend
+MAX_REFRESH_DELAY = 60*60
+
+# storage backend for timers.db, see storage.py: "orm" (SQLAlchemy), "sqlite" (stdlib sqlite3)
+# or "remote" (client of "todo.py serve" at TODO_SERVER)
+storage_backend = environ.get("TODO_STORAGE", "orm")
+
+# performance stats: seconds between event loop lag samples and between periodic log records
+LAG_PROBE_INTERVAL = 1
+STATS_LOG_INTERVAL = 5*60
+
+# commands run when a deadline passes, see dueevents.py:
+# shell command getting the event in TODO_* environment variables, and "module:function" Python callback
+due_shell_hook = environ.get("TODO_DUE_HOOK")
+due_python_hook = environ.get("TODO_DUE_PYTHON_HOOK")
+
+# seconds between checks for failed background database writes, only while writes are queued
+WRITER_POLL_INTERVAL = 0.2
+
+# seconds between checks whether a read the GUI queued for the database writer got its result
+READ_POLL_INTERVAL = 0.01
+
+# seconds of no typing in the search box before the search runs
+SEARCH_DELAY = 0.15
+
+# agenda window: days of deadlines it covers and rows added per "Show more" click
+AGENDA_DAYS = 30
+AGENDA_PAGE = 200
+
+# task lists kept in memory including the shown one, the least recently viewed beyond that are released
+LOADED_LISTS = 3
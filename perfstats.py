@@ -0,0 +1,97 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+
+# In-process timing counters and latency histograms for the hot paths.
+# Recording a sample is a bisect and a few additions, cheap enough to stay on
+# in normal use. The GUI shows them in the Diagnostics window and can dump
+# them periodically through its log handlers.
+#   with perfstats.timed("populate"):
+#       ...
+#   perfstats.record("eventloop.lag", seconds)
+#   perfstats.count("deadlines.rekeyed", n)
+
+# histogram bucket upper bounds in seconds, 1-2-5 steps from 10us to 10s, last bucket is unbounded
+BUCKET_BOUNDS = tuple(step * 10.0**exponent for exponent in range(-5, 1) for step in (1, 2, 5)) + (10.0,)
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.buckets[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, fraction):
+        # upper bound of the bucket holding the requested sample, never above the real maximum
+        if self.count == 0:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for index, amount in enumerate(self.buckets):
+            seen += amount
+            if seen >= target and amount:
+                if index == len(BUCKET_BOUNDS):
+                    return self.max
+                return min(BUCKET_BOUNDS[index], self.max)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "total": self.total, "mean": self.mean(), "p50": self.percentile(0.5),
+                "p95": self.percentile(0.95), "p99": self.percentile(0.99), "max": self.max}
+
+
+class PerfStats:
+    def __init__(self):
+        self.histograms = {}  # name: Histogram
+        self.counters = {}  # name: int
+        self.started = perf_counter()
+
+    def record(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(seconds)
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def timed(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, perf_counter() - start)
+
+    def snapshot(self):
+        # plain dict of everything recorded so far, times in seconds
+        return {
+            "uptime": perf_counter() - self.started,
+            "timings": {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+            "counters": dict(sorted(self.counters.items()))
+        }
+
+    def reset(self):
+        self.histograms.clear()
+        self.counters.clear()
+        self.started = perf_counter()
+
+
+# process-wide registry used by the module level functions below
+stats = PerfStats()
+record = stats.record
+count = stats.count
+timed = stats.timed
+snapshot = stats.snapshot
+reset = stats.reset
@@ -0,0 +1,367 @@
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+from math import lcm
+
+from tztable import DAY, localzone, days_from_civil, civil_from_days, days_in_month, weekday
+
+# Recurrence rules of "Rule" timers, a subset of the iCalendar RRULE syntax (RFC 5545) stored as
+# the only value of the Data column. Deadlines are at BYHOUR:BYMINUTE local time on the days
+# the rule selects:
+#   FREQ=MONTHLY;BYDAY=2TU;BYHOUR=18                         every 2nd Tuesday at 18:00
+#   FREQ=MONTHLY;BYDAY=MO,TU,WE,TH,FR;BYSETPOS=-1            last weekday of the month
+#   FREQ=WEEKLY;INTERVAL=3;BYDAY=MO,TH;DTSTART=20220502      every 3 weeks on Monday and Thursday
+#   FREQ=YEARLY;BYMONTH=12;BYMONTHDAY=24,31;EXDATE=20221231  December 24th and 31st, except 2022-12-31
+# DTSTART only anchors INTERVAL and supplies the missing day, weekday or month, deadlines
+# before it count as well. Numbered BYDAY entries count within the month, also for YEARLY.
+# A rule is compiled once into the days its deadlines fall on within one cycle after which it
+# repeats exactly: INTERVAL days or weeks, or 400 Gregorian years (a whole number of weeks) times
+# what INTERVAL needs on top for monthly and yearly rules. The days are kept per used period, as
+# its start and the pattern of days shared by all periods of the same length and first weekday,
+# so a cycle of up to 4800 months takes a few arrays instead of a list of every day. Every
+# deadline query is a divmod and two bisects then, however long the rule's period is, and timers
+# with the same rule share it.
+
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+DAY_NAMES = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+# 400 Gregorian years
+CYCLE_DAYS = 146097
+CYCLE_MONTHS = 4800
+CYCLE_YEARS = 400
+# compiled rules kept around, lists with more distinct rules than this compile the rest again when used
+# a compiled rule takes up to ~90 KB and a few ms to compile
+COMPILED_RULES = 256
+
+# interned rule texts, the position is what DeadlineBatch stores for a Rule timer
+rule_texts = []
+rule_numbers = {}
+
+
+def intern_rule(text):
+    if text not in rule_numbers:
+        rule_numbers[text] = len(rule_texts)
+        rule_texts.append(text)
+    return rule_numbers[text]
+
+
+def parse_integers(name, value, rangemin, rangemax, signed=False):
+    # comma separated list, signed values count from the end and may not be 0
+    numbers = []
+    for entry in value.split(","):
+        try:
+            number = int(entry)
+        except ValueError:
+            raise ValueError(f"Non-number value \"{entry}\" in {name}")
+        if signed:
+            valid = number != 0 and rangemin <= abs(number) <= rangemax
+        else:
+            valid = rangemin <= number <= rangemax
+        if not valid:
+            raise ValueError(f"{name} value {number} is out of range")
+        numbers.append(number)
+    return numbers
+
+
+def parse_date(name, value):
+    # YYYYMMDD -> local day number
+    if len(value) != 8 or not value.isdigit():
+        raise ValueError(f"Invalid {name} date \"{value}\", use YYYYMMDD")
+    year, month, day = int(value[:4]), int(value[4:6]), int(value[6:])
+    if not 1 <= month <= 12 or not 1 <= day <= days_in_month(year, month):
+        raise ValueError(f"Invalid {name} date \"{value}\"")
+    return days_from_civil(year, month, day)
+
+
+def parse_byday(value, numbered):
+    # [(number, weekday)], number 0 = every such weekday
+    entries = []
+    for entry in value.split(","):
+        name = entry[-2:].upper()
+        if name not in DAY_NAMES:
+            raise ValueError(f"Unknown weekday \"{entry}\" in BYDAY, use one of {','.join(DAY_NAMES)}")
+        number = 0
+        if entry[:-2]:
+            if not numbered:
+                raise ValueError(f"Numbered weekday \"{entry}\" needs FREQ=MONTHLY or YEARLY")
+            number = parse_integers("BYDAY", entry[:-2], 1, 5, signed=True)[0]
+        entries.append((number, DAY_NAMES.index(name)))
+    return entries
+
+
+def parse_rule(text):
+    # {part name: value} of a rule, raises ValueError
+    parts = {}
+    for part in text.strip().split(";"):
+        if not part:
+            continue
+        name, equals, value = part.partition("=")
+        name, value = name.strip().upper(), value.strip()
+        if not equals or not value:
+            raise ValueError(f"Rule part \"{part}\" has no value")
+        if name in parts:
+            raise ValueError(f"Rule part {name} given twice")
+        parts[name] = value
+    return parts
+
+
+def format_rule(parts):
+    return ";".join(f"{name}={value}" for name, value in parts.items())
+
+
+class Recurrence:
+    # compiled rule, all days are local day numbers
+    def __init__(self, text):
+        parts = parse_rule(text)
+        unknown = set(parts) - {"FREQ", "INTERVAL", "BYDAY", "BYMONTHDAY", "BYMONTH", "BYSETPOS",
+                                "BYHOUR", "BYMINUTE", "DTSTART", "EXDATE"}
+        if unknown:
+            raise ValueError(f"Unsupported rule part {', '.join(sorted(unknown))}")
+        self.frequency = parts.get("FREQ", "").upper()
+        if self.frequency not in FREQUENCIES:
+            raise ValueError(f"Rule needs FREQ={'|'.join(FREQUENCIES)}")
+        self.interval = parse_integers("INTERVAL", parts.get("INTERVAL", "1"), 1, 10000)[0]
+        hour = parse_integers("BYHOUR", parts.get("BYHOUR", "0"), 0, 23)
+        minute = parse_integers("BYMINUTE", parts.get("BYMINUTE", "0"), 0, 59)
+        if len(hour) > 1 or len(minute) > 1:
+            raise ValueError("Rule can only have one BYHOUR and one BYMINUTE")
+        self.base = hour[0]*60*60 + minute[0]*60
+
+        start = parse_date("DTSTART", parts["DTSTART"]) if "DTSTART" in parts else None
+        periodic = self.frequency in ("MONTHLY", "YEARLY")
+        self.byday = parse_byday(parts["BYDAY"], periodic) if "BYDAY" in parts else []
+        self.monthdays = parse_integers("BYMONTHDAY", parts["BYMONTHDAY"], 1, 31, signed=True) \
+            if "BYMONTHDAY" in parts else []
+        self.months = parse_integers("BYMONTH", parts["BYMONTH"], 1, 12) if "BYMONTH" in parts else []
+        self.setpos = parse_integers("BYSETPOS", parts["BYSETPOS"], 1, 366, signed=True) \
+            if "BYSETPOS" in parts else []
+        if not periodic and (self.monthdays or self.months):
+            raise ValueError("BYMONTHDAY and BYMONTH need FREQ=MONTHLY or YEARLY")
+        if self.frequency == "MONTHLY" and self.months:
+            raise ValueError("BYMONTH needs FREQ=YEARLY")
+
+        # parts missing from the rule come from DTSTART like in iCalendar
+        def from_start(part):
+            if start is None:
+                raise ValueError(f"FREQ={self.frequency} rule needs {part} or DTSTART")
+            return civil_from_days(start)
+        if self.frequency == "WEEKLY" and not self.byday:
+            self.byday = [(0, weekday(from_start("BYDAY")))]
+        if self.frequency == "YEARLY" and not self.months:
+            self.months = [from_start("BYMONTH")[1]]
+        if periodic and not self.byday and not self.monthdays:
+            self.monthdays = [from_start("BYDAY or BYMONTHDAY")[2]]
+        if self.interval > 1 and start is None:
+            raise ValueError("INTERVAL needs DTSTART")
+
+        match self.frequency:
+            case "DAILY":
+                cycleperiods = lcm(self.interval, 7) if self.byday else self.interval
+                cycledays = cycleperiods
+            case "WEEKLY":
+                cycleperiods, cycledays = self.interval, self.interval*7
+            case "MONTHLY":
+                cycleperiods = lcm(self.interval, CYCLE_MONTHS)
+                cycledays = CYCLE_DAYS * cycleperiods // CYCLE_MONTHS
+            case "YEARLY":
+                cycleperiods = lcm(self.interval, CYCLE_YEARS)
+                cycledays = CYCLE_DAYS * cycleperiods // CYCLE_YEARS
+
+        # the cycle starts with the period of DTSTART, every INTERVALth period from there on is used
+        firstperiod = self.period(start) if start is not None else 0
+        self.origin = self.period_start(firstperiod)
+        self.cycledays = cycledays
+        active = range(firstperiod, firstperiod + cycleperiods, self.interval)
+        if periodic:
+            self.calendar_patterns(active)
+        else:
+            # a handful of days at most, one pattern starting at the origin
+            self.starts, self.shapes = array("q", [0]), array("b", [0])
+            self.patterns = [tuple(day - self.origin for period in active for day in self.period_days(period))]
+        # deadlines in the cycle before each period
+        self.firsts = array("q", [0])
+        for shape in self.shapes:
+            self.firsts.append(self.firsts[-1] + len(self.patterns[shape]))
+        self.cyclecount = self.firsts.pop()
+        if not self.cyclecount:
+            raise ValueError("Rule never has a deadline")
+
+        # exclusions that aren't deadlines anyway don't change any count
+        exdates = [parse_date("EXDATE", entry) for entry in parts["EXDATE"].split(",")] if "EXDATE" in parts else []
+        self.excluded = sorted(day for day in set(exdates) if self.raw_last(day) == day)
+        self.excludedset = set(self.excluded)
+        self.bracket = (0, 0)  # last result of deadlines()
+
+    def period(self, day):
+        # number of the period containing the day
+        match self.frequency:
+            case "DAILY":
+                return day
+            case "WEEKLY":
+                # weeks since monday 1969-12-29
+                return (day + 3) // 7
+            case "MONTHLY":
+                year, month, _ = civil_from_days(day)
+                return (year - 1970)*12 + month - 1
+            case "YEARLY":
+                return civil_from_days(day)[0] - 1970
+
+    def period_start(self, period):
+        match self.frequency:
+            case "DAILY":
+                return period
+            case "WEEKLY":
+                return period*7 - 3
+            case "MONTHLY":
+                year, month = divmod(period, 12)
+                return days_from_civil(year + 1970, month + 1, 1)
+            case "YEARLY":
+                return days_from_civil(period + 1970, 1, 1)
+
+    def period_days(self, period):
+        # sorted days of a period the rule selects, before BYSETPOS and EXDATE
+        match self.frequency:
+            case "DAILY":
+                days = [period] if not self.byday or (0, weekday(period)) in self.byday else []
+            case "WEEKLY":
+                days = sorted({period*7 - 3 + entry for _, entry in self.byday})
+            case "MONTHLY":
+                year, month = divmod(period, 12)
+                days = self.month_days(year + 1970, month + 1)
+            case "YEARLY":
+                days = [day for month in sorted(set(self.months)) for day in self.month_days(period + 1970, month)]
+        if self.setpos:
+            # positions that don't exist in the period are left out
+            days = sorted({days[position - 1 if position > 0 else position] for position in self.setpos
+                           if position <= len(days) and -position <= len(days)})
+        return days
+
+    def calendar_patterns(self, periods):
+        # starts, shapes and day patterns of a range of months or years, the ones of the same length starting
+        # on the same weekday select the same days, so period_days() only runs for up to 28 of the thousands of them
+        # numpy is imported here, so only monthly and yearly rules make a command line call pay for it
+        import numpy as np
+        periods = np.array(periods, dtype=np.int64)
+        if self.frequency == "MONTHLY":
+            year, month = np.divmod(periods, 12)
+            starts = days_from_civil(year + 1970, month + 1, 1)
+            lengths = days_in_month(year + 1970, month + 1)
+        else:
+            starts = days_from_civil(periods + 1970, 1, 1)
+            lengths = days_from_civil(periods + 1971, 1, 1) - starts
+        shapes, numbers = np.unique(lengths*7 + weekday(starts), return_inverse=True)
+        self.patterns = []
+        for number in range(len(shapes)):
+            position = int(np.argmax(numbers == number))
+            start = int(starts[position])
+            self.patterns.append(tuple(day - start for day in self.period_days(int(periods[position]))))
+        self.starts = array("q", (starts - self.origin).tolist())
+        self.shapes = array("b", numbers.tolist())
+
+    def month_days(self, year, month):
+        first = days_from_civil(year, month, 1)
+        length = days_in_month(year, month)
+        if self.monthdays:
+            # days the month doesn't have are skipped
+            days = {first + (entry - 1 if entry > 0 else length + entry) for entry in self.monthdays
+                    if abs(entry) <= length}
+        else:
+            days = set(range(first, first + length))
+        if self.byday:
+            selected = set()
+            for number, entry in self.byday:
+                matching = range(first + (entry - weekday(first)) % 7, first + length, 7)
+                if number == 0:
+                    selected.update(matching)
+                elif number <= len(matching) and -number <= len(matching):
+                    selected.add(matching[number - 1 if number > 0 else number])
+            days &= selected
+        return sorted(days)
+
+    # position(offset) = deadline days of the cycle <= offset, offset_of(number) = day of the deadline with that number
+    def position(self, offset):
+        period = bisect_right(self.starts, offset) - 1
+        return self.firsts[period] + bisect_right(self.patterns[self.shapes[period]], offset - self.starts[period])
+
+    def offset_of(self, number):
+        # periods without deadlines share their first number with the next one, bisect_right skips them
+        period = bisect_right(self.firsts, number) - 1
+        return self.starts[period] + self.patterns[self.shapes[period]][number - self.firsts[period]]
+
+    # raw_* ignore EXDATE, raw_last(day) = last deadline day <= day, raw_next(day) = first one > day
+    def raw_last(self, day):
+        cycle, offset = divmod(day - self.origin, self.cycledays)
+        position = self.position(offset) - 1
+        if position < 0:
+            cycle, position = cycle - 1, self.cyclecount - 1
+        return self.origin + cycle*self.cycledays + self.offset_of(position)
+
+    def raw_next(self, day):
+        cycle, offset = divmod(day - self.origin, self.cycledays)
+        position = self.position(offset)
+        if position == self.cyclecount:
+            cycle, position = cycle + 1, 0
+        return self.origin + cycle*self.cycledays + self.offset_of(position)
+
+    def last_day(self, day):
+        # each skipped day is an exclusion, so this loops at most len(self.excluded) times
+        day = self.raw_last(day)
+        while day in self.excludedset:
+            day = self.raw_last(day - 1)
+        return day
+
+    def next_day(self, day):
+        day = self.raw_next(day)
+        while day in self.excludedset:
+            day = self.raw_next(day)
+        return day
+
+    def count(self, day):
+        # deadline days <= day counted from the origin, negative before it
+        cycle, offset = divmod(day - self.origin, self.cycledays)
+        return cycle*self.cyclecount + self.position(offset) - bisect_right(self.excluded, day)
+
+    def deadline(self, day):
+        return localzone.to_utc(day*DAY + self.base)
+
+    def deadlines(self, currtime):
+        # (last deadline <= currtime, next deadline > currtime)
+        # the previous answer holds until the next deadline, timers sharing the rule mostly ask for the same time
+        bracket = self.bracket
+        if bracket[0] <= currtime < bracket[1]:
+            return bracket
+        day = self.last_day(localzone.local_day(currtime))
+        deadline = self.deadline(day)
+        if deadline <= currtime:
+            self.bracket = deadline, self.deadline(self.next_day(day))
+        else:
+            self.bracket = self.deadline(self.last_day(day - 1)), deadline
+        return self.bracket
+
+    def deadline_index(self, timestamp):
+        localday = localzone.local_day(timestamp)
+        today = self.last_day(localday) == localday
+        return self.count(localday) - (today and self.deadline(localday) > timestamp)
+
+    def occurrences(self, start, end):
+        day = self.next_day(localzone.local_day(start) - 2)
+        while True:
+            occurrence = self.deadline(day)
+            if occurrence >= end:
+                return
+            if occurrence >= start:
+                yield occurrence
+            day = self.next_day(day)
+
+
+@lru_cache(maxsize=COMPILED_RULES)
+def compile_rule(text):
+    # raises ValueError for invalid rules
+    return Recurrence(text)
+
+
+def shift_rule(text, delta):
+    # rule text with the time of day moved by delta seconds, wrapping around within the day like Daily timers
+    parts = parse_rule(text)
+    base = (compile_rule(text).base + delta) % DAY
+    parts["BYHOUR"], parts["BYMINUTE"] = str(base // (60*60)), str(base % (60*60) // 60)
+    return format_rule(parts)
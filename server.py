@@ -0,0 +1,301 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import core
+import perfstats
+from storage import SqliteStorage, DUE_TIMERS, NO_LIMIT, DEFAULT_ADDRESS, parse_address
+from timerclasses import *
+from writebehind import WRITE_METHODS
+
+# Local JSON API for timers.db, so scripts, dashboards and more than one GUI can share the task set.
+# One JSON object per line in both directions, a client may send the next request before the
+# answer to the previous one arrived:
+#   {"id": 1, "method": "due", "args": [null, 7200, 20]}
+#   {"id": 1, "result": [[12, "Daily", "Water the plants", 1652000000, "[8, 30]"], ...]}
+#   {"id": 2, "error": "No task with id 99"}
+# Reads run concurrently on a pool of connections (WAL lets them go on during a write),
+# writes go through a single connection and everything queued while a transaction runs
+# is committed together in the next one.
+#   python todo.py serve --address 127.0.0.1:8765
+#   python todo.py serve --address /tmp/todo.sock
+
+log = logging.getLogger(__name__)
+
+# connections serving reads, each one busy with at most one request at a time
+READER_CONNECTIONS = 4  # also named in the --readers help of todo.py
+
+# hosts a TCP address may use, the API has no authentication and only serves this machine
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+# longest request line accepted, bulk writes of many timers can get big
+LINE_LIMIT = 2**24
+
+# storage methods clients may call directly, this is what RemoteStorage forwards for the GUI
+READ_METHODS = {"load_timers", "load_timer", "load_settings", "load_stats", "has_timer", "search",
+                "overdue_timers", "urgent_timers", "load_timers_page", "max_timer_id"}
+FORWARDED_WRITES = WRITE_METHODS - {"refresh_deadlines"}
+
+# earliest deadline a recurring timer rolls over at, due reads need no deadline refresh before it
+NEXT_ROLLOVER = 'SELECT MIN("Next_Deadline") FROM "Timers" WHERE "Type" != \'Once\''
+
+
+# operations, called with the storage as first argument on a database thread
+
+def complete(database, objid, clicked):
+    # same as "todo.py done", returns whether the completion counted
+    row = database.load_timer(objid)
+    if row is None:
+        raise ValueError(f"No task with id {objid}")
+    timertype, timer = core.hydrate([row])[objid]
+    record = core.completion(timertype, timer, clicked)
+    if record is not None:
+        database.record_completion(objid, clicked, *record)
+    if timertype == "Once":
+        database.delete_timer(objid)
+    else:
+        database.set_last_clicked(objid, clicked)
+    return record is not None
+
+
+def add(database, timertype, comment, args):
+    return database.add_timer(timertype, comment, 0, json.dumps(core.validate_args(timertype, args)))
+
+
+def edit(database, objid, timertype, comment, args):
+    if not database.has_timer(objid):
+        raise ValueError(f"No task with id {objid}")
+    database.update_timer(objid, timertype, comment, json.dumps(core.validate_args(timertype, args)))
+
+
+def delete(database, objid):
+    if not database.has_timer(objid):
+        raise ValueError(f"No task with id {objid}")
+    database.delete_timer(objid)
+
+
+def refresh(database, currtime):
+    # re-materializes rolled over deadlines, returns the time until which they stay current
+    # and the change counter (core.CHANGES_SCHEMA) of the timers they were computed for
+    database.refresh_deadlines(currtime)
+    rollover = database.connection.execute(NEXT_ROLLOVER).fetchone()[0]
+    return NO_LIMIT if rollover is None else rollover, database.change_counter()
+
+
+def due(database, counter, until, limit):
+    # None if the timers changed since counter, other programs write the database too
+    if counter is not None and database.change_counter() != counter:
+        return None
+    return database.connection.execute(DUE_TIMERS, (until, -1 if limit is None else limit)).fetchall()
+
+
+def storage_method(method):
+    return lambda database, *args: getattr(database, method)(*args)
+
+
+class Server:
+    def __init__(self, path=core.DATABASE, readers=READER_CONNECTIONS):
+        # connections move between the executor's threads, but only one uses a connection at a time
+        self.writer = SqliteStorage(path, check_same_thread=False)
+        self.readers = asyncio.Queue()
+        for _ in range(readers):
+            self.readers.put_nowait(SqliteStorage(path, check_same_thread=False))
+        self.executor = ThreadPoolExecutor(readers + 1, thread_name_prefix="database")
+        self.writes = asyncio.Queue()  # (function, args, future)
+        self.rollover = 0  # Next_Deadline values are current for due reads before this time
+        self.counter = None  # as long as the change counter still has this value
+        self.operations = {"list": self.list_timers, "due": self.due, "complete": self.complete,
+                           "add": lambda *args: self.write(add, *args),
+                           "edit": lambda *args: self.write(edit, *args),
+                           "delete": lambda *args: self.write(delete, *args)}
+
+    async def read(self, function, *args):
+        # function(storage, *args) on a free reader connection
+        database = await self.readers.get()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, database, *args)
+        finally:
+            self.readers.put_nowait(database)
+
+    async def write(self, function, *args):
+        # function(storage, *args) in the next transaction
+        future = asyncio.get_running_loop().create_future()
+        self.writes.put_nowait((function, args, future))
+        return await future
+
+    def _transaction(self, batch):
+        # one transaction for the batch and a savepoint per write inside it,
+        # so a failing write doesn't take the rest of the batch down
+        # returns [(result, exception)]
+        connection = self.writer.connection
+        # a savepoint outside of a transaction would be one of its own, committed by its RELEASE
+        connection.execute("BEGIN IMMEDIATE")
+        results = []
+        for function, args, future in batch:
+            connection.execute("SAVEPOINT request")
+            try:
+                results.append((function(self.writer, *args), None))
+                connection.execute("RELEASE request")
+            except Exception as error:
+                connection.execute("ROLLBACK TO request")
+                connection.execute("RELEASE request")
+                results.append((None, error))
+        self.writer.commit()
+        return results
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.writes.get()]
+            while not self.writes.empty():
+                batch.append(self.writes.get_nowait())
+            perfstats.count("api.writes", len(batch))
+            try:
+                results = await loop.run_in_executor(self.executor, self._transaction, batch)
+            except Exception as error:
+                self.writer.rollback()
+                results = [(None, error)] * len(batch)
+
+            # added and edited timers have new deadlines, only a batch of refreshes knows the next rollover
+            refreshed = [result for (function, args, future), (result, error) in zip(batch, results)
+                         if function is refresh and error is None]
+            self.rollover, self.counter = refreshed[-1] if len(refreshed) == len(batch) else (0, None)
+
+            for (function, args, future), (result, error) in zip(batch, results):
+                if future.cancelled():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+    async def list_timers(self):
+        return await self.read(storage_method("load_timers"))
+
+    async def due(self, currtime=None, within=None, limit=None):
+        # unfinished timers by next deadline, optionally only those due within seconds
+        if currtime is None:
+            currtime = time_int()
+        until = NO_LIMIT if within is None else currtime + within
+        rows = None
+        if currtime < self.rollover:
+            rows = await self.read(due, self.counter, until, limit)
+        if rows is None:
+            # refreshing is a write, done once per rollover or change by another program instead of before every read
+            await self.write(refresh, currtime)
+            rows = await self.read(due, None, until, limit)
+        return rows
+
+    async def complete(self, objid, clicked=None):
+        return await self.write(complete, objid, time_int() if clicked is None else clicked)
+
+    async def call(self, method, args):
+        if method in self.operations:
+            return await self.operations[method](*args)
+        if method in READ_METHODS:
+            result = await self.read(storage_method(method), *args)
+            if method == "load_stats":
+                # JSON object keys are strings, the ID: values mapping goes out as pairs
+                return list(result.items())
+            return result
+        if method in FORWARDED_WRITES:
+            return await self.write(storage_method(method), *args)
+        raise ValueError(f"Unknown method \"{method}\"")
+
+    async def answer(self, line, writer, lock):
+        request = None
+        try:
+            request = json.loads(line)
+            with perfstats.timed("api.request"):
+                response = {"id": request.get("id"), "result": await self.call(request["method"], request.get("args", []))}
+        except Exception as error:
+            # a broken request only fails itself, the connection stays open
+            response = {"id": request.get("id") if isinstance(request, dict) else None, "error": str(error)}
+        await send(writer, lock, response)
+
+    async def handle(self, reader, writer):
+        # requests of a connection are answered concurrently, in the order they finish
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await read_line(reader)
+                except ValueError as error:
+                    await send(writer, lock, {"id": None, "error": str(error)})
+                    continue
+                if not line:
+                    break
+                task = asyncio.create_task(self.answer(line, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, address=DEFAULT_ADDRESS, started=None):
+        # started() is called once the socket listens
+        host, port = parse_address(address)
+        if port is None:
+            server = await asyncio.start_unix_server(self.handle, host, limit=LINE_LIMIT)
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=LINE_LIMIT)
+        writeloop = asyncio.create_task(self._write_loop())
+        log.info(f"Serving timers on {address}")
+        if started is not None:
+            started()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            writeloop.cancel()
+            self.close()
+
+    def close(self):
+        self.executor.shutdown()
+        self.writer.close()
+        while not self.readers.empty():
+            self.readers.get_nowait().close()
+
+
+async def read_line(reader):
+    # next request line, b"" at the end of the stream
+    # a line longer than LINE_LIMIT is skipped up to its end and raises ValueError
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError as error:
+        return error.partial
+    except asyncio.LimitOverrunError as error:
+        overrun = error
+    try:
+        while True:
+            # drops what is buffered so far, up to the newline if it is in there
+            await reader.readexactly(overrun.consumed)
+            try:
+                await reader.readuntil(b"\n")
+                break
+            except asyncio.LimitOverrunError as error:
+                overrun = error
+    except asyncio.IncompleteReadError:
+        pass
+    raise ValueError(f"Request longer than {LINE_LIMIT} bytes")
+
+
+async def send(writer, lock, response):
+    async with lock:
+        writer.write(json.dumps(response).encode() + b"\n")
+        await writer.drain()
+
+
+def serve(path=core.DATABASE, address=DEFAULT_ADDRESS, readers=READER_CONNECTIONS):
+    host, port = parse_address(address)
+    if port is not None and host not in LOCAL_HOSTS:
+        raise ValueError(f"Refusing to listen on \"{host}\", use a loopback address or a socket path")
+    try:
+        asyncio.run(Server(path, readers).serve(address))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,100 @@
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from recurrence import intern_rule, rule_texts
+from timerstore import TimerStore
+
+# Binary snapshot of the TimerStore arrays next to timers.db, so a start with an unchanged
+# database maps the arrays straight from the file instead of loading and parsing every row.
+# The snapshot records the change counter of the database (core.CHANGES_SCHEMA) and is
+# ignored as soon as the counter differs.
+# File layout: MAGIC, header length (uint32), JSON header, arrays at ALIGNMENT byte offsets.
+# Rule timers store positions in recurrence.rule_texts, the header lists the texts so they are
+# renumbered for the interning of the loading process.
+
+MAGIC = b"TODOSNAP"
+VERSION = 2
+ALIGNMENT = 8
+
+
+def snapshot_path(database):
+    return database + ".snapshot"
+
+
+def store_arrays(store):
+    # name: array of everything needed to rebuild the store
+    arrays = {"typecodes": store.typecodes, "rows": store.rows,
+              "commentstarts": store.commentstarts, "commentlengths": store.commentlengths,
+              "text": np.frombuffer(bytes(store.text), dtype=np.uint8)}
+    for timertype, group in store.groups.items():
+        arrays[f"{timertype}.ids"] = group.ids[:group.size]
+        arrays[f"{timertype}.lastclicked"] = group.lastclicked[:group.size]
+        for name, column in group.columns.items():
+            arrays[f"{timertype}.{name}"] = column[:group.size]
+    return arrays
+
+
+def save(store, path, counter):
+    # written to a temporary file first, an interrupted save never leaves a broken snapshot behind
+    if store.garbage:
+        store._compact()
+    arrays = store_arrays(store)
+    layout = []
+    offset = 0
+    for name, array in arrays.items():
+        layout.append([name, array.dtype.str, offset, len(array)])
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header = json.dumps({"version": VERSION, "counter": counter, "count": store.count,
+                         "rules": rule_texts, "arrays": layout}).encode()
+    start = -(-(len(MAGIC) + 4 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as output:
+        output.write(MAGIC + struct.pack("<I", len(header)) + header)
+        for (name, dtype, arrayoffset, length), array in zip(layout, arrays.values()):
+            output.seek(start + arrayoffset)
+            output.write(np.ascontiguousarray(array).tobytes())
+        output.truncate(start + offset)
+    os.replace(temporary, path)
+
+
+def load(path, counter):
+    # TimerStore backed by a copy-on-write mapping of the snapshot, None if it is missing,
+    # unreadable or doesn't match counter
+    try:
+        with open(path, "rb") as source:
+            mapping = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_COPY)
+    except (OSError, ValueError):
+        return None
+    try:
+        if mapping[:len(MAGIC)] != MAGIC:
+            return None
+        headerlength, = struct.unpack_from("<I", mapping, len(MAGIC))
+        header = json.loads(mapping[len(MAGIC) + 4:len(MAGIC) + 4 + headerlength])
+        if header["version"] != VERSION or header["counter"] != counter:
+            return None
+        start = -(-(len(MAGIC) + 4 + headerlength) // ALIGNMENT) * ALIGNMENT
+        arrays = {name: np.frombuffer(mapping, dtype=dtype, count=length, offset=start + offset)
+                  for name, dtype, offset, length in header["arrays"]}
+        rules = np.array([intern_rule(text) for text in header["rules"]], dtype=np.int32)
+        arrays["Rule.rule"] = rules[arrays["Rule.rule"]]
+    except (ValueError, KeyError, TypeError, IndexError, struct.error):
+        return None
+
+    # group arrays stay mapped until they grow, the store only writes to its private copy
+    store = TimerStore()
+    store.typecodes, store.rows = arrays["typecodes"], arrays["rows"]
+    store.commentstarts, store.commentlengths = arrays["commentstarts"], arrays["commentlengths"]
+    store.text = bytearray(arrays["text"])
+    store.count = header["count"]
+    for timertype, group in store.groups.items():
+        group.ids = arrays[f"{timertype}.ids"]
+        group.lastclicked = arrays[f"{timertype}.lastclicked"]
+        group.size = len(group.ids)
+        for name in group.columns:
+            group.columns[name] = arrays[f"{timertype}.{name}"]
+    return store
@@ -0,0 +1,504 @@
+import json
+import socket
+import sqlite3
+from os import environ
+
+import core
+import perfstats
+from timerclasses import time_int
+
+# Storage backends for the Timers/Settings tables defined in db.py.
+# Both expose the same methods, changes are only persisted by commit().
+#   "orm"    - SQLAlchemy session over the declarative models in db.py
+#   "sqlite" - stdlib sqlite3 with WAL journaling and cached prepared statements
+#   "remote" - client of the JSON API served by "todo.py serve" (server.py) at TODO_SERVER
+
+SCHEDULE_NAMES = ", ".join(f'"{column}"' for column in core.SCHEDULE_COLUMNS)
+SCHEDULE_SETTERS = ", ".join(f'"{column}" = ?' for column in core.SCHEDULE_COLUMNS)
+
+SELECT_TIMERS = 'SELECT id, "Type", "Comment", "Last_Clicked", "Data" FROM "Timers"'
+SELECT_TIMER = SELECT_TIMERS + ' WHERE id = ?'
+SELECT_SETTINGS = 'SELECT "Name", "Value" FROM "Settings"'
+HAS_TIMER = 'SELECT 1 FROM "Timers" WHERE id = ?'
+INSERT_TIMER = (f'INSERT INTO "Timers" (id, "Type", "Comment", "Last_Clicked", "Data", {SCHEDULE_NAMES}, "Tags") '
+                f'VALUES (?, ?, ?, ?, ?, {", ".join("?" * len(core.SCHEDULE_COLUMNS))}, ?)')
+UPDATE_TIMER = (f'UPDATE "Timers" SET "Type" = ?, "Comment" = ?, "Data" = ?, {SCHEDULE_SETTERS}, "Tags" = ? '
+                f'WHERE id = ?')
+UPDATE_CLICKED = 'UPDATE "Timers" SET "Last_Clicked" = ? WHERE id = ?'
+DELETE_TIMER = 'DELETE FROM "Timers" WHERE id = ?'
+# bulk versions taking the IDs as one JSON array parameter, a single statement for any number of timers
+SELECTED_IDS = 'SELECT value FROM json_each(?)'
+UPDATE_CLICKED_MANY = f'UPDATE "Timers" SET "Last_Clicked" = ? WHERE id IN ({SELECTED_IDS})'
+DELETE_TIMERS = f'DELETE FROM "Timers" WHERE id IN ({SELECTED_IDS})'
+INSERT_SETTING = 'INSERT INTO "Settings" ("Name", "Value") VALUES (?, ?)'
+UPDATE_SETTING = 'UPDATE "Settings" SET "Value" = ? WHERE "Name" = ?'
+# deadline queries, all of them are range scans over the deadline indexes
+STALE_TIMERS = 'SELECT id, "Type", "Data" FROM "Timers" WHERE "Next_Deadline" <= ? AND "Type" != \'Once\''
+UPDATE_DEADLINES = 'UPDATE "Timers" SET "Last_Deadline" = ?, "Next_Deadline" = ? WHERE id = ?'
+DUE_TIMERS = (SELECT_TIMERS + ' WHERE "Last_Clicked" < "Last_Deadline" AND "Next_Deadline" <= ?'
+              ' ORDER BY "Next_Deadline", id LIMIT ?')
+# startup pages: the most urgent unfinished timers first, then all of them in ID order
+URGENT_TIMERS = SELECT_TIMERS + ' WHERE "Last_Clicked" < "Last_Deadline" ORDER BY "Next_Deadline", id LIMIT ?'
+TIMERS_PAGE = SELECT_TIMERS + ' WHERE id > ? ORDER BY id LIMIT ?'
+MAX_TIMER_ID = 'SELECT MAX(id) FROM "Timers"'
+OVERDUE_TIMERS = (SELECT_TIMERS + ' WHERE "Type" = \'Once\' AND "Next_Deadline" <= ?'
+                  ' ORDER BY "Next_Deadline", id')
+
+# completions: one History row each and an in-place update of the timer's Stats row,
+# all SET expressions see the values from before the update
+INSERT_HISTORY = 'INSERT INTO "History" ("Timer", "Clicked", "Deadline", "Missed") VALUES (?, ?, ?, ?)'
+UPSERT_STATS = ('INSERT INTO "Stats" ("Timer", "Completions", "On_Time", "Streak", "Best_Streak", "Lateness_Sum") '
+                'VALUES (?, 1, ?, ?, ?, ?) ON CONFLICT ("Timer") DO UPDATE SET '
+                '"Completions" = "Completions" + 1, '
+                '"On_Time" = "On_Time" + excluded."On_Time", '
+                '"Streak" = CASE WHEN excluded."On_Time" THEN "Streak" + 1 ELSE 0 END, '
+                '"Best_Streak" = MAX("Best_Streak", CASE WHEN excluded."On_Time" THEN "Streak" + 1 ELSE 0 END), '
+                '"Lateness_Sum" = "Lateness_Sum" + excluded."Lateness_Sum"')
+SELECT_STATS = ('SELECT "Timer", "Completions", "On_Time", "Streak", "Best_Streak", "Lateness_Sum" FROM "Stats"')
+DELETE_STATS = 'DELETE FROM "Stats" WHERE "Timer" = ?'
+DELETE_STATS_MANY = f'DELETE FROM "Stats" WHERE "Timer" IN ({SELECTED_IDS})'
+
+# "until" value meaning no upper bound on deadlines
+NO_LIMIT = 2**62
+
+# where "todo.py serve" listens and RemoteStorage connects: "host:port" or a Unix socket path
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+
+
+class SqliteStorage:
+    def __init__(self, path=core.DATABASE, check_same_thread=True):
+        # statements above are compiled once and then served from the connection's cache
+        # check_same_thread=False for connections handed between threads, see server.py
+        self.connection = sqlite3.connect(path, cached_statements=64, check_same_thread=check_same_thread)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # WAL keeps the database consistent with NORMAL sync, only the last commits may be lost on power failure
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in core.SCHEMA:
+            self.connection.execute(statement)
+        core.upgrade_schema(self.connection.cursor())
+        self.connection.commit()
+
+    def load_timers(self):
+        # [(ID, type, comment, last clicked, JSON data)]
+        return self.connection.execute(SELECT_TIMERS).fetchall()
+
+    def iter_timers(self):
+        # streams rows straight from the cursor instead of building a list
+        return self.connection.execute(SELECT_TIMERS)
+
+    def load_timer(self, objid):
+        # the row of one timer, None if there is none with that ID
+        return self.connection.execute(SELECT_TIMER, (objid,)).fetchone()
+
+    def urgent_timers(self, limit):
+        # unfinished timers with the earliest materialized deadlines, call refresh_deadlines() first
+        return self.connection.execute(URGENT_TIMERS, (limit,)).fetchall()
+
+    def load_timers_page(self, after, limit):
+        # up to limit timers with IDs above after, in ID order
+        return self.connection.execute(TIMERS_PAGE, (after, limit)).fetchall()
+
+    def max_timer_id(self):
+        return self.connection.execute(MAX_TIMER_ID).fetchone()[0] or 0
+
+    def load_settings(self):
+        return {name: bool(value) for name, value in self.connection.execute(SELECT_SETTINGS)}
+
+    def has_timer(self, objid):
+        return self.connection.execute(HAS_TIMER, (objid,)).fetchone() is not None
+
+    def add_timer(self, timertype, comment, lastclicked, data, objid=None):
+        # objid = None lets the database pick the ID, returns the ID
+        values = (objid, timertype, comment, lastclicked, data, *core.schedule_values(timertype, data),
+                  core.comment_tags(comment))
+        return self.connection.execute(INSERT_TIMER, values).lastrowid
+
+    def add_timers(self, rows, schedules=None):
+        # rows = iterable of (type, comment, last clicked, JSON data)
+        # schedules = matching SCHEDULE_COLUMNS values if the caller already computed them
+        # rows are read twice when the schedules are computed here, an iterator would run out after the first pass
+        rows = list(rows)
+        if schedules is None:
+            currtime = time_int()
+            schedules = (core.schedule_values(row[0], row[3], currtime) for row in rows)
+        self.connection.executemany(INSERT_TIMER, ((None, *row, *schedule, core.comment_tags(row[1]))
+                                                   for row, schedule in zip(rows, schedules)))
+
+    def update_timer(self, objid, timertype, comment, data):
+        values = (timertype, comment, data, *core.schedule_values(timertype, data), core.comment_tags(comment), objid)
+        self.connection.execute(UPDATE_TIMER, values)
+
+    def update_timers(self, rows):
+        # rows = iterable of (ID, type, comment, JSON data)
+        currtime = time_int()
+        self.connection.executemany(UPDATE_TIMER, ((timertype, comment, data,
+                                                    *core.schedule_values(timertype, data, currtime),
+                                                    core.comment_tags(comment), objid)
+                                                   for objid, timertype, comment, data in rows))
+
+    def set_last_clicked(self, objid, lastclicked):
+        self.connection.execute(UPDATE_CLICKED, (lastclicked, objid))
+
+    def set_last_clicked_many(self, objids, lastclicked):
+        self.connection.execute(UPDATE_CLICKED_MANY, (lastclicked, json.dumps(list(objids))))
+
+    def delete_timer(self, objid):
+        self.connection.execute(DELETE_TIMER, (objid,))
+        self.connection.execute(DELETE_STATS, (objid,))
+
+    def delete_timers(self, objids):
+        objids = json.dumps(list(objids))
+        self.connection.execute(DELETE_TIMERS, (objids,))
+        self.connection.execute(DELETE_STATS_MANY, (objids,))
+
+    def record_completion(self, objid, clicked, deadline, missed):
+        # O(1) regardless of the history length, the Stats row is updated and never recomputed
+        self.record_completions([(objid, clicked, deadline, missed)])
+
+    def record_completions(self, rows):
+        # rows = list of (ID, clicked, deadline, missed)
+        self.connection.executemany(INSERT_HISTORY, rows)
+        # only completions that missed a deadline count as late, by the time since the last one they missed
+        self.connection.executemany(UPSERT_STATS, ((objid, int(missed == 0), int(missed == 0), int(missed == 0),
+                                                    clicked - deadline if missed else 0)
+                                                   for objid, clicked, deadline, missed in rows))
+
+    def load_stats(self):
+        # {ID: (completions, on time, streak, best streak, lateness sum)}
+        return {row[0]: row[1:] for row in self.connection.execute(SELECT_STATS)}
+
+    def add_settings(self, items):
+        self.connection.executemany(INSERT_SETTING, items)
+
+    def set_setting(self, name, value):
+        self.connection.execute(UPDATE_SETTING, (value, name))
+
+    def refresh_deadlines(self, currtime=None):
+        # re-materializes the deadlines of recurring timers that rolled over, returns their count
+        if currtime is None:
+            currtime = time_int()
+        stale = self.connection.execute(STALE_TIMERS, (currtime,)).fetchall()
+        updates = []
+        for objid, timertype, data in stale:
+            lastdeadline, nextdeadline = core.schedule_values(timertype, data, currtime)[-2:]
+            updates.append((lastdeadline, nextdeadline, objid))
+        self.connection.executemany(UPDATE_DEADLINES, updates)
+        return len(stale)
+
+    def due_timers(self, currtime=None, within=None, limit=None):
+        # unfinished timers ordered by next deadline, optionally only those due within seconds
+        if currtime is None:
+            currtime = time_int()
+        self.refresh_deadlines(currtime)
+        until = NO_LIMIT if within is None else currtime + within
+        return self.connection.execute(DUE_TIMERS, (until, -1 if limit is None else limit)).fetchall()
+
+    def overdue_timers(self, currtime=None):
+        # one-time timers past their deadline, the only kind that can be overdue
+        if currtime is None:
+            currtime = time_int()
+        return self.connection.execute(OVERDUE_TIMERS, (currtime,)).fetchall()
+
+    def search(self, text):
+        # IDs of timers matching search box text, see core.search_query
+        query = core.search_query(text)
+        if not query:
+            return []
+        return [row[0] for row in self.connection.execute(core.SEARCH, (query,))]
+
+    def change_counter(self, lock=False):
+        # lock = take the write lock first, the value then stays valid until commit() or rollback()
+        if lock:
+            self.connection.execute(core.LOCK_CHANGES)
+        return self.connection.execute(core.SELECT_CHANGES).fetchone()[0]
+
+    def commit(self):
+        with perfstats.timed("db.commit"):
+            self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+
+class OrmStorage:
+    def __init__(self, path=core.DATABASE):
+        # imported here so the sqlite backend never pays for SQLAlchemy
+        from sqlalchemy.orm import sessionmaker
+        import db
+        self.db = db
+
+        engine = db.create_engine(f"sqlite:///{path}")
+        db.Base.metadata.create_all(engine)
+        connection = engine.raw_connection()
+        core.upgrade_schema(connection.cursor())
+        connection.commit()
+        connection.close()
+        self.session = sessionmaker(bind=engine)()
+
+    def load_timers(self):
+        return list(self._rows(self.session.query(self.db.Timers).all()))
+
+    def iter_timers(self):
+        return self._rows(self.session.query(self.db.Timers).yield_per(1000))
+
+    def _columns(self):
+        # plain row tuples, the session doesn't keep track of them like it does with Timers objects
+        Timers = self.db.Timers
+        return self.session.query(Timers.id, Timers.type, Timers.comment, Timers.last_clicked, Timers.data)
+
+    def load_timer(self, objid):
+        row = self._columns().filter(self.db.Timers.id == objid).first()
+        return tuple(row) if row is not None else None
+
+    def urgent_timers(self, limit):
+        Timers = self.db.Timers
+        query = self._columns().filter(Timers.last_clicked < Timers.last_deadline)
+        return [tuple(row) for row in query.order_by(Timers.next_deadline, Timers.id).limit(limit)]
+
+    def load_timers_page(self, after, limit):
+        Timers = self.db.Timers
+        return [tuple(row) for row in self._columns().filter(Timers.id > after).order_by(Timers.id).limit(limit)]
+
+    def max_timer_id(self):
+        from sqlalchemy import func
+        return self.session.query(func.max(self.db.Timers.id)).scalar() or 0
+
+    def load_settings(self):
+        return {entry.name: entry.value for entry in self.session.query(self.db.Settings).all()}
+
+    def has_timer(self, objid):
+        return self.session.query(self.db.Timers).get(objid) is not None
+
+    def add_timer(self, timertype, comment, lastclicked, data, objid=None):
+        newdbentry = self.db.Timers(timertype, comment, lastclicked, data)
+        newdbentry.id = objid
+        self.session.add(newdbentry)
+        self.session.flush()
+        return newdbentry.id
+
+    def add_timers(self, rows, schedules=None):
+        # the model computes its own schedule columns
+        self.session.add_all([self.db.Timers(*row) for row in rows])
+
+    def update_timer(self, objid, timertype, comment, data):
+        db_entry = self.session.query(self.db.Timers).get(objid)
+        db_entry.type = timertype
+        db_entry.comment = comment
+        db_entry.data = data
+        db_entry.update_schedule()
+
+    def update_timers(self, rows):
+        for objid, timertype, comment, data in rows:
+            self.update_timer(objid, timertype, comment, data)
+
+    def set_last_clicked(self, objid, lastclicked):
+        self.session.query(self.db.Timers).get(objid).last_clicked = lastclicked
+
+    def set_last_clicked_many(self, objids, lastclicked):
+        Timers = self.db.Timers
+        self.session.query(Timers).filter(Timers.id.in_(list(objids))).update(
+            {Timers.last_clicked: lastclicked}, synchronize_session="fetch")
+
+    def delete_timer(self, objid):
+        self.session.delete(self.session.query(self.db.Timers).get(objid))
+        self.session.query(self.db.Stats).filter(self.db.Stats.timer == objid).delete()
+
+    def delete_timers(self, objids):
+        objids = list(objids)
+        self.session.query(self.db.Timers).filter(self.db.Timers.id.in_(objids)).delete(synchronize_session="fetch")
+        self.session.query(self.db.Stats).filter(self.db.Stats.timer.in_(objids)).delete(synchronize_session="fetch")
+
+    def record_completion(self, objid, clicked, deadline, missed):
+        ontime = int(missed == 0)
+        self.session.add(self.db.History(objid, clicked, deadline, missed))
+        stats = self.session.query(self.db.Stats).get(objid)
+        if stats is None:
+            stats = self.db.Stats(objid)
+            self.session.add(stats)
+        stats.completions += 1
+        stats.on_time += ontime
+        stats.streak = stats.streak + 1 if ontime else 0
+        stats.best_streak = max(stats.best_streak, stats.streak)
+        if not ontime:
+            stats.lateness_sum += clicked - deadline
+
+    def record_completions(self, rows):
+        for row in rows:
+            self.record_completion(*row)
+
+    def load_stats(self):
+        return {entry.timer: (entry.completions, entry.on_time, entry.streak, entry.best_streak, entry.lateness_sum)
+                for entry in self.session.query(self.db.Stats).all()}
+
+    def add_settings(self, items):
+        self.session.add_all(self.db.Settings(*item) for item in items)
+
+    def set_setting(self, name, value):
+        self.session.query(self.db.Settings).get(name).value = value
+
+    def refresh_deadlines(self, currtime=None):
+        if currtime is None:
+            currtime = time_int()
+        Timers = self.db.Timers
+        stale = self.session.query(Timers).filter(Timers.next_deadline <= currtime, Timers.type != "Once").all()
+        for entry in stale:
+            entry.update_schedule(currtime)
+        return len(stale)
+
+    def _rows(self, query):
+        return ((entry.id, entry.type, entry.comment, entry.last_clicked, entry.data) for entry in query)
+
+    def due_timers(self, currtime=None, within=None, limit=None):
+        if currtime is None:
+            currtime = time_int()
+        self.refresh_deadlines(currtime)
+        Timers = self.db.Timers
+        query = self.session.query(Timers).filter(Timers.last_clicked < Timers.last_deadline)
+        if within is not None:
+            query = query.filter(Timers.next_deadline <= currtime + within)
+        query = query.order_by(Timers.next_deadline, Timers.id)
+        if limit is not None:
+            query = query.limit(limit)
+        return list(self._rows(query))
+
+    def search(self, text):
+        query = core.search_query(text)
+        if not query:
+            return []
+        return [row[0] for row in self.session.connection().exec_driver_sql(core.SEARCH, (query,))]
+
+    def change_counter(self, lock=False):
+        # pending changes are flushed first, they only reach the triggers when written
+        self.session.flush()
+        connection = self.session.connection()
+        if lock:
+            connection.exec_driver_sql(core.LOCK_CHANGES)
+        return connection.exec_driver_sql(core.SELECT_CHANGES).scalar()
+
+    def overdue_timers(self, currtime=None):
+        if currtime is None:
+            currtime = time_int()
+        Timers = self.db.Timers
+        query = self.session.query(Timers).filter(Timers.type == "Once", Timers.next_deadline <= currtime)
+        return list(self._rows(query.order_by(Timers.next_deadline, Timers.id)))
+
+    def commit(self):
+        with perfstats.timed("db.commit"):
+            self.session.commit()
+
+    def rollback(self):
+        self.session.rollback()
+
+    def close(self):
+        self.session.close()
+
+
+def json_value(value):
+    # numpy numbers and arrays, generators and other iterables the GUI passes as arguments
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return list(value)
+
+
+def parse_address(address):
+    # (host, port) for "host:port", (path, None) for a Unix socket path
+    host, separator, port = address.rpartition(":")
+    if not separator or "/" in address:
+        return address, None
+    if not port.isdigit():
+        raise ValueError(f"Invalid address \"{address}\", use host:port or a socket path")
+    return host.strip("[]"), int(port)
+
+
+class RemoteStorage:
+    # every method is a request to the API server, which commits each write on its own
+    def __init__(self, path=core.DATABASE, address=None):
+        # path is unused, the server decides which database it serves
+        host, port = parse_address(address or environ.get("TODO_SERVER", DEFAULT_ADDRESS))
+        if port is None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(host)
+        else:
+            self.socket = socket.create_connection((host, port))
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.stream = self.socket.makefile("rwb")
+        self.requestid = 0
+
+    def request(self, method, *args):
+        self.requestid += 1
+        request = {"id": self.requestid, "method": method, "args": args}
+        self.stream.write(json.dumps(request, default=json_value).encode() + b"\n")
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("Todo server closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response["result"]
+
+    def __getattr__(self, name):
+        # the storage methods the server forwards, see server.READ_METHODS and server.FORWARDED_WRITES
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return lambda *args: self.request(name, *args)
+
+    def load_timers(self):
+        return [tuple(row) for row in self.request("load_timers")]
+
+    def iter_timers(self):
+        return iter(self.load_timers())
+
+    def load_timer(self, objid):
+        row = self.request("load_timer", objid)
+        return tuple(row) if row is not None else None
+
+    def urgent_timers(self, limit):
+        return [tuple(row) for row in self.request("urgent_timers", limit)]
+
+    def load_timers_page(self, after, limit):
+        return [tuple(row) for row in self.request("load_timers_page", after, limit)]
+
+    def load_stats(self):
+        return {objid: tuple(values) for objid, values in self.request("load_stats")}
+
+    def due_timers(self, currtime=None, within=None, limit=None):
+        return [tuple(row) for row in self.request("due", currtime, within, limit)]
+
+    def add_timers(self, rows, schedules=None):
+        # the server computes the schedule columns itself, the rows go out as a JSON array
+        self.request("add_timers", list(rows))
+
+    def change_counter(self, lock=False):
+        # other clients write at any time, so there is no counter to keep a local snapshot in sync with
+        return None
+
+    def refresh_deadlines(self, currtime=None):
+        # the server refreshes deadlines on its own
+        return 0
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.stream.close()
+        self.socket.close()
+
+
+backends = {
+    "orm": OrmStorage,
+    "sqlite": SqliteStorage,
+    "remote": RemoteStorage
+}
+
+
+def open_storage(backend, path=core.DATABASE):
+    if backend not in backends:
+        raise ValueError(f"Unknown storage backend \"{backend}\", use one of {', '.join(backends)}")
+    return backends[backend](path)
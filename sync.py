@@ -0,0 +1,182 @@
+import json
+import logging
+import random
+import zlib
+from os import listdir
+from os.path import getsize, join as joinpath
+from socket import gethostname
+
+import core
+from storage import SCHEDULE_NAMES
+
+# Delta sync of timers and settings between machines through a shared directory, e.g. a synced
+# folder or a network share. Every machine appends the rows it changed since its last sync to its
+# own <machine ID>.jsonl in the directory and reads what the others appended since it last looked,
+# so a sync costs time and bytes in proportion to the changes, never to the database size.
+# Conflicts are resolved per row with the version stamps in core.SYNC_SCHEMA: the definition
+# (type, comment, data) and Last_Clicked each take the value with the highest stamp, settings as
+# well, and deletions win over any change. Every machine ends up with the same result no matter
+# in which order the changes arrive.
+#   python todo.py sync /mnt/share/todo
+# Completion history and statistics stay local.
+
+log = logging.getLogger(__name__)
+
+SELECT_META = 'SELECT "Value" FROM "Meta" WHERE "Name" = ?'
+SET_META = 'UPDATE "Meta" SET "Value" = ? WHERE "Name" = ?'
+
+CHANGED_TIMERS = ('SELECT "Uid", "Type", "Comment", "Data", "Def_Stamp", "Last_Clicked", "Click_Stamp" '
+                  'FROM "Timers" WHERE "Seq" > ?')
+CHANGED_DELETED = 'SELECT "Uid", "Stamp" FROM "Deleted" WHERE "Seq" > ?'
+CHANGED_SETTINGS = 'SELECT "Name", "Value", "Stamp" FROM "Settings" WHERE "Seq" > ?'
+
+SELECT_BY_UID = ('SELECT id, "Type", "Comment", "Data", "Last_Clicked", "Def_Stamp", "Click_Stamp", "Seq" '
+                 'FROM "Timers" WHERE "Uid" = ?')
+IS_DELETED = 'SELECT 1 FROM "Deleted" WHERE "Uid" = ?'
+INSERT_TIMER = (f'INSERT INTO "Timers" ("Uid", "Type", "Comment", "Last_Clicked", "Data", '
+                f'{SCHEDULE_NAMES}, "Tags") '
+                f'VALUES (?, ?, ?, ?, ?, {", ".join("?" * len(core.SCHEDULE_COLUMNS))}, ?)')
+# imported values keep the stamps they were made with, and the local Seq: imported changes aren't sent
+# back out, local ones not synced yet still are
+SET_STAMPS = 'UPDATE "Timers" SET "Def_Stamp" = ?, "Click_Stamp" = ?, "Seq" = ? WHERE "Uid" = ?'
+SET_DELETED = 'INSERT OR REPLACE INTO "Deleted" ("Uid", "Stamp", "Seq") VALUES (?, ?, 0)'
+SELECT_SETTING = 'SELECT "Value", "Stamp", "Seq" FROM "Settings" WHERE "Name" = ?'
+INSERT_SETTING = 'INSERT INTO "Settings" ("Name", "Value", "Stamp", "Seq") VALUES (?, ?, ?, 0)'
+UPDATE_SETTING = 'UPDATE "Settings" SET "Value" = ? WHERE "Name" = ?'
+SET_SETTING_STAMP = 'UPDATE "Settings" SET "Stamp" = ?, "Seq" = ? WHERE "Name" = ?'
+SELECT_OFFSET = 'SELECT "Offset" FROM "Sync_Peers" WHERE "File" = ?'
+SET_OFFSET = 'INSERT OR REPLACE INTO "Sync_Peers" ("File", "Offset") VALUES (?, ?)'
+
+
+def machine_id(connection):
+    # a database copied to another computer gets a machine ID of its own there on its first sync and sends all
+    # of its timers once, copies made before syncing started would share the machine ID and change file otherwise
+    host = zlib.crc32(gethostname().encode())
+    stored = connection.execute(SELECT_META, ("host",)).fetchone()
+    if stored is None or stored[0] != host:
+        connection.execute('INSERT OR REPLACE INTO "Meta" ("Name", "Value") VALUES (\'host\', ?)', (host,))
+        connection.execute(SET_META, (random.getrandbits(62), "machine"))
+        connection.execute(SET_META, (0, "exported"))
+    return connection.execute(SELECT_META, ("machine",)).fetchone()[0]
+
+
+def changefile(machine):
+    return f"{machine:016x}.jsonl"
+
+
+def export_changes(connection, path):
+    # appends the rows changed since the last export, returns their number
+    exported = connection.execute(SELECT_META, ("exported",)).fetchone()[0]
+    lines = []
+    for uid, timertype, comment, data, defstamp, lastclicked, clickstamp in connection.execute(CHANGED_TIMERS, (exported,)):
+        lines.append({"uid": uid, "type": timertype, "comment": comment, "data": data, "defstamp": defstamp,
+                      "clicked": lastclicked, "clickstamp": clickstamp})
+    for uid, stamp in connection.execute(CHANGED_DELETED, (exported,)):
+        lines.append({"uid": uid, "deleted": stamp})
+    for name, value, stamp in connection.execute(CHANGED_SETTINGS, (exported,)):
+        lines.append({"setting": name, "value": bool(value), "stamp": stamp})
+    if lines:
+        with open(path, "a", encoding="utf-8") as output:
+            output.write("".join(json.dumps(line, separators=(",", ":")) + "\n" for line in lines))
+    connection.execute(SET_META, (connection.execute(SELECT_META, ("seq",)).fetchone()[0], "exported"))
+    return len(lines)
+
+
+def read_new(connection, directory, filename):
+    # complete lines appended to another machine's file since the last sync, the offset is stored right away
+    path = joinpath(directory, filename)
+    stored = connection.execute(SELECT_OFFSET, (filename,)).fetchone()
+    offset = stored[0] if stored is not None else 0
+    if getsize(path) < offset:
+        # the file was replaced, e.g. by a fresh copy, all of it is read again
+        offset = 0
+    with open(path, "rb") as source:
+        source.seek(offset)
+        data = source.read()
+    # the other machine may be in the middle of writing the last line
+    data = data[:data.rfind(b"\n") + 1]
+    connection.execute(SET_OFFSET, (filename, offset + len(data)))
+    return data.decode("utf-8").splitlines()
+
+
+def apply_timer(storage, change):
+    # returns whether anything changed
+    connection = storage.connection
+    uid = change["uid"]
+    if connection.execute(IS_DELETED, (uid,)).fetchone() is not None:
+        return False
+    args = core.validate_args(change["type"], json.loads(change["data"]))
+    row = connection.execute(SELECT_BY_UID, (uid,)).fetchone()
+    if row is None:
+        connection.execute(INSERT_TIMER, (uid, change["type"], change["comment"], change["clicked"], change["data"],
+                                          *core.schedule_values(change["type"], json.dumps(args)),
+                                          core.comment_tags(change["comment"])))
+        connection.execute(SET_STAMPS, (change["defstamp"], change["clickstamp"], 0, uid))
+        return True
+
+    objid, timertype, comment, data, lastclicked, defstamp, clickstamp, seq = row
+    # equal stamps (copies of one database changing the same timer in the same millisecond) are decided by
+    # the values, so both sides still pick the same one
+    newer = False
+    if (change["defstamp"], change["type"], change["comment"], change["data"]) > (defstamp or 0, timertype, comment, data):
+        storage.update_timer(objid, change["type"], change["comment"], change["data"])
+        defstamp, newer = change["defstamp"], True
+    if (change["clickstamp"], change["clicked"]) > (clickstamp or 0, lastclicked):
+        storage.set_last_clicked(objid, change["clicked"])
+        clickstamp, newer = change["clickstamp"], True
+    if newer:
+        connection.execute(SET_STAMPS, (defstamp, clickstamp, seq, uid))
+    return newer
+
+
+def apply_deleted(storage, change):
+    connection = storage.connection
+    row = connection.execute(SELECT_BY_UID, (change["uid"],)).fetchone()
+    known = connection.execute(IS_DELETED, (change["uid"],)).fetchone() is not None
+    if row is not None:
+        storage.delete_timer(row[0])
+    connection.execute(SET_DELETED, (change["uid"], change["deleted"]))
+    return row is not None or not known
+
+
+def apply_setting(storage, change):
+    connection = storage.connection
+    row = connection.execute(SELECT_SETTING, (change["setting"],)).fetchone()
+    if row is None:
+        connection.execute(INSERT_SETTING, (change["setting"], change["value"], change["stamp"]))
+        return True
+    value, stamp, seq = row
+    if (change["stamp"], change["value"]) <= (stamp or 0, bool(value)):
+        return False
+    connection.execute(UPDATE_SETTING, (change["value"], change["setting"]))
+    connection.execute(SET_SETTING_STAMP, (change["stamp"], seq, change["setting"]))
+    return True
+
+
+def apply(storage, change):
+    if "setting" in change:
+        return apply_setting(storage, change)
+    if "deleted" in change:
+        return apply_deleted(storage, change)
+    return apply_timer(storage, change)
+
+
+def sync(storage, directory):
+    # storage = SqliteStorage, everything is committed at the end
+    # returns (changes received, changes applied, changes sent)
+    connection = storage.connection
+    own = changefile(machine_id(connection))
+    received = applied = 0
+    for filename in sorted(listdir(directory)):
+        if not filename.endswith(".jsonl") or filename == own:
+            continue
+        for line in read_new(connection, directory, filename):
+            received += 1
+            try:
+                applied += apply(storage, json.loads(line))
+            except (ValueError, KeyError, TypeError) as error:
+                # a broken line must not block everything after it
+                log.warning(f"Skipping change from \"{filename}\": {error}")
+    sent = export_changes(connection, joinpath(directory, own))
+    storage.commit()
+    return received, applied, sent
@@ -0,0 +1,234 @@
+from tkinter import *
+
+# Scrollable task list that only creates widgets for the rows fitting in the window.
+# Row widgets are pooled by screen position and re-used, a refresh only patches
+# the texts and images that actually changed.
+# Clicking a row's text toggles it in the selection, which is kept as a set of IDs.
+
+SELECTED_BACKGROUND = "#cce4ff"
+
+
+class TaskRow:
+    def __init__(self, parent, tasklist):
+        self.tasklist = tasklist
+        self.objid = None
+        self.position = None  # slot the row is currently placed at
+        self.state = {}  # last values pushed into the widgets
+
+        settings = tasklist.settings
+        size = "32" if settings["show_remain"] else ""
+        self.checkimage = tasklist.images[f"check{size}"]
+        self.crossimage = tasklist.images[f"cross{size}"]
+
+        self.frame = Frame(parent)
+        if settings["show_border"]:
+            self.frame.config(highlightbackground="black", highlightthickness=1)
+
+        labelframe = Frame(self.frame)
+
+        self.statebutton = Button(self.frame, image=self.checkimage, command=self.toggle)
+        self.statebutton.pack(side=LEFT)
+
+        if settings["show_delete"]:
+            Button(self.frame, image=tasklist.images[f"trash{size}"], command=lambda: tasklist.ondelete(self.objid)
+                   ).pack(side=RIGHT)
+        if settings["show_edit"]:
+            Button(self.frame, image=tasklist.images[f"edit{size}"], command=lambda: tasklist.onedit(self.objid)
+                   ).pack(side=RIGHT)
+
+        self.backloglabel = None
+        if settings["show_backlog"]:
+            self.backloglabel = Label(self.frame)
+            self.backloglabel.pack(side=RIGHT)
+
+        self.commentlabel = Label(labelframe)
+        self.commentlabel.pack(anchor=W)
+        self.statuslabel = None
+        if settings["show_remain"]:
+            self.statuslabel = Label(labelframe)
+            self.statuslabel.pack(anchor=W)
+        labelframe.pack(side=LEFT, expand=True, fill=X)
+
+        # widgets taking the selection background
+        self.background = self.frame.cget("background")
+        self.selectable = [widget for widget in (self.frame, labelframe, self.commentlabel, self.statuslabel,
+                                                 self.backloglabel) if widget is not None]
+        for widget in (labelframe, self.commentlabel, self.statuslabel):
+            if widget is not None:
+                widget.bind("<Button-1>", lambda event: tasklist.toggle_selected(self.objid))
+
+    def toggle(self):
+        if self.state.get("completed"):
+            self.tasklist.onuncheck(self.objid)
+        else:
+            self.tasklist.oncheck(self.objid)
+
+    def _patch(self, key, value, widget, **options):
+        if self.state.get(key) != value:
+            self.state[key] = value
+            widget.config(**options)
+
+    def show(self, objid, comment, status, completed, backlog, selected=False):
+        self.objid = objid
+        if self.state.get("selected") != selected:
+            self.state["selected"] = selected
+            for widget in self.selectable:
+                widget.config(background=SELECTED_BACKGROUND if selected else self.background)
+        self._patch("comment", comment, self.commentlabel, text=comment)
+        if self.statuslabel is not None:
+            self._patch("status", status, self.statuslabel, text=status)
+        if self.backloglabel is not None:
+            self._patch("backlog", backlog, self.backloglabel, text=backlog)
+        self._patch("completed", completed, self.statebutton,
+                    image=self.crossimage if completed else self.checkimage)
+
+    def place_at(self, position, rowheight):
+        if self.position != position:
+            self.position = position
+            self.frame.place(x=0, y=position*rowheight, relwidth=1, height=rowheight)
+
+    def hide(self):
+        if self.position is not None:
+            self.position = None
+            self.frame.place_forget()
+
+    def destroy(self):
+        self.frame.destroy()
+
+
+class TaskList(Frame):
+    # describe(item) -> (ID, comment, status text, completed, backlog text), only called for visible items
+    # onscroll() is called after the visible rows changed by scrolling, onselect() after the selection changed
+    def __init__(self, parent, images, settings, describe, oncheck, onuncheck, onedit, ondelete, onscroll=None,
+                 onselect=None):
+        super().__init__(parent)
+        self.images = images
+        self.settings = settings
+        self.describe = describe
+        self.oncheck = oncheck
+        self.onuncheck = onuncheck
+        self.onedit = onedit
+        self.ondelete = ondelete
+        self.onscroll = onscroll
+        self.onselect = onselect
+
+        self.items = []
+        self.selected = set()  # IDs, kept across renders as long as they're listed
+        self.message = None
+        self.top = 0  # index of the first visible item
+        self.rows = []
+        self.rowheight = None
+
+        self.scrollbar = Scrollbar(self, orient=VERTICAL, command=self.scroll)
+        self.scrollbar.pack(side=RIGHT, fill=Y)
+        self.body = Frame(self)
+        self.body.pack(side=LEFT, fill=BOTH, expand=True)
+        self.messagelabel = Label(self.body)
+
+        self.body.bind("<Configure>", lambda event: self.redraw())
+        toplevel = self.winfo_toplevel()
+        toplevel.bind("<MouseWheel>", self.wheel, add="+")
+        toplevel.bind("<Button-4>", self.wheel, add="+")
+        toplevel.bind("<Button-5>", self.wheel, add="+")
+
+    def reset(self):
+        # drop the row pool after changing settings that affect row layout, render() rebuilds it
+        for row in self.rows:
+            row.destroy()
+        self.rows = []
+        self.rowheight = None
+
+    def render(self, items, message=None):
+        self.items = items
+        self.message = message
+        if self.selected:
+            self.selected.intersection_update(item[0] for item in items)
+        self.redraw()
+
+    def toggle_selected(self, objid):
+        if objid is None:
+            return
+        self.selected.symmetric_difference_update((objid,))
+        self.redraw()
+        if self.onselect is not None:
+            self.onselect()
+
+    def select_all(self):
+        self.selected = {item[0] for item in self.items}
+        self.redraw()
+        if self.onselect is not None:
+            self.onselect()
+
+    def clear_selection(self):
+        self.selected = set()
+        self.redraw()
+        if self.onselect is not None:
+            self.onselect()
+
+    def _measure(self):
+        row = TaskRow(self.body, self)
+        self.rows.append(row)
+        row.show(None, " ", " ", False, " ")
+        row.frame.update_idletasks()
+        self.rowheight = max(1, row.frame.winfo_reqheight())
+
+    def visible_items(self):
+        if self.message is not None or self.rowheight is None:
+            return []
+        return self.items[self.top:self.top + self.fullrows() + 1]
+
+    def fullrows(self):
+        return max(1, self.body.winfo_height() // self.rowheight)
+
+    def redraw(self):
+        if self.message is not None:
+            for row in self.rows:
+                row.hide()
+            self.messagelabel.config(text=self.message)
+            self.messagelabel.place(x=0, y=0, relwidth=1)
+            self.scrollbar.set(0, 1)
+            return
+        self.messagelabel.place_forget()
+
+        if self.rowheight is None:
+            self._measure()
+
+        fullrows = self.fullrows()
+        count = fullrows + 1  # partially visible row at the bottom
+        self.top = max(0, min(self.top, len(self.items) - fullrows))
+
+        while len(self.rows) < count:
+            self.rows.append(TaskRow(self.body, self))
+
+        for position, row in enumerate(self.rows):
+            index = self.top + position
+            if position < count and index < len(self.items):
+                item = self.items[index]
+                row.show(*self.describe(item), item[0] in self.selected)
+                row.place_at(position, self.rowheight)
+            else:
+                row.hide()
+
+        if self.items:
+            self.scrollbar.set(self.top / len(self.items), min(1, (self.top + fullrows) / len(self.items)))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def scroll(self, action, amount, unit=None):
+        if self.rowheight is None or not self.items:
+            return
+        if action == "moveto":
+            self.top = int(float(amount) * len(self.items))
+        elif unit == "pages":
+            self.top += int(amount) * self.fullrows()
+        else:
+            self.top += int(amount)
+        self.redraw()
+        if self.onscroll is not None:
+            self.onscroll()
+
+    def wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.scroll("scroll", -1, "units")
+        else:
+            self.scroll("scroll", 1, "units")
@@ -0,0 +1,69 @@
+import random
+
+import numpy as np
+
+from batchdeadlines import DeadlineBatch
+from conftest import START, END, random_args, transitions
+from timerclasses import *
+
+# DeadlineBatch against the timer classes it vectorizes, at random times and around every DST change.
+
+
+def random_timers(rng, count, around):
+    timers = {}
+    for objid in range(count):
+        timertype = timertypes[objid % len(timertypes)]
+        lastclicked = rng.choice([0, rng.randrange(around - 60*DAY, around + 60*DAY)])
+        timers[objid] = [timertype, timerclass_dict[timertype]("", lastclicked, random_args(rng, timertype, around))]
+    return timers
+
+
+def check(batch, timers, currtime):
+    ids, lastclicked, last, nxt = batch.evaluate(currtime)
+    for objid, clicked, lastdeadline, nextdeadline in zip(ids.tolist(), lastclicked.tolist(), last.tolist(), nxt.tolist()):
+        timertype, timer = timers[objid]
+        assert (clicked, lastdeadline, nextdeadline) == \
+            (timer.lastclicked, timer.lastdeadline(currtime), timer.nextdeadline(currtime)), (timertype, timer.extraargs)
+    ids, backlog = batch.backlog(currtime)
+    for objid, count in zip(ids.tolist(), backlog.tolist()):
+        timertype, timer = timers[objid]
+        assert count == timer.backlog(currtime), (timertype, timer.extraargs, timer.lastclicked, currtime)
+    assert sorted(ids.tolist()) == sorted(timers)
+
+
+def test_matches_timer_classes(zonetables):
+    rng = random.Random(zonetables)
+    samples = [rng.randrange(START, END) for _ in range(20)]
+    for change in transitions()[:6]:
+        samples += [change + delta for delta in (-DAY, -HOUR - 1, -1, 0, 1, HOUR, DAY)]
+    timers = random_timers(rng, 140, samples[0])
+    batch = DeadlineBatch(timers)
+    for currtime in samples:
+        check(batch, timers, currtime)
+
+
+def test_updates(zonetables):
+    rng = random.Random(1)
+    timers = random_timers(rng, 70, START)
+    batch = DeadlineBatch(timers)
+    for step in range(200):
+        objid = rng.randrange(100)
+        action = rng.random()
+        if action < 0.2 and objid in timers:
+            del timers[objid]
+            batch.discard(objid)
+        elif action < 0.5 and objid in timers:
+            timers[objid][1].lastclicked = START + step
+            batch.set_last_clicked(objid, START + step)
+        else:
+            timertype = rng.choice(timertypes)
+            timers[objid] = [timertype, timerclass_dict[timertype]("", 0, random_args(rng, timertype, START))]
+            batch.update(objid, timers[objid])
+    check(batch, timers, START + 10*DAY)
+    assert len(batch) == len(timers)
+
+
+def test_empty():
+    ids, lastclicked, last, nxt = DeadlineBatch().evaluate(START)
+    assert len(ids) == len(nxt) == 0
+    assert np.array_equal(DeadlineBatch().backlog(START)[1], np.zeros(0))
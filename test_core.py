@@ -0,0 +1,34 @@
+from core import completion, stats_summary
+from timerclasses import *
+
+# History rows of completions and the summary of a Stats row.
+
+START = 1700000000
+
+
+def timer(timertype, lastclicked, args):
+    return timerclass_dict[timertype]("", lastclicked, args)
+
+
+def test_completion():
+    hourly = timer("Custom", START + 10, [START, 1, "hours"])
+    # already completed since the last deadline
+    assert completion("Custom", hourly, START + 20) is None
+    # due at START + 1h, completed before the next one
+    assert completion("Custom", hourly, START + HOUR + 5) == (START + HOUR, 0)
+    # due at START + 1h, missed the two after it
+    assert completion("Custom", hourly, START + 3*HOUR + 5) == (START + 3*HOUR, 2)
+
+
+def test_completion_once():
+    once = timer("Once", 0, [START])
+    assert completion("Once", once, START - 5) == (START, 0)
+    assert completion("Once", once, START + 5) == (START, 1)
+
+
+def test_stats_summary():
+    assert stats_summary(4, 3, 2, 3, 600) == (4, 0.75, 2, 3, 600)
+    assert stats_summary(4, 2, 0, 2, 600) == (4, 0.5, 0, 2, 300)
+    # never late is no lateness at all, not a lateness of 0
+    assert stats_summary(3, 3, 3, 3, 0) == (3, 1.0, 3, 3, None)
+    assert stats_summary(0, 0, 0, 0, 0) == (0, 0.0, 0, 0, None)
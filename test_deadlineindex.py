@@ -0,0 +1,60 @@
+import json
+import random
+
+from conftest import random_args
+from deadlineindex import DeadlineIndex
+from timerclasses import *
+from timerstore import TimerStore
+
+# The index against sorting every timer by its deadlines, through clicks, unchecks, edits,
+# deletions and rollovers.
+
+START = 1700000000
+
+
+def expected(store, currtime, show_complete, only=None):
+    entries = []
+    for objid in store:
+        if only is not None and objid not in only:
+            continue
+        timer = store[objid].timer()
+        lastdeadline = timer.lastdeadline(currtime)
+        if show_complete or timer.lastclicked < lastdeadline:
+            entries.append((timer.nextdeadline(currtime), objid, lastdeadline))
+    return [(objid, lastdeadline, nextdeadline) for nextdeadline, objid, lastdeadline in sorted(entries)]
+
+
+def test_ordered():
+    rng = random.Random(3)
+    rows = []
+    for objid in range(800):
+        timertype = rng.choice(timertypes)
+        rows.append((objid, timertype, f"task {objid}", rng.choice([0, START - DAY]),
+                     json.dumps(random_args(rng, timertype, START))))
+    store = TimerStore.load(rows)
+    currtime = START
+    index = DeadlineIndex(store, currtime)
+
+    for step in range(100):
+        currtime += rng.choice([1, 60, HOUR, DAY, 7*DAY])
+        if rng.random() < 0.3:
+            # click or uncheck a few timers
+            objids = rng.sample(list(store), rng.choice([1, 5, 150]))
+            clicked = rng.choice([0, currtime])
+            for objid in objids:
+                store[objid].lastclicked = clicked
+            index.update_many(objids, currtime)
+        if rng.random() < 0.2:
+            objid = rng.choice(list(store))
+            del store[objid]
+            index.discard(objid)
+        if rng.random() < 0.3:
+            objid = rng.randrange(3000)
+            timertype = rng.choice(timertypes)
+            store.add(objid, timertype, "new", 0, random_args(rng, timertype, START))
+            index.update(objid, currtime)
+
+        for show_complete in (False, True):
+            assert index.ordered(currtime, show_complete) == expected(store, currtime, show_complete)
+            only = set(rng.sample(list(store), rng.choice([3, 500])))
+            assert index.ordered(currtime, show_complete, only) == expected(store, currtime, show_complete, only)
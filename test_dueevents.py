@@ -0,0 +1,79 @@
+import json
+
+from dueevents import DueDispatcher, event_environment, python_hook
+from timerclasses import *
+from timerstore import TimerStore
+
+# Arming, firing and re-arming deadlines of a TimerStore.
+
+START = 1700000000
+HOURLY, ONCE, DAILY = START + 600, START + 1800, START - HOUR + DAY  # first deadlines after START
+
+
+def store():
+    return TimerStore.load([(1, "Custom", "every hour", 0, json.dumps([START + 600, 1, "hours"])),
+                            (2, "Once", "renew passport", 0, json.dumps([ONCE])),
+                            (3, "Custom", "every day", START + 10, json.dumps([START - HOUR, 1, "days"]))])
+
+
+def fired(dispatcher, currtime):
+    return sorted((event.objid, event.deadline, event.missed) for event in dispatcher.dispatch(currtime))
+
+
+def test_fires_and_rearms():
+    dispatcher = DueDispatcher(store(), START)
+    events = []
+    dispatcher.register(events.append)
+    # next_event() may be early, but never late
+    assert START < dispatcher.next_event() <= HOURLY
+    assert fired(dispatcher, HOURLY - 1) == []
+    # never completed, so the deadline before was missed already
+    assert fired(dispatcher, HOURLY) == [(1, HOURLY, True)]
+    # the recurring timer is armed at its next deadline, the one-time one fires once
+    assert fired(dispatcher, START + 2*HOUR) == [(1, HOURLY + HOUR, True), (2, ONCE, True)]
+    assert fired(dispatcher, START + 3*HOUR) == [(1, HOURLY + 2*HOUR, True)]
+    # callbacks see the events in deadline order
+    assert [event.deadline for event in events] == [HOURLY, ONCE, HOURLY + HOUR, HOURLY + 2*HOUR]
+
+
+def test_missed_flag_and_skipped_deadlines():
+    dispatcher = DueDispatcher(store(), START)
+    dispatcher.dispatch(DAILY - 1)
+    # completed since its last deadline, so this one isn't missed
+    assert fired(dispatcher, DAILY) == [(3, DAILY, False)]
+    # days without dispatching fire each timer once, not once per deadline, the later deadlines are missed
+    assert [(objid, missed) for objid, deadline, missed in fired(dispatcher, START + 8*DAY)] == [(1, True), (3, True)]
+
+
+def test_cancel_and_arm():
+    timers = store()
+    dispatcher = DueDispatcher(timers, START)
+    dispatcher.cancel(1)
+    assert fired(dispatcher, HOURLY) == []
+    timers.add(1, "Once", "moved", 0, [HOURLY + 60])
+    dispatcher.arm(1, HOURLY)
+    del timers[2]
+    # deleted timers don't fire even while still armed
+    assert [objid for objid, deadline, missed in fired(dispatcher, ONCE)] == [1]
+
+
+def test_failing_callback():
+    dispatcher = DueDispatcher(store(), START)
+    seen = []
+
+    def broken(event):
+        raise RuntimeError("broken")
+
+    dispatcher.register(broken)
+    dispatcher.register(seen.append)
+    dispatcher.dispatch(HOURLY)
+    assert [event.objid for event in seen] == [1]
+
+
+def test_hooks(tmp_path):
+    path = tmp_path / "hook.py"
+    path.write_text("def hook(event):\n    return event.comment\n")
+    event = DueDispatcher(store(), START).dispatch(HOURLY)[0]
+    assert python_hook(f"{path}:hook")(event) == "every hour"
+    environment = event_environment(event)
+    assert (environment["TODO_ID"], environment["TODO_DEADLINE"], environment["TODO_MISSED"]) == ("1", str(HOURLY), "1")
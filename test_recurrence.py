@@ -0,0 +1,96 @@
+import random
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+
+import pytest
+
+import recurrence
+from recurrence import Recurrence, intern_rule, rule_texts, shift_rule
+from conftest import START, END, brute_to_utc
+from tztable import DAY, TransitionTable
+
+# Compiled rules against a day by day walk over the calendar, in every zone of conftest.ZONES.
+
+EPOCH = date(1970, 1, 1)
+FIRST, LAST = date(2019, 11, 1), date(2028, 3, 1)  # a deadline of every rule on both sides of [START, END)
+
+# rule: (time of day in seconds, whether it selects a date)
+RULES = {
+    "FREQ=DAILY;BYHOUR=2;BYMINUTE=30": (2*60*60 + 30*60, lambda d: True),
+    "FREQ=DAILY;INTERVAL=2;DTSTART=20210101": (0, lambda d: (d - date(2021, 1, 1)).days % 2 == 0),
+    "FREQ=WEEKLY;BYDAY=MO,TH;BYHOUR=9": (9*60*60, lambda d: d.weekday() in (0, 3)),
+    "FREQ=WEEKLY;INTERVAL=3;BYDAY=MO,TH;DTSTART=20220502":
+        (0, lambda d: d.weekday() in (0, 3) and (d - date(2022, 5, 2)).days // 7 % 3 == 0),
+    "FREQ=MONTHLY;BYDAY=2TU;BYHOUR=10": (10*60*60, lambda d: d.weekday() == 1 and 8 <= d.day <= 14),
+    "FREQ=MONTHLY;BYDAY=MO,TU,WE,TH,FR;BYSETPOS=-1":
+        (0, lambda d: d.weekday() < 5 and all((d + timedelta(days)).month != d.month or (d + timedelta(days)).weekday() >= 5
+                                              for days in range(1, 4))),
+    "FREQ=MONTHLY;BYMONTHDAY=-1;BYHOUR=23;BYMINUTE=59": (23*60*60 + 59*60, lambda d: (d + timedelta(1)).day == 1),
+    "FREQ=MONTHLY;BYMONTHDAY=31": (0, lambda d: d.day == 31),
+    "FREQ=MONTHLY;BYDAY=MO,TU,WE,TH,FR;BYHOUR=8": (8*60*60, lambda d: d.weekday() < 5),
+    "FREQ=MONTHLY;INTERVAL=7;BYMONTHDAY=1,2,-1;DTSTART=20200115":
+        (0, lambda d: ((d.year - 2020)*12 + d.month - 1) % 7 == 0 and (d.day <= 2 or (d + timedelta(1)).day == 1)),
+    "FREQ=YEARLY;BYMONTH=2;BYMONTHDAY=29": (0, lambda d: d.month == 2 and d.day == 29),
+    "FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU;BYHOUR=2;BYMINUTE=30":
+        (2*60*60 + 30*60, lambda d: d.month == 3 and d.weekday() == 6 and d.day > 24),
+    "FREQ=YEARLY;BYMONTH=12;BYMONTHDAY=24,31;EXDATE=20221231":
+        (0, lambda d: d.month == 12 and d.day in (24, 31) and d != date(2022, 12, 31)),
+}
+
+
+@pytest.fixture
+def rulezone(zone, monkeypatch):
+    # a table for the zone, the shared one was built for the zone of the test process
+    monkeypatch.setattr(recurrence, "localzone", TransitionTable())
+    return zone
+
+
+def brute_deadlines(text):
+    base, selects = RULES[text]
+    days = [FIRST + timedelta(offset) for offset in range((LAST - FIRST).days)]
+    return [brute_to_utc((day - EPOCH).days*DAY + base) for day in days if selects(day)]
+
+
+@pytest.mark.parametrize("text", RULES)
+def test_deadlines(rulezone, text):
+    rule = Recurrence(text)
+    expected = brute_deadlines(text)
+    assert list(rule.occurrences(START, END)) == expected[bisect_left(expected, START):bisect_left(expected, END)]
+
+    rng = random.Random(text)
+    samples = [rng.randrange(START, END) for _ in range(300)]
+    samples += [deadline + delta for deadline in expected[1:-1:7] for delta in (-1, 0, 1)]
+    for ts in samples:
+        position = bisect_right(expected, ts)
+        assert rule.deadlines(ts) == (expected[position - 1], expected[position]), ts
+
+    samples.sort()
+    for since, until in zip(samples, samples[1:]):
+        count = bisect_right(expected, until) - bisect_right(expected, since)
+        assert rule.deadline_index(until) - rule.deadline_index(since) == count, (since, until)
+
+
+def test_compiled_size():
+    # every weekday of 4800 months is stored as 4800 period starts and a pattern per month shape
+    rule = Recurrence("FREQ=MONTHLY;BYDAY=MO,TU,WE,TH,FR")
+    assert rule.cyclecount == 104355
+    assert len(rule.starts) == recurrence.CYCLE_MONTHS and len(rule.patterns) <= 28
+    assert sum(map(len, rule.patterns)) <= 28*23
+
+
+@pytest.mark.parametrize("text", ["", "FREQ=HOURLY", "FREQ=DAILY;BYHOUR=24", "FREQ=DAILY;BYHOUR=1,2",
+                                  "FREQ=WEEKLY;BYMONTHDAY=3", "FREQ=MONTHLY;BYMONTH=2", "FREQ=DAILY;COUNT=3",
+                                  "FREQ=DAILY;FREQ=DAILY", "FREQ=DAILY;INTERVAL", "FREQ=WEEKLY;BYDAY=XX"])
+def test_invalid_rules(text):
+    with pytest.raises(ValueError):
+        Recurrence(text)
+
+
+def test_shift_rule():
+    assert shift_rule("FREQ=WEEKLY;BYDAY=MO;BYHOUR=23;BYMINUTE=30", 45*60) == "FREQ=WEEKLY;BYDAY=MO;BYHOUR=0;BYMINUTE=15"
+
+
+def test_intern_rule():
+    number = intern_rule("FREQ=DAILY;BYHOUR=7")
+    assert intern_rule("FREQ=DAILY;BYHOUR=7") == number
+    assert rule_texts[number] == "FREQ=DAILY;BYHOUR=7"
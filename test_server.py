@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import pytest
+
+import server
+from server import Server, add, delete
+from storage import SqliteStorage
+
+# The JSON API server: batched write transactions and the request stream of a connection.
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "timers.db")
+    SqliteStorage(path).close()
+    return path
+
+
+def test_batch_is_one_transaction(path):
+    other = SqliteStorage(path)
+    instance = Server(path, 1)
+    try:
+        def visible(database):
+            # what another connection sees in the middle of the batch
+            return len(other.load_timers())
+
+        batch = [(add, ("Daily", "first", [8, 0]), None), (add, ("Daily", "second", [9, 0]), None),
+                 (visible, (), None), (delete, (99,), None), (add, ("Daily", "third", [10, 0]), None)]
+        results = instance._transaction(batch)
+        assert results[2] == (0, None)
+        # the failing write is rolled back on its own
+        assert isinstance(results[3][1], ValueError)
+        assert [error for result, error in results[:2] + results[4:]] == [None, None, None]
+        assert [row[2] for row in other.load_timers()] == ["first", "second", "third"]
+    finally:
+        instance.close()
+        other.close()
+
+
+async def exchange(path, socketpath, lines):
+    # sends lines to a running server and returns the parsed answers
+    instance = Server(path, 2)
+    started = asyncio.Event()
+    serving = asyncio.create_task(instance.serve(socketpath, started.set))
+    await started.wait()
+    try:
+        reader, writer = await asyncio.open_unix_connection(socketpath, limit=2**20)
+        writer.write(b"".join(line + b"\n" for line in lines))
+        await writer.drain()
+        answers = [json.loads(await reader.readline()) for _ in lines]
+        writer.close()
+        return answers
+    finally:
+        serving.cancel()
+        try:
+            await serving
+        except asyncio.CancelledError:
+            pass
+
+
+def test_requests(path, tmp_path):
+    lines = [json.dumps({"id": 1, "method": "add", "args": ["Daily", "Water the plants", [8, 30]]}).encode(),
+             b"not json",
+             json.dumps({"id": 2, "method": "nothing"}).encode(),
+             json.dumps({"id": 3, "method": "edit", "args": [99, "Daily", "x", [8, 0]]}).encode()]
+    answers = asyncio.run(exchange(path, str(tmp_path / "api.sock"), lines))
+    assert {"id": 1, "result": 1} in answers
+    assert {answer["id"] for answer in answers if "error" in answer} == {None, 2, 3}
+
+
+def test_overlong_line(path, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "LINE_LIMIT", 1000)
+    lines = [b'{"id": 1, "method": "list", "args": [' + b" " * 200000 + b"]}",
+             json.dumps({"id": 2, "method": "list"}).encode()]
+    answers = asyncio.run(exchange(path, str(tmp_path / "api.sock"), lines))
+    # the long line gets an error, the connection goes on with the next one
+    assert answers[0]["id"] is None and "longer than 1000" in answers[0]["error"]
+    assert answers[1] == {"id": 2, "result": []}
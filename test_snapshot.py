@@ -0,0 +1,87 @@
+import json
+import random
+
+import pytest
+
+import snapshot
+from conftest import random_args
+from timerclasses import *
+from timerstore import TimerStore
+
+# Snapshots of the timer store: the round trip and the files a start has to ignore.
+
+START = 1700000000
+COUNTER = 42
+
+
+def contents(store):
+    return {objid: (store[objid].timertype, store.comment(objid), store[objid].lastclicked, store.args(objid))
+            for objid in store}
+
+
+@pytest.fixture
+def store():
+    rng = random.Random(5)
+    rows = []
+    for objid in range(1, 300):
+        timertype = rng.choice(timertypes)
+        rows.append((objid, timertype, f"task {objid} " * rng.randrange(3), rng.choice([0, START]),
+                     json.dumps(random_args(rng, timertype, START))))
+    store = TimerStore.load(rows)
+    # a deleted timer leaves garbage in the comment text
+    store.discard(7)
+    return store
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "timers.db.snapshot")
+
+
+def test_round_trip(store, path):
+    snapshot.save(store, path, COUNTER)
+    loaded = snapshot.load(path, COUNTER)
+    assert contents(loaded) == contents(store)
+    # the loaded store changes its own copy only
+    objid = next(iter(loaded))
+    loaded[objid].lastclicked = START + 1
+    loaded.add(1000, "Daily", "new", 0, [8, 0])
+    assert contents(snapshot.load(path, COUNTER)) == contents(store)
+
+
+def test_counter_moved(store, path):
+    snapshot.save(store, path, COUNTER)
+    assert snapshot.load(path, COUNTER + 1) is None
+
+
+def test_missing(path):
+    assert snapshot.load(path, COUNTER) is None
+
+
+@pytest.mark.parametrize("keep", [0, 4, 20, 200, -8])
+def test_truncated(store, path, keep):
+    snapshot.save(store, path, COUNTER)
+    with open(path, "rb") as source:
+        data = source.read()
+    with open(path, "wb") as output:
+        output.write(data[:keep] if keep >= 0 else data[:len(data) + keep])
+    assert snapshot.load(path, COUNTER) is None
+
+
+@pytest.mark.parametrize("position, replacement", [
+    (0, b"XODOSNAP"),  # magic
+    (8, b"\xff\xff\xff\x7f"),  # header length
+    (12, b"[[["),  # header JSON
+])
+def test_corrupt(store, path, position, replacement):
+    snapshot.save(store, path, COUNTER)
+    with open(path, "r+b") as output:
+        output.seek(position)
+        output.write(replacement)
+    assert snapshot.load(path, COUNTER) is None
+
+
+def test_other_version(store, path, monkeypatch):
+    snapshot.save(store, path, COUNTER)
+    monkeypatch.setattr(snapshot, "VERSION", snapshot.VERSION + 1)
+    assert snapshot.load(path, COUNTER) is None
@@ -0,0 +1,44 @@
+import pytest
+
+import storage
+
+# History and Stats rows written by the completions of the local backends.
+
+
+@pytest.fixture(params=["sqlite", "orm"])
+def database(request, tmp_path):
+    database = storage.open_storage(request.param, str(tmp_path / "timers.db"))
+    yield database
+    database.close()
+
+
+def test_stats(database):
+    first = database.add_timer("Daily", "first", 0, "[8, 0]")
+    second = database.add_timer("Daily", "second", 0, "[9, 0]")
+    database.commit()
+    # on time, on time, 100s late missing one deadline, on time
+    database.record_completions([(first, 1000, 900, 0), (first, 2000, 1900, 0)])
+    database.record_completion(first, 3000, 2900, 1)
+    database.record_completion(first, 4000, 3900, 0)
+    database.record_completion(second, 1000, 900, 0)
+    database.commit()
+    # the lateness sum only holds the late completion
+    assert database.load_stats() == {first: (4, 3, 1, 2, 100), second: (1, 1, 1, 1, 0)}
+
+
+def test_deleted_timer_stats(database):
+    first = database.add_timer("Daily", "first", 0, "[8, 0]")
+    second = database.add_timer("Daily", "second", 0, "[9, 0]")
+    database.commit()
+    database.record_completions([(first, 1000, 900, 2), (second, 1000, 900, 0)])
+    database.delete_timer(first)
+    database.commit()
+    assert database.load_stats() == {second: (1, 1, 1, 1, 0)}
+
+
+def test_load_timer(database):
+    objid = database.add_timer("Daily", "first", 0, "[8, 0]")
+    database.add_timer("Daily", "second", 0, "[9, 0]")
+    database.commit()
+    assert database.load_timer(objid) == (objid, "Daily", "first", 0, "[8, 0]")
+    assert database.load_timer(objid + 100) is None
@@ -0,0 +1,145 @@
+import json
+import shutil
+import time
+
+import pytest
+
+import sync
+from storage import SqliteStorage
+
+# Two machines syncing through a shared directory, each with a database of its own.
+
+
+@pytest.fixture
+def machines(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    first, second = SqliteStorage(str(tmp_path / "first.db")), SqliteStorage(str(tmp_path / "second.db"))
+    yield first, second, str(shared)
+    first.close()
+    second.close()
+
+
+def contents(database):
+    # timers by comment, IDs differ between machines
+    return sorted((timertype, comment, lastclicked, json.loads(data))
+                  for objid, timertype, comment, lastclicked, data in database.load_timers())
+
+
+def ids(database):
+    return {comment: objid for objid, timertype, comment, lastclicked, data in database.load_timers()}
+
+
+def settle():
+    # stamps have millisecond resolution, later changes must get later stamps
+    time.sleep(0.01)
+
+
+def test_copies_timers(machines):
+    first, second, shared = machines
+    first.add_timer("Daily", "Water the plants", 0, "[8, 30]")
+    first.add_timer("Rule", "Team meeting", 0, '["FREQ=MONTHLY;BYDAY=2TU;BYHOUR=10"]')
+    first.commit()
+    assert sync.sync(first, shared) == (0, 0, 2)
+    assert sync.sync(second, shared) == (2, 2, 0)
+    assert contents(second) == contents(first)
+
+
+def test_nothing_twice(machines):
+    first, second, shared = machines
+    first.add_timer("Daily", "Water the plants", 0, "[8, 30]")
+    first.commit()
+    sync.sync(first, shared)
+    sync.sync(second, shared)
+    # imported changes aren't sent back, and nothing is received again
+    assert sync.sync(second, shared) == (0, 0, 0)
+    assert sync.sync(first, shared) == (0, 0, 0)
+
+
+def test_later_change_wins(machines):
+    first, second, shared = machines
+    first.add_timer("Daily", "Water the plants", 0, "[8, 30]")
+    first.commit()
+    sync.sync(first, shared)
+    sync.sync(second, shared)
+
+    first.update_timer(ids(first)["Water the plants"], "Daily", "Water the plants", "[9, 0]")
+    first.commit()
+    settle()
+    second.update_timer(ids(second)["Water the plants"], "Daily", "Water the plants", "[7, 15]")
+    second.set_last_clicked(ids(second)["Water the plants"], 1650000000)
+    second.commit()
+    settle()
+    first.set_last_clicked(ids(first)["Water the plants"], 1660000000)
+    first.commit()
+
+    # both orders of arrival end with the same result
+    sync.sync(first, shared)
+    sync.sync(second, shared)
+    sync.sync(first, shared)
+    assert contents(first) == contents(second) == [("Daily", "Water the plants", 1660000000, [7, 15])]
+
+
+def test_deletion_wins(machines):
+    first, second, shared = machines
+    first.add_timer("Daily", "Water the plants", 0, "[8, 30]")
+    first.add_timer("Weekly", "Take out the trash", 0, "[0, 7, 0]")
+    first.commit()
+    sync.sync(first, shared)
+    sync.sync(second, shared)
+
+    first.delete_timer(ids(first)["Water the plants"])
+    first.commit()
+    settle()
+    # a later change on the other machine doesn't bring the timer back
+    second.update_timer(ids(second)["Water the plants"], "Daily", "Water the plants", "[9, 0]")
+    second.commit()
+
+    sync.sync(second, shared)
+    sync.sync(first, shared)
+    sync.sync(second, shared)
+    assert contents(first) == contents(second) == [("Weekly", "Take out the trash", 0, [0, 7, 0])]
+
+
+def test_settings(machines):
+    first, second, shared = machines
+    for database in (first, second):
+        database.add_settings([("show_complete", False)])
+        database.commit()
+    first.set_setting("show_complete", True)
+    first.commit()
+    sync.sync(first, shared)
+    sync.sync(second, shared)
+    assert dict(second.load_settings())["show_complete"]
+
+
+def test_copied_database(machines, tmp_path):
+    first, second, shared = machines
+    first.add_timer("Daily", "Water the plants", 0, "[8, 30]")
+    first.commit()
+    shutil.copy(tmp_path / "first.db", tmp_path / "copy.db")
+    copy = SqliteStorage(str(tmp_path / "copy.db"))
+    try:
+        copy.add_timer("Once", "Renew passport", 0, "[1900000000]")
+        copy.commit()
+        # copies made before the first sync share the machine ID until they sync on their own
+        sync.sync(first, shared)
+        sync.sync(copy, shared)
+        sync.sync(first, shared)
+        assert contents(first) == contents(copy)
+        assert len(contents(first)) == 2
+    finally:
+        copy.close()
+
+
+def test_broken_lines_are_skipped(machines):
+    first, second, shared = machines
+    first.add_timer("Daily", "Water the plants", 0, "[8, 30]")
+    first.commit()
+    sync.sync(first, shared)
+    with open(f"{shared}/0000000000000001.jsonl", "w", encoding="utf-8") as output:
+        output.write('{"uid": "x", "type": "Daily", "comment": "bad", "data": "[25, 0]", "defstamp": 1, '
+                     '"clicked": 0, "clickstamp": 1}\nnot json\n{"partial": ')
+    received, applied, sent = sync.sync(second, shared)
+    assert (received, applied) == (3, 1)
+    assert contents(second) == contents(first)
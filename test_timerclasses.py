@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+from conftest import random_args
+from timerclasses import *
+
+# Missed deadline counts of the timer classes.
+
+START = 1700000000
+
+
+def timer(timertype, lastclicked, args):
+    return timerclass_dict[timertype]("", lastclicked, args)
+
+
+def test_never_completed():
+    # recurring deadlines always have one in the past, it counts once however many passed
+    hourly = timer("Custom", 0, [START, 1, "hours"])
+    assert hourly.backlog(START - 1) == 1
+    assert hourly.backlog(START + 100*HOUR) == 1
+    # a one-time task only once its deadline passed
+    once = timer("Once", 0, [START])
+    assert once.backlog(START - 1) == 0
+    assert once.backlog(START + DAY) == 1
+
+
+def test_just_completed():
+    hourly = timer("Custom", START + 1, [START, 1, "hours"])
+    assert hourly.backlog(START + 1) == 0
+    assert hourly.backlog(START + HOUR - 1) == 0
+    assert hourly.backlog(START + HOUR) == 1
+
+
+def test_several_missed():
+    hourly = timer("Custom", START + 10, [START, 1, "hours"])
+    assert hourly.backlog(START + 5*HOUR) == 5
+    assert hourly.backlog(START + 5*HOUR - 1) == 4
+    # unchecking makes it a never completed task again
+    hourly.lastclicked = 0
+    assert hourly.backlog(START + 5*HOUR) == 1
+
+
+@pytest.mark.parametrize("timertype", timertypes)
+def test_counts_occurrences(timertype):
+    # deadlines in (last clicked, now], counted one by one
+    rng = random.Random(timertype)
+    for _ in range(100):
+        lastclicked = rng.randrange(START - 30*DAY, START + 30*DAY)
+        currtime = lastclicked + rng.choice([0, 1, HOUR, rng.randrange(200*DAY)])
+        subject = timer(timertype, lastclicked, random_args(rng, timertype, START))
+        assert subject.backlog(currtime) == len(list(subject.occurrences(lastclicked + 1, currtime + 1)))
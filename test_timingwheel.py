@@ -0,0 +1,61 @@
+import random
+
+from timingwheel import TimingWheel, SLOTS
+
+# The wheel against a plain dict of armed deadlines scanned in full.
+
+
+def test_against_scan():
+    rng = random.Random(5)
+    currtime = 1700000000
+    wheel = TimingWheel(currtime)
+    armed = {}
+    for step in range(3000):
+        action = rng.random()
+        if action < 0.5:
+            objid = rng.randrange(500)
+            # within the second, the lowest level, the higher ones, and already due
+            deadline = currtime + rng.choice([0, 1, rng.randrange(SLOTS), rng.randrange(SLOTS**2),
+                                              rng.randrange(SLOTS**3), -rng.randrange(100)])
+            wheel.insert(objid, deadline)
+            armed[objid] = deadline
+        elif action < 0.6 and armed:
+            objid = rng.choice(list(armed))
+            wheel.remove(objid)
+            del armed[objid]
+        else:
+            nextexpiry = wheel.next_expiry()
+            if armed:
+                # a lower bound of the earliest deadline, nothing is handed out before it
+                assert nextexpiry is not None and nextexpiry <= max(currtime, min(armed.values()))
+                if nextexpiry > currtime:
+                    assert wheel.advance(nextexpiry - 1) == []
+                    currtime = nextexpiry - 1
+            currtime += rng.choice([0, 1, rng.randrange(SLOTS), rng.randrange(SLOTS**2), rng.randrange(SLOTS**3)])
+            expected = sorted((objid, deadline) for objid, deadline in armed.items() if deadline <= currtime)
+            assert sorted(wheel.advance(currtime)) == expected
+            for objid, deadline in expected:
+                del armed[objid]
+        assert len(wheel) == len(armed)
+
+
+def test_next_expiry_exact_on_lowest_level():
+    wheel = TimingWheel(1000)
+    assert wheel.next_expiry() is None
+    wheel.insert(1, 1100)
+    wheel.insert(2, 1050)
+    assert wheel.next_expiry() == 1050
+    assert wheel.advance(1049) == []
+    assert wheel.advance(1050) == [(2, 1050)]
+    assert wheel.next_expiry() == 1100
+
+
+def test_replaced_and_due_deadlines():
+    wheel = TimingWheel(1000)
+    wheel.insert(1, 5000)
+    wheel.insert(1, 2000)
+    wheel.insert(2, 900)
+    assert wheel.next_expiry() == 1000
+    assert wheel.advance(1000) == [(2, 900)]
+    assert wheel.advance(10000) == [(1, 2000)]
+    assert len(wheel) == 0
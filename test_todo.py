@@ -0,0 +1,32 @@
+import pytest
+
+import todo
+from storage import SqliteStorage
+
+# Commands of the command line interface that change the database.
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "timers.db")
+    database = SqliteStorage(path)
+    database.add_timer("Custom", "every hour", 0, "[1700000000, 1, \"hours\"]")
+    database.add_timer("Once", "renew passport", 0, "[1700000000]")
+    database.commit()
+    database.close()
+    return path
+
+
+def test_done(path, capsys):
+    assert todo.main(["--db", path, "done", "1"]) == 0
+    assert todo.main(["--db", path, "done", "2"]) == 0
+    database = SqliteStorage(path)
+    try:
+        # the recurring timer is checked, the one-time one deleted along with its stats
+        [(objid, timertype, comment, lastclicked, data)] = database.load_timers()
+        assert objid == 1 and lastclicked > 1700000000
+        assert list(database.load_stats()) == [1]
+    finally:
+        database.close()
+    assert todo.main(["--db", path, "done", "3"]) == 1
+    assert "No task with id 3" in capsys.readouterr().err
@@ -0,0 +1,178 @@
+import json
+import os
+
+import pytest
+
+import todolists
+from dueevents import DueDispatcher
+from storage import SqliteStorage
+from timerclasses import *
+from todolists import DEFAULT_LIST, ListCache, OpenList, check_list_name, list_names
+
+# Named task lists, the least recently viewed ones being released, and opening a list with its
+# most urgent timers and the pages loaded after them.
+
+START = 1700000000
+COUNT = 250
+
+
+@pytest.fixture
+def directory(tmp_path, monkeypatch):
+    # the default list with COUNT timers, in a directory of its own
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(todolists, "FIRST_PAGE", 10)
+    monkeypatch.setattr(todolists, "PAGE_SIZE", 40)
+    database = SqliteStorage(todolists.list_path(DEFAULT_LIST))
+    database.add_timers([("Custom", f"task {number}", 0, json.dumps([START + number*60, 1, "days"]))
+                         for number in range(COUNT)])
+    database.commit()
+    database.close()
+    return tmp_path
+
+
+def open_list(name=DEFAULT_LIST):
+    os.makedirs(todolists.LISTS_DIRECTORY, exist_ok=True)
+    return OpenList(name, "sqlite", DueDispatcher)
+
+
+def test_paged_loading(directory):
+    entry = open_list()
+    try:
+        assert entry.loading and len(entry.timers) == 10
+        # new timers get IDs after every one in the database, loaded or not
+        assert entry.allocate_id() == COUNT + 1
+        pages = 0
+        while entry.loading:
+            entry.add_page(entry.request_page().result(), START)
+            pages += 1
+        assert pages == -(-COUNT // 40)
+        assert sorted(entry.timers) == list(range(1, COUNT + 1))
+        assert len(entry.deadlines.ordered(START, True)) == COUNT
+        assert entry.load_page() == 0
+    finally:
+        entry.close()
+
+
+def test_loaded_timers_keep_their_state(directory):
+    entry = open_list()
+    try:
+        loaded = next(iter(entry.timers))
+        page = entry.request_page()
+        # changed after the page was read
+        entry.timers[loaded].lastclicked = START
+        entry.add_page(page.result(), START)
+        assert entry.timers[loaded].lastclicked == START
+    finally:
+        entry.close()
+
+
+def test_deleted_while_page_pending(directory, monkeypatch):
+    monkeypatch.setattr(todolists, "PAGE_SIZE", COUNT + 1)
+    entry = open_list()
+    try:
+        deleted = next(iter(entry.timers))
+        page = entry.request_page()
+        # the deletion is queued after the read, the page still holds the timer
+        entry.remove([deleted])
+        assert deleted in [row[0] for row in page.result()]
+        assert entry.add_page(page.result(), START) == COUNT - 10
+        assert not entry.loading and deleted not in entry.timers
+    finally:
+        entry.close()
+
+
+def test_snapshot_after_full_load(directory):
+    entry = open_list()
+    entry.load_page()
+    # a partly loaded list saves no snapshot, the next start loads pages again
+    assert entry.close() == []
+    entry = open_list()
+    while entry.load_page():
+        pass
+    entry.close()
+    entry = open_list()
+    try:
+        assert not entry.loading and len(entry.timers) == COUNT
+        assert entry.allocate_id() == COUNT + 1
+    finally:
+        entry.close()
+
+
+def test_list_names(directory):
+    assert list_names() == [DEFAULT_LIST]
+    for name in ("Work", "Home"):
+        open_list(name).close()
+    # the default list first, then the others alphabetically
+    assert list_names() == [DEFAULT_LIST, "Home", "Work"]
+    assert todolists.list_path("Home") == os.path.join("lists", "Home.db")
+    assert check_list_name("  Side projects 2.0 ") == "Side projects 2.0"
+
+
+@pytest.mark.parametrize("name, message", [
+    ("", "Invalid list name"),
+    ("../timers", "Invalid list name"),
+    ("a/b", "Invalid list name"),
+    (".hidden", "Invalid list name"),
+    ("Default", "already exists"),
+    ("Work", "already exists"),
+])
+def test_invalid_list_name(directory, name, message):
+    open_list("Work").close()
+    with pytest.raises(ValueError, match=message):
+        check_list_name(name)
+
+
+def test_lists_are_separate(directory):
+    work = open_list("Work")
+    objid = work.allocate_id()
+    work.timers.add(objid, "Daily", "standup", 0, [9, 0])
+    work.database.add_timer("Daily", "standup", 0, "[9, 0]", objid)
+    assert work.close() == []
+    home = open_list("Home")
+    try:
+        assert len(home.timers) == 0
+    finally:
+        home.close()
+    work = open_list("Work")
+    try:
+        assert [work.timers.comment(objid) for objid in work.timers] == ["standup"]
+    finally:
+        work.close()
+
+
+def test_least_recently_viewed_released(directory):
+    opened = []
+
+    def loader(name):
+        opened.append(name)
+        return open_list(name)
+
+    lists = ListCache(loader, 2)
+    work = lists.get("Work")
+    home = lists.get("Home")
+    # viewing Work again makes Home the least recently viewed list
+    assert lists.get("Work") is work
+    lists.get(DEFAULT_LIST)
+    assert list(lists.loaded) == ["Work", DEFAULT_LIST] and "Home" not in lists
+    # the released list got closed, its writes committed
+    with pytest.raises(ValueError, match="closed"):
+        home.database.load_timers()
+    # and is loaded again when it is viewed next
+    assert lists.get("Home") is not home
+    assert list(lists.loaded) == [DEFAULT_LIST, "Home"]
+    assert opened == ["Work", "Home", DEFAULT_LIST, "Home"]
+    assert lists.close() == [] and not lists.loaded
+    with pytest.raises(ValueError, match="closed"):
+        work.database.load_timers()
+
+
+def test_released_list_writes(directory):
+    lists = ListCache(open_list, 1)
+    work = lists.get("Work")
+    objid = work.allocate_id()
+    work.timers.add(objid, "Daily", "standup", 0, [9, 0])
+    work.database.add_timer("Daily", "standup", 0, "[9, 0]", objid)
+    lists.get("Home")
+    assert "Work" not in lists
+    assert [lists.get("Work").timers.comment(objid)] == ["standup"]
+    lists.close()
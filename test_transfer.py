@@ -0,0 +1,92 @@
+import io
+
+import pytest
+
+import transfer
+from storage import SqliteStorage
+
+# Import and export of timers, mostly the rows an import has to refuse.
+
+GOOD = '{"type": "Daily", "comment": "Water the plants", "last_clicked": 0, "data": [8, 30]}\n'
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = SqliteStorage(str(tmp_path / "timers.db"))
+    yield database
+    database.close()
+
+
+def comments(database):
+    return [comment for objid, timertype, comment, lastclicked, data in database.load_timers()]
+
+
+def test_round_trip(database, tmp_path):
+    database.add_timer("Weekday", "Standup, \"daily\"", 1650000000, "[[0, 2, 4], 9, 45]")
+    database.add_timer("Rule", "Team meeting", 0, '["FREQ=MONTHLY;BYDAY=2TU;BYHOUR=10"]')
+    database.commit()
+    for fileformat in transfer.formats:
+        output = io.StringIO()
+        assert transfer.export_timers(database, output, fileformat) == 2
+        copy = SqliteStorage(str(tmp_path / f"{fileformat}.db"))
+        try:
+            assert transfer.import_timers(copy, io.StringIO(output.getvalue()), fileformat) == 2
+            assert [row[1:] for row in copy.load_timers()] == [row[1:] for row in database.load_timers()]
+        finally:
+            copy.close()
+
+
+@pytest.mark.parametrize("line, message", [
+    ('{"type": "Hourly", "comment": "x", "data": [1]}', "line 2"),
+    ('{"type": "Daily", "comment": "x", "data": [25, 0]}', "line 2"),
+    ('{"type": "Daily", "comment": "x", "data": "[8,"}', "line 2"),
+    ('{"type": "Daily", "comment": 5, "data": [8, 0]}', "Invalid comment"),
+    ('{"type": "Daily", "comment": null, "data": [8, 0]}', "Invalid comment"),
+    ('{"type": "Daily", "comment": "x", "last_clicked": -1, "data": [8, 0]}', "last clicked"),
+    ('{"type": "Daily", "comment": "x", "last_clicked": "soon", "data": [8, 0]}', "line 2"),
+    ('{"type": "Daily", "comment": "x"}', "invalid record"),
+    ('[1, 2, 3]', "invalid record"),
+    ('not json', "invalid record"),
+])
+def test_invalid_jsonl(database, line, message):
+    with pytest.raises(ValueError, match=message):
+        transfer.import_timers(database, io.StringIO(GOOD + line + "\n"), "jsonl", batchsize=1)
+    # batches before the broken line stay imported
+    assert comments(database) == ["Water the plants"]
+
+
+def test_stops_with_count(database):
+    source = io.StringIO(GOOD * 3 + '{"type": "Daily", "comment": "x", "data": []}\n' + GOOD)
+    with pytest.raises(ValueError, match="2 timers were imported"):
+        transfer.import_timers(database, source, "jsonl", batchsize=2)
+    # the broken line is in the second batch, only the first one got committed
+    assert len(comments(database)) == 2
+
+
+@pytest.mark.parametrize("text, message", [
+    ("type,comment,data\nDaily,x,\"[8, 0]\"\n", "Unexpected CSV header"),
+    ("type,comment,last_clicked,data\nDaily,x,0\n", "expected 4 fields"),
+    ("type,comment,last_clicked,data\nDaily,x,yesterday,\"[8, 0]\"\n", "line 2"),
+    ("type,comment,last_clicked,data\nMonthly,x,0,\"[32, 0, 0]\"\n", "line 2"),
+])
+def test_invalid_csv(database, text, message):
+    with pytest.raises(ValueError, match=message):
+        transfer.import_timers(database, io.StringIO(text), "csv")
+    assert comments(database) == []
+
+
+def test_csv_empty_fields(database):
+    text = "type,comment,last_clicked,data\nOnce,,,[1900000000]\n"
+    assert transfer.import_timers(database, io.StringIO(text), "csv") == 1
+    assert [row[1:] for row in database.load_timers()] == [("Once", "", 0, "[1900000000]")]
+
+
+def test_unknown_format(database):
+    with pytest.raises(ValueError, match="Can't import ics"):
+        transfer.import_timers(database, io.StringIO(""), "ics")
+
+
+def test_add_timers_from_iterator(database):
+    rows = [("Daily", f"task {number}", 0, "[8, 30]") for number in range(5)]
+    database.add_timers(iter(rows))
+    assert comments(database) == [f"task {number}" for number in range(5)]
@@ -0,0 +1,56 @@
+import random
+from time import localtime
+
+import numpy as np
+
+from conftest import START, END, brute_to_utc, transitions
+from tztable import DAY, TransitionTable, days_from_civil, civil_from_days, weekday
+
+# The transition table against localtime() itself, in every zone of conftest.ZONES.
+
+
+def test_utc_offset(zone):
+    table = TransitionTable()
+    rng = random.Random(zone)
+    samples = [rng.randrange(START, END) for _ in range(2000)]
+    for change in transitions():
+        samples += [change - 1, change, change + 1]
+    for ts in samples:
+        assert table.to_local(ts) == ts + localtime(ts).tm_gmtoff, ts
+
+
+def test_to_utc(zone):
+    table = TransitionTable()
+    rng = random.Random(zone)
+    samples = [rng.randrange(START, END) for _ in range(300)]
+    for change in transitions():
+        # both sides of every skipped and repeated hour
+        for delta in (-2*60*60, -60*60 - 1, -60*60, -30*60, -1, 0, 1, 30*60, 60*60, 2*60*60):
+            samples.append(change + localtime(change - 1).tm_gmtoff + delta)
+    for local in samples:
+        assert table.to_utc(local) == brute_to_utc(local), local
+
+
+def test_arrays_match_scalars(zone):
+    table = TransitionTable()
+    rng = np.random.default_rng(1)
+    ts = rng.integers(START, END, 5000)
+    assert table.to_local_array(ts).tolist() == [table.to_local(value) for value in ts.tolist()]
+    assert table.to_utc_array(ts).tolist() == [table.to_utc(value) for value in ts.tolist()]
+
+
+def test_extends_both_ways():
+    table = TransitionTable()
+    table.cover(START, START + DAY)
+    assert table.covers(START, START + DAY)
+    table.to_local(END)
+    table.to_local(0)
+    assert table.covers(0, END)
+
+
+def test_civil_dates():
+    for days in range(-800000, 800000, 997):
+        year, month, day = civil_from_days(days)
+        assert days_from_civil(year, month, day) == days
+    assert civil_from_days(0) == (1970, 1, 1)
+    assert weekday(days_from_civil(2022, 5, 2)) == 0  # a Monday
@@ -0,0 +1,88 @@
+import sqlite3
+
+import pytest
+
+import writebehind
+from storage import SqliteStorage
+from writebehind import WriteBehind
+
+# The write-behind writer thread: order of the writes, failures and the writes left on close().
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "timers.db")
+    SqliteStorage(path).close()
+    return path
+
+
+@pytest.fixture
+def database(path):
+    database = WriteBehind(lambda: SqliteStorage(path))
+    yield database
+    database.close()
+
+
+def test_writes_in_order(database):
+    for objid in range(1, 6):
+        database.add_timer("Daily", f"task {objid}", 0, "[8, 0]", objid)
+    database.set_last_clicked(2, 100)
+    database.delete_timer(3)
+    database.set_last_clicked(2, 200)
+    database.update_timer(4, "Daily", "changed", "[9, 0]")
+    # the read waits for all of them
+    assert [row[:4] for row in database.load_timers()] == [(1, "Daily", "task 1", 0), (2, "Daily", "task 2", 200),
+                                                           (4, "Daily", "changed", 0), (5, "Daily", "task 5", 0)]
+    assert database.request("has_timer", 3).result() is False
+
+
+def test_failed_read(database):
+    with pytest.raises(AttributeError):
+        database.no_such_method()
+    future = database.request("has_timer")
+    assert isinstance(future.exception(), TypeError)
+    # the writer goes on
+    assert database.load_timers() == []
+
+
+def test_failed_write(database, monkeypatch):
+    monkeypatch.setattr(writebehind, "COALESCE_DELAY", 1)
+    database.add_timer("Daily", "first", 0, "[8, 0]", 1)
+    database.add_timer("Daily", "duplicate", 0, "[8, 0]", 1)
+    database.add_timer("Daily", "second", 0, "[8, 0]", 2)
+    # only the failing write of the transaction is lost
+    assert [row[2] for row in database.load_timers()] == ["first", "second"]
+    [(error, count)] = database.errors()
+    assert isinstance(error, sqlite3.IntegrityError) and count == 1
+    assert database.errors() == []
+
+
+def test_close_writes_pending(path):
+    database = WriteBehind(lambda: SqliteStorage(path))
+    database.add_timers([("Daily", f"task {number}", 0, "[8, 0]") for number in range(100)])
+    database.set_last_clicked(1, 100)
+    database.close()
+    assert database.errors() == []
+    with pytest.raises(ValueError, match="closed"):
+        database.set_last_clicked(1, 200)
+    with pytest.raises(ValueError, match="closed"):
+        database.load_timers()
+    reopened = SqliteStorage(path)
+    try:
+        rows = reopened.load_timers()
+        assert len(rows) == 100 and rows[0][3] == 100
+    finally:
+        reopened.close()
+
+
+def test_open_error():
+    def opener():
+        raise OSError("no database")
+
+    database = WriteBehind(opener)
+    database.set_last_clicked(1, 100)
+    with pytest.raises(OSError, match="no database"):
+        database.load_timers()
+    database.close()
+    [(error, count)] = database.errors()
+    assert str(error) == "no database" and count == 1
@@ -1,21 +1,59 @@
 from datetime import datetime
-from calendar import monthrange
 from time import time as time_orig
 
+from recurrence import compile_rule
+from tztable import localzone, days_from_civil, civil_from_days, days_in_month, weekday
+
 # now = current time as datetime object
 # time = current time as timestamp
-# offset = UTC timezone offset in seconds
+# local times are converted with tztable.localzone, see LocalTimer
 now = datetime.now
 def time_int(): return int(time_orig())
-offset = now().astimezone().tzinfo.utcoffset(None).seconds
 
 MINUTE = 60
 HOUR = 60*60
 DAY = 24*60*60
 WEEK = 7*24*60*60
-timertypes = ("Daily", "Weekly", "Weekday", "Monthly", "Custom", "Once")
+timertypes = ("Daily", "Weekly", "Weekday", "Monthly", "Custom", "Once", "Rule")
 weekdays = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
 time_measurements = ("days", "hours", "minutes")  # , "seconds")
+unit_seconds = {"days": DAY, "hours": HOUR, "minutes": MINUTE, "seconds": 1}
+
+
+def format_remaining(timeleft):
+    minutesleft = (timeleft//MINUTE) % 60
+    hoursleft = (timeleft//HOUR) % 24
+    daysleft = timeleft//DAY
+    if daysleft:
+        return f"{daysleft}d {hoursleft}h"
+    elif hoursleft:
+        return f"{hoursleft}h {minutesleft:02}m"
+    elif minutesleft:
+        return f"{minutesleft}m"
+    else:
+        return "Less than 1m"
+
+
+def label_change_delay(timeleft):
+    # seconds until format_remaining(timeleft) shows a different text
+    if timeleft >= DAY:
+        return timeleft % HOUR + 1
+    else:
+        return timeleft % MINUTE + 1
+
+
+def shift_month(year, month, delta):
+    # returns (year, month) moved by delta months, month is 1-12
+    newyear, newmonth = divmod(year*12 + month - 1 + delta, 12)
+    return newyear, newmonth + 1
+
+
+def periodic_occurrences(phase, period, start, end):
+    # timestamps congruent to phase modulo period in [start, end), in closed form
+    occurrence = start + (phase - start) % period
+    while occurrence < end:
+        yield occurrence
+        occurrence += period
 
 
 class TimerTemplate:
@@ -27,30 +65,53 @@ class TimerTemplate:
         self.starttime = None
         self.interval = None
     
-    def lastdeadline(self):
-        intervalspassed = (time_int() - self.starttime) // self.interval
+    # every deadline method takes an optional currtime timestamp,
+    # so a whole refresh can be evaluated against a single clock reading
+    def lastdeadline(self, currtime=None):
+        if currtime is None:
+            currtime = time_int()
+        intervalspassed = (currtime - self.starttime) // self.interval
         lasttimestamp = self.starttime + self.interval * intervalspassed
         return lasttimestamp
     
-    def nextdeadline(self):
-        return self.lastdeadline() + self.interval
+    def nextdeadline(self, currtime=None):
+        return self.lastdeadline(currtime) + self.interval
 
-    def remaining_delta(self):
-        return self.nextdeadline() - time_int()
+    def remaining_delta(self, currtime=None):
+        if currtime is None:
+            currtime = time_int()
+        return self.nextdeadline(currtime) - currtime
     
-    def remaining_str(self):
-        timeleft = self.remaining_delta()
-        minutesleft = (timeleft//MINUTE) % 60
-        hoursleft = (timeleft//HOUR) % 24
-        daysleft = timeleft//DAY
-        if daysleft:
-            return f"{daysleft}d {hoursleft}h"
-        elif hoursleft:
-            return f"{hoursleft}h {minutesleft:02}m"
-        elif minutesleft:
-            return f"{minutesleft}m"
-        else:
-            return "Less than 1m"
+    def remaining_str(self, timeleft=None):
+        if timeleft is None:
+            timeleft = self.remaining_delta()
+        return format_remaining(timeleft)
+
+    # every occurrence method lazily yields deadline timestamps in [start, end) in ascending order
+    def occurrences(self, start, end):
+        return periodic_occurrences(self.starttime, self.interval, start, end)
+
+    # deadline_index(timestamp) = number of deadlines <= timestamp counted from an arbitrary origin,
+    # so deadlines in any range are counted in closed form instead of walking the occurrences
+    def deadline_index(self, timestamp):
+        return (timestamp - self.starttime) // self.interval
+
+    def missed_deadlines(self, since, currtime=None):
+        # number of deadlines in (since, currtime]
+        if currtime is None:
+            currtime = time_int()
+        if since >= currtime:
+            return 0
+        return self.deadline_index(currtime) - self.deadline_index(since)
+
+    def backlog(self, currtime=None):
+        # deadlines passed since the task was last completed,
+        # a task that was never completed or got unchecked counts once when its deadline passed
+        if currtime is None:
+            currtime = time_int()
+        if not self.lastclicked:
+            return int(self.lastdeadline(currtime) <= currtime)
+        return self.missed_deadlines(self.lastclicked, currtime)
 
 
 class CustomTimer(TimerTemplate):
@@ -60,15 +121,7 @@ class CustomTimer(TimerTemplate):
         # extraargs = (start time, integer, interval measurement units)
         self.starttime, interval_value, interval_units = extraargs
 
-        match interval_units:
-            case "days":
-                self.interval = interval_value * DAY
-            case "hours":
-                self.interval = interval_value * HOUR
-            case "minutes":
-                self.interval = interval_value * MINUTE
-            case "seconds":
-                self.interval = interval_value
+        self.interval = interval_value * unit_seconds[interval_units]
 
 
 class OnceTimer(TimerTemplate):
@@ -78,109 +131,196 @@ class OnceTimer(TimerTemplate):
         # extraargs = (start time)
         self.starttime = extraargs[0]
 
-    def lastdeadline(self):
+    def lastdeadline(self, currtime=None):
         return self.starttime
 
-    def nextdeadline(self):
+    def nextdeadline(self, currtime=None):
         return self.starttime
 
-    def remaining_delta(self):
-        return max(0, self.nextdeadline() - time_int())
+    def remaining_delta(self, currtime=None):
+        if currtime is None:
+            currtime = time_int()
+        return max(0, self.nextdeadline(currtime) - currtime)
 
-    def remaining_str(self):
-        if self.remaining_delta() == 0:
+    def remaining_str(self, timeleft=None):
+        if timeleft is None:
+            timeleft = self.remaining_delta()
+        if timeleft == 0:
             return "Overdue"
         else:
-            return super().remaining_str()
+            return super().remaining_str(timeleft)
+
+    def occurrences(self, start, end):
+        if start <= self.starttime < end:
+            yield self.starttime
+
+    def deadline_index(self, timestamp):
+        return int(timestamp >= self.starttime)
     
 
-class DailyTimer(TimerTemplate):
+class LocalTimer(TimerTemplate):
+    # not for use, only inheritance
+    # deadlines at a fixed local wall-clock time once per period (day, week, month),
+    # converted to UTC through the cached transition table so they stay right across DST changes
+    # subclasses define period(localday) and period_deadline(period) for integer period numbers
+
+    def deadlines(self, currtime=None):
+        # (last deadline <= currtime, next deadline > currtime)
+        if currtime is None:
+            currtime = time_int()
+        period = self.period((currtime + localzone.utc_offset(currtime)) // DAY)
+        current = self.period_deadline(period)
+        if current <= currtime:
+            return current, self.period_deadline(period + 1)
+        return self.period_deadline(period - 1), current
+
+    def lastdeadline(self, currtime=None):
+        return self.deadlines(currtime)[0]
+
+    def nextdeadline(self, currtime=None):
+        return self.deadlines(currtime)[1]
+
+    def deadline_index(self, timestamp):
+        # number of the period of the last deadline <= timestamp
+        period = self.period((timestamp + localzone.utc_offset(timestamp)) // DAY)
+        return period - (self.period_deadline(period) > timestamp)
+
+    def occurrences(self, start, end):
+        period = self.period(localzone.local_day(start)) - 1
+        while True:
+            occurrence = self.period_deadline(period)
+            if occurrence >= end:
+                return
+            if occurrence >= start:
+                yield occurrence
+            period += 1
+
+
+class DailyTimer(LocalTimer):
     def __init__(self, comment, lastclicked, extraargs):
         super().__init__(comment, lastclicked, extraargs)
         # extraargs = (hours, minutes)
-        
-        self.starttime = time_int() - (time_int() % DAY) - offset - DAY
-        self.starttime += self.extraargs[0]*HOUR + self.extraargs[1]*MINUTE
-        
+
+        self.base = self.extraargs[0]*HOUR + self.extraargs[1]*MINUTE
         self.interval = DAY
 
+    def period(self, localday):
+        return localday
+
+    def period_deadline(self, period):
+        return localzone.to_utc(period*DAY + self.base)
+
 
-class WeeklyTimer(TimerTemplate):
+class WeeklyTimer(LocalTimer):
     def __init__(self, comment, lastclicked, extraargs):
         super().__init__(comment, lastclicked, extraargs)
         # extraargs = (day of week, hours, minutes)
-        
-        self.starttime = time_int() - (time_int() % WEEK) - offset - WEEK - DAY*3
-        self.starttime += self.extraargs[0]*DAY + self.extraargs[1]*HOUR + self.extraargs[2]*MINUTE
-        
+
+        self.base = self.extraargs[0]*DAY + self.extraargs[1]*HOUR + self.extraargs[2]*MINUTE
         self.interval = WEEK
 
+    def period(self, localday):
+        # weeks since monday 1969-12-29
+        return (localday + 3) // 7
+
+    def period_deadline(self, period):
+        return localzone.to_utc((period*7 - 3)*DAY + self.base)
 
-class WeekdayTimer(TimerTemplate):
+
+class WeekdayTimer(LocalTimer):
     def __init__(self, comment, lastclicked, extraargs):
         super().__init__(comment, lastclicked, extraargs)
         # extraargs = ((days of week), hours, minutes)
-        
-        self.starttime = time_int() - (time_int() % WEEK) - offset - WEEK - DAY*3
-        self.starttime += self.extraargs[1]*HOUR + self.extraargs[2]*MINUTE
-        
-        self.interval = WEEK
-
-    def __gettimers(self):
-        weekstimes = []
-        for entry in self.extraargs[0]:
-            temp_starttime = self.starttime + entry * DAY
-            intervalspassed = (time_int() - temp_starttime) // self.interval
-            lasttimestamp = temp_starttime + self.interval * intervalspassed
-            weekstimes.append(lasttimestamp)
-        return weekstimes
-
-    def lastdeadline(self):
-        return max(self.__gettimers())
-    
-    def nextdeadline(self):
-        return min(self.__gettimers()) + self.interval
 
+        self.days = set(self.extraargs[0])
+        self.base = self.extraargs[1]*HOUR + self.extraargs[2]*MINUTE
+        self.interval = WEEK
 
-class MonthlyTimer(TimerTemplate):
+    # periods are days, the ones not on a selected weekday are skipped
+    def period_deadline(self, localday):
+        return localzone.to_utc(localday*DAY + self.base)
+
+    def deadlines(self, currtime=None):
+        if currtime is None:
+            currtime = time_int()
+        today = localzone.local_day(currtime)
+
+        lastdeadline = nextdeadline = None
+        for daysback in range(8):
+            if weekday(today - daysback) in self.days:
+                lastdeadline = self.period_deadline(today - daysback)
+                if lastdeadline <= currtime:
+                    break
+        for daysahead in range(8):
+            if weekday(today + daysahead) in self.days:
+                nextdeadline = self.period_deadline(today + daysahead)
+                if nextdeadline > currtime:
+                    break
+        return lastdeadline, nextdeadline
+
+    def deadline_index(self, timestamp):
+        # selected days since monday 1969-12-29 whose deadline is <= timestamp
+        localday = localzone.local_day(timestamp)
+        weeks, today = divmod(localday + 3, 7)
+        index = weeks*len(self.days) + sum(day <= today for day in self.days)
+        return index - (today in self.days and self.period_deadline(localday) > timestamp)
+
+    def occurrences(self, start, end):
+        localday = localzone.local_day(start) - 1
+        while True:
+            if weekday(localday) in self.days:
+                occurrence = self.period_deadline(localday)
+                if occurrence >= end:
+                    return
+                if occurrence >= start:
+                    yield occurrence
+            localday += 1
+
+
+class MonthlyTimer(LocalTimer):
     def __init__(self, comment, lastclicked, extraargs):
         super().__init__(comment, lastclicked, extraargs)
         # extraargs = (day, hours, minutes)
 
-    def __gettimers(self):
-        temptime1 = now()
+        self.day = self.extraargs[0]
+        self.base = self.extraargs[1]*HOUR + self.extraargs[2]*MINUTE
 
-        # get current month's day by variable, get last day of month if variable is out of bounds
-        temptime2 = datetime(
-            temptime1.year,
-            temptime1.month,
-            min(monthrange(temptime1.year, temptime1.month)[1], self.extraargs[0]),
-            self.extraargs[1],
-            self.extraargs[2])
+    def period(self, localday):
+        # months since january 1970
+        year, month, day = civil_from_days(localday)
+        return (year - 1970)*12 + month - 1
 
-        if temptime1 > temptime2:
-            monthdelta = 1
-        else:
-            monthdelta = -1
+    def period_deadline(self, period):
+        year, month = divmod(period, 12)
+        year, month = year + 1970, month + 1
+        # use last day of month if the day is out of bounds
+        day = min(days_in_month(year, month), self.day)
+        return localzone.to_utc(days_from_civil(year, month, day)*DAY + self.base)
 
-        newyear = (temptime1.year*12+temptime1.month+monthdelta)//12
-        newmonth = (12+temptime1.month+monthdelta) % 12
 
-        # get previous or next month's day by variable, get last day of month if variable is out of bounds
-        temptime3 = datetime(
-            newyear,
-            newmonth,
-            min(monthrange(newyear, newmonth)[1], self.extraargs[0]),
-            self.extraargs[1],
-            self.extraargs[2])
+class RuleTimer(TimerTemplate):
+    def __init__(self, comment, lastclicked, extraargs):
+        super().__init__(comment, lastclicked, extraargs)
+        # extraargs = (recurrence rule,), see recurrence.py
 
-        return temptime2, temptime3
+        self.rule = compile_rule(self.extraargs[0])
 
-    def lastdeadline(self):
-        return int(datetime.timestamp(min(self.__gettimers())))
-    
-    def nextdeadline(self):
-        return int(datetime.timestamp(max(self.__gettimers())))
+    def deadlines(self, currtime=None):
+        if currtime is None:
+            currtime = time_int()
+        return self.rule.deadlines(currtime)
+
+    def lastdeadline(self, currtime=None):
+        return self.deadlines(currtime)[0]
+
+    def nextdeadline(self, currtime=None):
+        return self.deadlines(currtime)[1]
+
+    def deadline_index(self, timestamp):
+        return self.rule.deadline_index(timestamp)
+
+    def occurrences(self, start, end):
+        return self.rule.occurrences(start, end)
 
 
 timerclass_dict = {
@@ -189,5 +329,6 @@ timerclass_dict = {
     "Weekday": WeekdayTimer,
     "Monthly": MonthlyTimer,
     "Custom": CustomTimer,
-    "Once": OnceTimer
+    "Once": OnceTimer,
+    "Rule": RuleTimer
 }
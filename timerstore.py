@@ -0,0 +1,194 @@
+import json
+import numpy as np
+
+from timerclasses import *
+from batchdeadlines import DeadlineBatch, args_params, params_args
+
+# Compact in-memory store for the whole timer list, replacing the {ID: [timertype, object]} dict.
+# Type, schedule and last clicked time live in the typed per-type arrays of DeadlineBatch,
+# comments are UTF-8 slices of a single bytearray. Nothing is kept per timer as a Python
+# object, timers[ID] returns a TimerView created on demand.
+
+
+class TimerView:
+    # handle on one stored timer, reads and writes go straight to the store arrays
+    __slots__ = ("store", "objid")
+
+    def __init__(self, store, objid):
+        self.store = store
+        self.objid = objid
+
+    @property
+    def timertype(self):
+        return self.store.timertype(self.objid)
+
+    @property
+    def comment(self):
+        return self.store.comment(self.objid)
+
+    @property
+    def lastclicked(self):
+        group, row = self.store.locate(self.objid)
+        return int(group.lastclicked[row])
+
+    @lastclicked.setter
+    def lastclicked(self, value):
+        self.store.set_last_clicked(self.objid, value)
+
+    @property
+    def extraargs(self):
+        return self.store.args(self.objid)
+
+    def timer(self):
+        # full timerclasses object for the scalar deadline methods
+        return self.store.timer(self.objid)
+
+    def lastdeadline(self, currtime=None):
+        return self.timer().lastdeadline(currtime)
+
+    def nextdeadline(self, currtime=None):
+        return self.timer().nextdeadline(currtime)
+
+    def remaining_delta(self, currtime=None):
+        return self.timer().remaining_delta(currtime)
+
+    def remaining_str(self, timeleft=None):
+        return self.timer().remaining_str(timeleft)
+
+    def backlog(self, currtime=None):
+        return self.timer().backlog(currtime)
+
+
+class TimerStore(DeadlineBatch):
+    def __init__(self):
+        # indexed by ID like typecodes and rows: comment slice in self.text
+        self.commentstarts = np.zeros(16, dtype=np.int64)
+        self.commentlengths = np.zeros(16, dtype=np.int32)
+        self.text = bytearray()
+        self.garbage = 0  # bytes of self.text no longer referenced
+        super().__init__()
+
+    @classmethod
+    def load(cls, rows):
+        # rows = iterable of (ID, type, comment, last clicked, JSON data), same as core.hydrate
+        store = cls()
+        grouped = {timertype: ([], [], []) for timertype in timertypes}
+        ids, comments = [], []
+        for objid, timertype, comment, lastclicked, data in rows:
+            groupids, clicked, params = grouped[timertype]
+            groupids.append(objid)
+            clicked.append(lastclicked or 0)
+            params.append(args_params(timertype, json.loads(data)))
+            ids.append(objid)
+            comments.append((comment or "").encode())
+        if not ids:
+            return store
+
+        store._reserve(max(ids))
+        for typecode, (timertype, (groupids, clicked, params)) in enumerate(grouped.items()):
+            if groupids:
+                store.typecodes[groupids] = typecode
+                store.rows[groupids] = store.groups[timertype].extend(groupids, clicked, params)
+        store.count = len(ids)
+
+        lengths = np.fromiter(map(len, comments), dtype=np.int64, count=len(comments))
+        store.commentstarts[ids] = np.cumsum(lengths) - lengths
+        store.commentlengths[ids] = lengths
+        store.text = bytearray(b"".join(comments))
+        return store
+
+    def merge(self, other):
+        # adds all timers of another store, none of its IDs may be in this one yet
+        ids = other.ids()
+        if len(ids) == 0:
+            return
+        self._reserve(int(ids.max()))
+        for typecode, (group, othergroup) in enumerate(zip(self.grouplist, other.grouplist)):
+            if othergroup.size == 0:
+                continue
+            groupids = othergroup.ids[:othergroup.size]
+            self.typecodes[groupids] = typecode
+            self.rows[groupids] = group.extend_columns(groupids, othergroup.lastclicked[:othergroup.size],
+                                                       [column[:othergroup.size] for column in othergroup.columns.values()])
+        self.count += len(ids)
+
+        self.commentstarts[ids] = other.commentstarts[ids] + len(self.text)
+        self.commentlengths[ids] = other.commentlengths[ids]
+        self.text += other.text
+        self.garbage += other.garbage
+
+    def _reserve(self, objid):
+        super()._reserve(objid)
+        missing = len(self.typecodes) - len(self.commentstarts)
+        if missing > 0:
+            self.commentstarts = np.concatenate((self.commentstarts, np.zeros(missing, np.int64)))
+            self.commentlengths = np.concatenate((self.commentlengths, np.zeros(missing, np.int32)))
+
+    def __getitem__(self, objid):
+        if objid not in self:
+            raise KeyError(objid)
+        return TimerView(self, objid)
+
+    def __delitem__(self, objid):
+        if objid not in self:
+            raise KeyError(objid)
+        self.discard(objid)
+
+    def __iter__(self):
+        return iter(self.ids().tolist())
+
+    def ids(self):
+        return np.flatnonzero(self.typecodes >= 0)
+
+    def add(self, objid, timertype, comment, lastclicked, args):
+        # adds a timer or replaces the one stored under objid
+        self.set_args(objid, timertype, args, lastclicked)
+        self.set_comment(objid, comment)
+
+    def discard(self, objid):
+        if objid in self:
+            self.garbage += int(self.commentlengths[objid])
+            self.commentlengths[objid] = 0
+        super().discard(objid)
+
+    def comment(self, objid):
+        start = self.commentstarts[objid]
+        return self.text[start:start + self.commentlengths[objid]].decode()
+
+    def set_comment(self, objid, comment):
+        encoded = comment.encode()
+        self.garbage += int(self.commentlengths[objid])
+        self.commentstarts[objid] = len(self.text)
+        self.commentlengths[objid] = len(encoded)
+        self.text += encoded
+        if self.garbage > len(self.text) // 2:
+            self._compact()
+
+    def _compact(self):
+        # drops the text of replaced and deleted comments
+        ids = self.ids()
+        comments = [self.text[start:start + length]
+                    for start, length in zip(self.commentstarts[ids].tolist(), self.commentlengths[ids].tolist())]
+        lengths = self.commentlengths[ids].astype(np.int64)
+        self.commentstarts[ids] = np.cumsum(lengths) - lengths
+        self.text = bytearray(b"".join(comments))
+        self.garbage = 0
+
+    def args(self, objid):
+        # argument list as stored in the Data column
+        group, row = self.locate(objid)
+        return params_args(self.timertype(objid), group.params(row))
+
+    def timer(self, objid):
+        typecode = self.typecodes[objid]
+        timertype = timertypes[typecode]
+        group, row = self.grouplist[typecode], self.rows[objid]
+        return timerclass_dict[timertype](self.comment(objid), int(group.lastclicked[row]),
+                                          params_args(timertype, group.params(row)))
+
+    def nbytes(self):
+        # memory held by the arrays and the comment text
+        arrays = [self.typecodes, self.rows, self.commentstarts, self.commentlengths]
+        for group in self.grouplist:
+            arrays += [group.ids, group.lastclicked, *group.columns.values()]
+        return sum(array.nbytes for array in arrays) + len(self.text)
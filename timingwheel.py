@@ -0,0 +1,99 @@
+# Hierarchical timing wheel with one second resolution.
+# Level k has SLOTS slots of SLOTS**k seconds each, an entry is put on the lowest
+# level whose range covers its deadline and moved down a level whenever the clock
+# enters its slot. Inserting, cancelling and firing are O(1) amortized, advancing
+# the clock only touches the slots it passes instead of all armed entries.
+
+SLOT_BITS = 8
+SLOTS = 1 << SLOT_BITS
+SLOT_MASK = SLOTS - 1
+LEVELS = 4  # 256**4 seconds, about 136 years
+
+
+class TimingWheel:
+    def __init__(self, currtime):
+        self.time = currtime  # everything due at or before this time has been handed out
+        self.wheels = [[[] for _ in range(SLOTS)] for _ in range(LEVELS)]
+        self.counts = [0] * LEVELS  # entries per level, cancelled ones included until their slot is passed
+        self.deadlines = {}  # ID: armed deadline, entries with a different deadline are cancelled
+        self.pending = []  # (ID, deadline) already due when they were inserted
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def insert(self, objid, deadline):
+        # arms objid, replacing its previous deadline
+        self.deadlines[objid] = deadline
+        self._place(objid, deadline)
+
+    def remove(self, objid):
+        self.deadlines.pop(objid, None)
+
+    def _place(self, objid, deadline):
+        delta = deadline - self.time
+        if delta <= 0:
+            self.pending.append((objid, deadline))
+            return
+        level = 0
+        while level < LEVELS - 1 and delta >= SLOTS ** (level + 1):
+            level += 1
+        self.wheels[level][(deadline >> (SLOT_BITS * level)) & SLOT_MASK].append((objid, deadline))
+        self.counts[level] += 1
+
+    def _take(self, level, index):
+        entries = self.wheels[level][index]
+        self.wheels[level][index] = []
+        self.counts[level] -= len(entries)
+        return entries
+
+    def _due(self, entries, fired):
+        for objid, deadline in entries:
+            if self.deadlines.get(objid) == deadline:
+                del self.deadlines[objid]
+                fired.append((objid, deadline))
+
+    def advance(self, currtime):
+        # moves the clock to currtime, returns [(ID, deadline)] of every entry that became due
+        fired = []
+        pending, self.pending = self.pending, []
+        self._due(pending, fired)
+
+        while self.time < currtime:
+            if not self.wheels[0][(self.time + 1) & SLOT_MASK] and (self.time + 1) & SLOT_MASK:
+                # nothing happens in the next second, jump right before the next slot that holds entries
+                nextexpiry = self.next_expiry()
+                if nextexpiry is None or nextexpiry > currtime:
+                    self.time = currtime
+                    break
+                self.time = nextexpiry - 1
+
+            self.time += 1
+            # entering a new slot of a higher level moves its entries down
+            for level in range(LEVELS - 1, 0, -1):
+                if self.time & ((1 << (SLOT_BITS * level)) - 1) == 0:
+                    index = (self.time >> (SLOT_BITS * level)) & SLOT_MASK
+                    for objid, deadline in self._take(level, index):
+                        if self.deadlines.get(objid) == deadline:
+                            self._place(objid, deadline)
+
+            self._due(self._take(0, self.time & SLOT_MASK), fired)
+            pending, self.pending = self.pending, []
+            self._due(pending, fired)
+        return fired
+
+    def next_expiry(self):
+        # earliest time advance() may have something to hand out, None if nothing is armed
+        if self.pending:
+            return self.time
+        candidates = []
+        for level, wheel in enumerate(self.wheels):
+            if self.counts[level] == 0:
+                continue
+            shift = SLOT_BITS * level
+            block = self.time >> shift
+            for step in range(1, SLOTS + 1):
+                if wheel[(block + step) & SLOT_MASK]:
+                    # exact on the lowest level, the time of the cascade on the higher ones
+                    candidates.append((block + step) << shift)
+                    break
+        return min(candidates, default=None)
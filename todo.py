@@ -0,0 +1,279 @@
+import argparse
+import json
+import sys
+from os import environ
+from os.path import exists, isdir
+
+import core
+from storage import SqliteStorage, DEFAULT_ADDRESS
+from timerclasses import *
+
+# Command line interface for cron jobs and shell prompts, never imports tkinter or SQLAlchemy.
+# Modules only some commands need are imported by those commands, every call pays for the rest.
+# Examples:
+#   python todo.py list --due-within 2h
+#   python todo.py done 12
+#   python todo.py stats
+#   python todo.py search "#garden wat"
+#   python todo.py add Daily "Water the plants" --at 08:30
+#   python todo.py add Weekday "Standup" --days Mon,Wed,Fri --at 09:45
+#   python todo.py add Custom "Backup" --start "2022-05-01 03:00" --every 3 --unit days
+#   python todo.py add Rule "Team meeting" --rule "FREQ=MONTHLY;BYDAY=2TU;BYHOUR=10"
+#   python todo.py agenda --days 7
+#   python todo.py export timers.jsonl
+#   python todo.py export calendar.ics --days 365
+#   python todo.py import maintenance.csv
+#   python todo.py serve --address 127.0.0.1:8765
+#   python todo.py sync /mnt/share/todo
+
+
+def parse_clock(text):
+    hours, separator, minutes = text.partition(":")
+    if not separator:
+        raise ValueError(f"Invalid time \"{text}\", use HH:MM")
+    return core.check_number(hours, "hour", 0, 23), core.check_number(minutes, "minute", 0, 59)
+
+
+def weekday_index(text):
+    if text.capitalize() not in weekdays:
+        raise ValueError(f"Unknown weekday \"{text}\", use one of {', '.join(weekdays)}")
+    return weekdays.index(text.capitalize())
+
+
+def build_args(options):
+    # same argument tuples as NewEntryWindow.add_timer stores in the Data column
+    match options.type:
+        case "Daily":
+            return parse_clock(options.at or "")
+        case "Weekly":
+            return (weekday_index(options.day or ""), *parse_clock(options.at or ""))
+        case "Weekday":
+            days = sorted({weekday_index(day) for day in (options.days or "").split(",") if day})
+            if len(days) == 0:
+                raise ValueError("Not a single weekday was selected.")
+            return (days, *parse_clock(options.at or ""))
+        case "Monthly":
+            return (core.check_number(options.day or "", "day", 1, 31), *parse_clock(options.at or ""))
+        case "Custom":
+            interval = core.check_number(options.every or "", "interval", 1, -1)
+            return (core.parse_date(options.start or "", "starting date"), interval, options.unit)
+        case "Once":
+            return (core.parse_date(options.at or "", "end date"),)
+        case "Rule":
+            return core.validate_args("Rule", [options.rule or ""])
+
+
+def command_list(database, options):
+    currtime = time_int()
+    window = core.parse_duration(options.due_within) if options.due_within else None
+
+    if options.all:
+        rows = database.load_timers()
+    else:
+        # indexed range scan over the materialized deadlines, only matching rows get hydrated
+        rows = database.due_timers(currtime, window, options.limit)
+        database.commit()
+    timers = core.hydrate(rows)
+
+    entries = []
+    for objid, (timertype, timer) in timers.items():
+        timeleft = timer.remaining_delta(currtime)
+        if window is not None and timeleft > window:
+            continue
+        entries.append((timeleft, objid, timer))
+
+    for timeleft, objid, timer in sorted(entries, key=lambda x: (x[0], x[1]))[:options.limit]:
+        print(f"{objid}\t{timer.remaining_str(timeleft)}\t{timer.comment}")
+
+
+def agenda_window(options):
+    # [start, end) from --from and --days
+    start = core.parse_date(options.start, "starting date") if options.start else time_int()
+    if options.days < 0:
+        raise ValueError("Number of days can't be negative")
+    return start, start + options.days*DAY
+
+
+def command_agenda(database, options):
+    import agenda
+    start, end = agenda_window(options)
+    occurrences = agenda.agenda(agenda.timers_from_rows(database.load_timers()), start, end)
+    for number, (timestamp, objid, timertype, comment) in enumerate(occurrences):
+        if options.limit is not None and number >= options.limit:
+            break
+        print(f"{datetime.fromtimestamp(timestamp).strftime(core.DATE_FORMAT)}\t{objid}\t{comment}")
+
+
+def command_done(database, options):
+    # only the completed timer's row is read
+    row = database.load_timer(options.id)
+    if row is None:
+        raise ValueError(f"No task with id {options.id}")
+    timertype, timer = core.hydrate([row])[options.id]
+    clicked = time_int()
+    record = core.completion(timertype, timer, clicked)
+    if record is not None:
+        database.record_completion(options.id, clicked, *record)
+    if timertype == "Once":
+        database.delete_timer(options.id)
+    else:
+        database.set_last_clicked(options.id, clicked)
+    database.commit()
+
+
+def command_stats(database, options):
+    stats = database.load_stats()
+    for objid, timertype, comment, lastclicked, data in database.load_timers():
+        if objid not in stats:
+            continue
+        completions, ontime, streak, beststreak, lateness = core.stats_summary(*stats[objid])
+        late = "never late" if lateness is None else f"{format_remaining(lateness)} late on average"
+        print(f"{objid}\t{completions} done\t{ontime:.0%} on time\tstreak {streak} (best {beststreak})\t"
+              f"{late}\t{comment}")
+
+
+def command_search(database, options):
+    matches = set(database.search(options.text))
+    for objid, timertype, comment, lastclicked, data in database.load_timers():
+        if objid in matches:
+            print(f"{objid}\t{timertype}\t{comment}")
+
+
+def command_add(database, options):
+    comment = options.description.strip()
+    if len(comment) == 0:
+        raise ValueError("Task description is empty!")
+    objid = database.add_timer(options.type, comment, 0, json.dumps(build_args(options)))
+    database.commit()
+    print(objid)
+
+
+def check_format(fileformat, formats):
+    if fileformat not in formats:
+        raise ValueError(f"Unknown format \"{fileformat}\", use one of {', '.join(formats)}")
+
+
+def open_text(path, mode):
+    # "-" means stdin/stdout
+    if path == "-":
+        return sys.stdin if mode == "r" else sys.stdout
+    return open(path, mode, newline="", encoding="utf-8")
+
+
+def command_export(database, options):
+    import agenda
+    import transfer
+    fileformat = options.format or transfer.guess_format(options.file)
+    check_format(fileformat, transfer.export_formats)
+    if fileformat == "ics":
+        start, end = agenda_window(options)
+    output = open_text(options.file, "w")
+    try:
+        if fileformat == "ics":
+            count = agenda.export_ics(agenda.timers_from_rows(database.iter_timers()), output, start, end)
+        else:
+            count = transfer.export_timers(database, output, fileformat)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(f"Exported {count} {'events' if fileformat == 'ics' else 'timers'}.", file=sys.stderr)
+
+
+def command_import(database, options):
+    import transfer
+    fileformat = options.format or transfer.guess_format(options.file)
+    check_format(fileformat, transfer.formats)
+    source = open_text(options.file, "r")
+    try:
+        count = transfer.import_timers(database, source, fileformat, options.batch_size or transfer.BATCH_SIZE)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    print(f"Imported {count} timers.", file=sys.stderr)
+
+
+def command_serve(database, options):
+    import server
+    # the schema is in place now, the server opens its own connections
+    database.close()
+    server.serve(options.db, options.address, options.readers or server.READER_CONNECTIONS)
+
+
+def command_sync(database, options):
+    import sync
+    if not isdir(options.directory):
+        raise FileNotFoundError(f"Directory \"{options.directory}\" not found")
+    received, applied, sent = sync.sync(database, options.directory)
+    print(f"Received {received} changes, applied {applied}, sent {sent}.", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="todo", description="Query and update the to-do list without the GUI.")
+    parser.add_argument("--db", default=core.DATABASE, help="database file (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    listparser = commands.add_parser("list", help="list unfinished tasks by deadline")
+    listparser.add_argument("--due-within", metavar="DURATION", help="only tasks due within e.g. 90m, 2h, 1d")
+    listparser.add_argument("--all", action="store_true", help="include completed tasks")
+    listparser.add_argument("--limit", type=int, help="show at most this many tasks")
+
+    doneparser = commands.add_parser("done", help="mark a task as completed")
+    doneparser.add_argument("id", type=int)
+
+    commands.add_parser("stats", help="show completion statistics of every task")
+
+    searchparser = commands.add_parser("search", help="find tasks by words and #tags in their description")
+    searchparser.add_argument("text", help="words are matched as prefixes, #tag only matches tags")
+
+    addparser = commands.add_parser("add", help="add a new task")
+    addparser.add_argument("type", choices=timertypes)
+    addparser.add_argument("description")
+    addparser.add_argument("--at", help="HH:MM reset time, or YYYY-MM-DD HH:MM end time for Once")
+    addparser.add_argument("--day", help="weekday name for Weekly, day of month for Monthly")
+    addparser.add_argument("--days", help="comma separated weekday names for Weekday")
+    addparser.add_argument("--start", help="YYYY-MM-DD HH:MM start time for Custom")
+    addparser.add_argument("--every", help="interval value for Custom")
+    addparser.add_argument("--unit", choices=time_measurements, default=time_measurements[-1])
+    addparser.add_argument("--rule", help="recurrence rule for Rule, e.g. \"FREQ=WEEKLY;BYDAY=MO,TH;BYHOUR=9\"")
+
+    agendaparser = commands.add_parser("agenda", help="list upcoming deadlines of all tasks in time order")
+    agendaparser.add_argument("--from", dest="start", metavar="DATE", help="YYYY-MM-DD HH:MM (default: now)")
+    agendaparser.add_argument("--days", type=int, default=7, help="length of the agenda (default: %(default)s)")
+    agendaparser.add_argument("--limit", type=int, help="show at most this many deadlines")
+
+    exportparser = commands.add_parser("export", help="write all timers to a JSON Lines, CSV or iCalendar file")
+    exportparser.add_argument("file", help="output file, - for stdout")
+    exportparser.add_argument("--format", help="jsonl, csv or ics (default: guessed from file extension)")
+    exportparser.add_argument("--from", dest="start", metavar="DATE", help="first deadline for ics (default: now)")
+    exportparser.add_argument("--days", type=int, default=365, help="days of deadlines for ics (default: %(default)s)")
+
+    importparser = commands.add_parser("import", help="add timers from a JSON Lines or CSV file")
+    importparser.add_argument("file", help="input file, - for stdin")
+    importparser.add_argument("--format", help="jsonl or csv (default: guessed from file extension)")
+    importparser.add_argument("--batch-size", type=int, help="timers per transaction (default: 10000)")
+
+    serveparser = commands.add_parser("serve", help="answer JSON API requests from local clients, see server.py")
+    serveparser.add_argument("--address", default=environ.get("TODO_SERVER", DEFAULT_ADDRESS),
+                             help="loopback host:port or Unix socket path (default: %(default)s)")
+    serveparser.add_argument("--readers", type=int, help="connections serving reads concurrently (default: 4)")
+
+    syncparser = commands.add_parser("sync", help="exchange changes with other machines through a shared directory")
+    syncparser.add_argument("directory", help="directory shared by all machines, e.g. a synced folder")
+
+    options = parser.parse_args(argv)
+    handlers = {"list": command_list, "agenda": command_agenda, "done": command_done, "stats": command_stats,
+                "search": command_search, "add": command_add, "export": command_export, "import": command_import,
+                "serve": command_serve, "sync": command_sync}
+
+    try:
+        if options.command not in ("add", "import", "serve", "sync") and not exists(options.db):
+            raise FileNotFoundError(f"File \"{options.db}\" not found")
+        handlers[options.command](SqliteStorage(options.db), options)
+    except (ValueError, OSError) as error:
+        print(f"todo: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+import logging
+import re
+from collections import OrderedDict
+from os import listdir
+from os.path import isdir, join as joinpath
+
+import core
+import perfstats
+import snapshot
+import storage
+from deadlineindex import DeadlineIndex
+from timerstore import TimerStore
+from timerclasses import time_int
+from writebehind import WriteBehind
+
+# Named task lists, each one a database file of its own: the default list is timers.db,
+# every other list is lists/<name>.db. A list is only loaded when it is viewed, and the
+# least recently viewed ones are released again once more than a handful are loaded.
+# Without a current snapshot a list starts out with its most urgent timers only, the
+# rest is added page by page (request_page() and add_page()), so opening it takes the
+# same time at any size.
+#   lists = ListCache(lambda name: OpenList(name, "sqlite", DueDispatcher), capacity=3)
+#   current = lists.get("Work")  # loads lists/Work.db on first use
+#   lists.close()                # commits and closes every loaded list
+
+log = logging.getLogger(__name__)
+
+# timers loaded before the list is shown when there is no snapshot: the most urgent ones, a screenful and then some
+FIRST_PAGE = 100
+# timers per page loaded in the background after that, see OpenList.request_page
+PAGE_SIZE = 2000
+
+LISTS_DIRECTORY = "lists"
+DEFAULT_LIST = "Default"
+LIST_NAME = re.compile(r"[\w][\w .-]*")
+
+
+def list_path(name):
+    if name == DEFAULT_LIST:
+        return core.DATABASE
+    return joinpath(LISTS_DIRECTORY, name + ".db")
+
+
+def list_names():
+    # default list first, then the others alphabetically
+    if not isdir(LISTS_DIRECTORY):
+        return [DEFAULT_LIST]
+    names = sorted(filename[:-3] for filename in listdir(LISTS_DIRECTORY)
+                   if filename.endswith(".db") and filename[:-3] != DEFAULT_LIST)
+    return [DEFAULT_LIST] + names
+
+
+def check_list_name(name):
+    # name of a new list, raises ValueError
+    name = name.strip()
+    if not LIST_NAME.fullmatch(name):
+        raise ValueError(f"Invalid list name \"{name}\", use letters, digits, spaces, dots and dashes")
+    if name in list_names():
+        raise ValueError(f"List \"{name}\" already exists")
+    return name
+
+
+class OpenList:
+    # a loaded list: its writer thread, timers, deadline index and dispatcher
+    def __init__(self, name, backend, make_dispatcher):
+        # make_dispatcher(timers) returns the DueDispatcher for the list's timers
+        self.name = name
+        self.path = list_path(name)
+        with perfstats.timed("list.database"):
+            # all database access goes through a writer thread, the Tk thread only waits for reads
+            self.database = WriteBehind(lambda: storage.open_storage(backend, self.path))
+            counter = self.database.track_changes()
+
+        with perfstats.timed("list.hydrate"):
+            # the snapshot saved when the list was closed is only used if nothing changed the database since
+            self.timers = snapshot.load(snapshot.snapshot_path(self.path), counter)
+            self.snapshotcounter = counter if self.timers is not None else None
+            self.loaded_after = None  # highest ID add_page() got to, None once all timers are loaded
+            self.removed = set()  # IDs deleted while loading, a page read before the deletion still has them
+            if self.timers is None:
+                log.info(f"No current timer snapshot for list \"{name}\", loading timers from the database.")
+                # enough to paint the top of the list, everything else follows page by page
+                self.database.refresh_deadlines(time_int())
+                self.timers = TimerStore.load(self.database.urgent_timers(FIRST_PAGE))
+                self.loaded_after = 0
+        log.debug(f"List \"{name}\" holds {len(self.timers)} entries so far.")
+
+        # new timers get their ID here instead of from the database, adding one never waits for the writer
+        if self.loading:
+            self.next_id = self.database.max_timer_id() + 1
+        else:
+            self.next_id = int(self.timers.ids().max()) + 1 if len(self.timers) else 1
+
+        # timers sorted by next deadline, keep in sync with the timers
+        with perfstats.timed("list.index"):
+            self.deadlines = DeadlineIndex(self.timers)
+        with perfstats.timed("list.dispatcher"):
+            self.dispatcher = make_dispatcher(self.timers)
+
+    @property
+    def loading(self):
+        return self.loaded_after is not None
+
+    def request_page(self):
+        # Future of the next PAGE_SIZE rows by ID, read on the writer thread after the writes queued so far
+        return self.database.request("load_timers_page", self.loaded_after, PAGE_SIZE)
+
+    def add_page(self, rows, currtime=None):
+        # adds the rows of a request_page() that aren't loaded yet, returns how many were added
+        # the ones already loaded keep their possibly newer state
+        if not self.loading:
+            return 0
+        self.loaded_after = rows[-1][0] if len(rows) == PAGE_SIZE else None
+        page = TimerStore.load(row for row in rows if row[0] not in self.timers and row[0] not in self.removed)
+        if not self.loading:
+            self.removed.clear()
+        self.timers.merge(page)
+        self.deadlines.add_all(page, currtime)
+        self.dispatcher.arm_all(page, currtime)
+        return len(page)
+
+    def load_page(self, currtime=None):
+        # request_page() and add_page() in one, waits for the writer
+        if not self.loading:
+            return 0
+        return self.add_page(self.request_page().result(), currtime)
+
+    def remove(self, objids):
+        # deletes timers from the database, the store, the deadline index and the dispatcher
+        self.database.delete_timers(objids)
+        for objid in objids:
+            del self.timers[objid]
+            self.dispatcher.cancel(objid)
+        self.deadlines.discard_many(objids)
+        if self.loading:
+            self.removed.update(objids)
+
+    def allocate_id(self):
+        objid = self.next_id
+        self.next_id += 1
+        return objid
+
+    def close(self):
+        # commits the remaining changes and saves a snapshot for the next load, returns the failed writes
+        self.database.close()
+        failed = self.database.errors()
+        counter = self.database.synced_counter()
+        # a partly loaded list has nothing to snapshot
+        if counter is not None and counter != self.snapshotcounter and not self.loading:
+            try:
+                snapshot.save(self.timers, snapshot.snapshot_path(self.path), counter)
+            except OSError as error:
+                log.warning(f"Couldn't save timer snapshot of list \"{self.name}\": {error}")
+        return failed
+
+
+class ListCache:
+    # loaded lists by name, least recently viewed first
+    def __init__(self, loader, capacity):
+        # loader(name) returns the OpenList, capacity = lists kept loaded including the active one
+        self.loader = loader
+        self.capacity = max(1, capacity)
+        self.loaded = OrderedDict()
+
+    def __contains__(self, name):
+        return name in self.loaded
+
+    def get(self, name):
+        # the list, loaded if necessary, becomes the most recently viewed one
+        if name in self.loaded:
+            self.loaded.move_to_end(name)
+            return self.loaded[name]
+        entry = self.loader(name)
+        self.loaded[name] = entry
+        while len(self.loaded) > self.capacity:
+            self.release(next(iter(self.loaded)))
+        return entry
+
+    def release(self, name):
+        entry = self.loaded.pop(name)
+        log.info(f"Releasing list \"{name}\"")
+        for error, count in entry.close():
+            log.error(f"Lost {count} changes of list \"{name}\": {error}")
+
+    def close(self):
+        # returns [(list name, exception, number of lost changes)]
+        failed = []
+        while self.loaded:
+            name, entry = self.loaded.popitem(last=False)
+            failed += [(name, error, count) for error, count in entry.close()]
+        return failed
@@ -0,0 +1,107 @@
+import csv
+import json
+from itertools import islice
+
+import core
+
+# Streaming import and export of the Timers table as JSON Lines or CSV.
+# Each record holds the stored columns: type, comment, last_clicked and data,
+# data being the same argument list the Data column holds. Rows are read and
+# written one at a time and inserted in batched transactions, so memory use
+# doesn't depend on the file size.
+
+formats = ("jsonl", "csv")
+export_formats = formats + ("ics",)  # iCalendar events, written by agenda.export_ics
+CSV_HEADER = ("type", "comment", "last_clicked", "data")
+BATCH_SIZE = 10000  # also named in the --batch-size help of todo.py
+
+
+def guess_format(path):
+    for fileformat in export_formats:
+        if path.lower().endswith(f".{fileformat}"):
+            return fileformat
+    return "jsonl"
+
+
+def export_timers(database, output, fileformat="jsonl"):
+    # output = text file object, returns number of exported timers
+    count = 0
+    if fileformat == "csv":
+        writer = csv.writer(output)
+        writer.writerow(CSV_HEADER)
+        for objid, timertype, comment, lastclicked, data in database.iter_timers():
+            writer.writerow((timertype, comment, lastclicked, data))
+            count += 1
+    else:
+        for objid, timertype, comment, lastclicked, data in database.iter_timers():
+            # data already is JSON text, no need to decode and encode it again
+            output.write(f'{{"type": {json.dumps(timertype)}, "comment": {json.dumps(comment)}, '
+                         f'"last_clicked": {int(lastclicked or 0)}, "data": {data}}}\n')
+            count += 1
+    return count
+
+
+def read_records(source, fileformat="jsonl"):
+    # yields (line number, type, comment, last clicked, decoded data)
+    if fileformat == "csv":
+        reader = csv.reader(source)
+        header = next(reader, None)
+        if header is not None and tuple(header) != CSV_HEADER:
+            raise ValueError(f"Unexpected CSV header {header}, expected {list(CSV_HEADER)}")
+        for row in reader:
+            if len(row) != len(CSV_HEADER):
+                raise ValueError(f"line {reader.line_num}: expected {len(CSV_HEADER)} fields, got {len(row)}")
+            timertype, comment, lastclicked, data = row
+            yield reader.line_num, timertype, comment, lastclicked, data
+    else:
+        for linenumber, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                yield (linenumber, record["type"], record.get("comment", ""), record.get("last_clicked", 0),
+                       record["data"])
+            except (ValueError, KeyError, TypeError, AttributeError) as error:
+                raise ValueError(f"line {linenumber}: invalid record ({error})")
+
+
+def validated_rows(records):
+    # yields (type, comment, last clicked, decoded data) checked by core.validate_args
+    for linenumber, timertype, comment, lastclicked, data in records:
+        try:
+            if isinstance(data, str):
+                data = json.loads(data)
+            core.validate_args(timertype, data)
+            if not isinstance(comment, str):
+                raise ValueError("Invalid comment, expected text")
+            if isinstance(lastclicked, str):
+                lastclicked = core.check_number(lastclicked or "0", "last clicked", 0, -1)
+            elif type(lastclicked) is not int or lastclicked < 0:
+                raise ValueError("Invalid last clicked timestamp")
+        except ValueError as error:
+            raise ValueError(f"line {linenumber}: {error}")
+        yield timertype, comment, lastclicked, data
+
+
+def import_timers(database, source, fileformat="jsonl", batchsize=BATCH_SIZE):
+    # source = text file object, commits every batchsize rows, returns number of imported timers
+    from batchdeadlines import schedule_rows
+
+    if fileformat not in formats:
+        raise ValueError(f"Can't import {fileformat} files, use one of {', '.join(formats)}")
+    records = validated_rows(read_records(source, fileformat))
+    count = 0
+    while True:
+        try:
+            batch = list(islice(records, batchsize))
+        except ValueError as error:
+            raise ValueError(f"{error}\nImport stopped, {count} timers were imported before the error.")
+        if not batch:
+            return count
+
+        # deadline columns for the whole batch come from one numpy pass
+        schedules = schedule_rows([(timertype, data) for timertype, comment, lastclicked, data in batch])
+        rows = [(timertype, comment, lastclicked, json.dumps(data)) for timertype, comment, lastclicked, data in batch]
+        database.add_timers(rows, schedules)
+        database.commit()
+        count += len(batch)
@@ -0,0 +1,159 @@
+from bisect import bisect_right
+from time import localtime
+
+# Cached table of the local timezone's UTC offset transitions, so converting between
+# UTC timestamps and local wall-clock seconds is a bisect and an addition instead of
+# a datetime/localtime call. The table covers a range of UTC timestamps and is
+# extended by whole years whenever a query falls outside of it.
+# Local wall-clock seconds = seconds since 1970-01-01 00:00 in local time, so
+# local // DAY is a day number and local % DAY the time of day.
+
+DAY = 24*60*60
+YEAR = 365*DAY
+MAX_OFFSET = DAY  # no UTC offset is a day or more, bounds the local/UTC difference
+
+
+# the civil date helpers only use floor division and arithmetic, so they work on ints and numpy arrays alike
+# numpy itself is only imported for the array conversions, the scalar path keeps the command line fast
+
+def days_from_civil(year, month, day):
+    # day number since 1970-01-01 of a proleptic Gregorian date, integer only
+    year = year - (month <= 2)
+    era = year // 400
+    yearofera = year - era*400
+    dayofyear = (153*(month - 3 + 12*(month <= 2)) + 2)//5 + day - 1
+    dayofera = yearofera*365 + yearofera//4 - yearofera//100 + dayofyear
+    return era*146097 + dayofera - 719468
+
+
+def civil_from_days(days):
+    # (year, month, day) of a day number since 1970-01-01, inverse of days_from_civil
+    days = days + 719468
+    era = days // 146097
+    dayofera = days - era*146097
+    yearofera = (dayofera - dayofera//1460 + dayofera//36524 - dayofera//146096) // 365
+    dayofyear = dayofera - (365*yearofera + yearofera//4 - yearofera//100)
+    monthpart = (5*dayofyear + 2)//153
+    day = dayofyear - (153*monthpart + 2)//5 + 1
+    month = monthpart + 3 - 12*(monthpart >= 10)
+    return yearofera + era*400 + (month <= 2), month, day
+
+
+def days_in_month(year, month):
+    return days_from_civil(year + (month == 12), month % 12 + 1, 1) - days_from_civil(year, month, 1)
+
+
+def weekday(days):
+    # 0 = Monday for a day number, 1970-01-01 was a Thursday
+    return (days + 3) % 7
+
+
+class TransitionTable:
+    def __init__(self, start=None, end=None):
+        self.start = self.end = 0  # covered UTC range, empty until the first query
+        self.times = []  # UTC timestamps the offsets below start at, times[0] = start of the table
+        self.offsets = []
+        self.thresholds = []  # local seconds from which offsets[i] applies when converting to UTC
+        self.timearray = self.offsetarray = self.thresholdarray = None  # see _arrays
+        # most lookups are close to the current time: the last UTC and local interval found with a single offset
+        self.utclow = self.utchigh = self.utcoffset = 0
+        self.locallow = self.localhigh = self.localoffset = 0
+        if start is not None:
+            self.cover(start, end)
+
+    def _offset(self, ts):
+        return localtime(ts).tm_gmtoff
+
+    def _build(self, start, end):
+        # samples the offset once a day and bisects every change down to the second
+        times, offsets = [start], [self._offset(start)]
+        prevts = start
+        for ts in range(start + DAY, end + DAY, DAY):
+            tsoffset = self._offset(ts)
+            if tsoffset != offsets[-1]:
+                low, high = prevts, ts
+                while high - low > 1:
+                    middle = (low + high) // 2
+                    if self._offset(middle) == offsets[-1]:
+                        low = middle
+                    else:
+                        high = middle
+                times.append(high)
+                offsets.append(tsoffset)
+            prevts = ts
+
+        # skipped local times resolve with the old offset, repeated ones to their first occurrence
+        thresholds = [start + offsets[0]]
+        for index in range(1, len(times)):
+            thresholds.append(times[index] + max(offsets[index - 1], offsets[index]))
+
+        self.start, self.end = start, end
+        self.times, self.offsets, self.thresholds = times, offsets, thresholds
+        self.timearray = self.offsetarray = self.thresholdarray = None  # see _arrays
+        self.utclow = self.utchigh = self.locallow = self.localhigh = 0
+
+    def _arrays(self):
+        # numpy copies of the table for the array conversions, made on their first use
+        if self.timearray is None:
+            import numpy as np
+            self.timearray = np.array(self.times, dtype=np.int64)
+            self.offsetarray = np.array(self.offsets, dtype=np.int64)
+            self.thresholdarray = np.array(self.thresholds, dtype=np.int64)
+
+    def covers(self, start, end):
+        return self.start < self.end and self.start <= start and end <= self.end
+
+    def cover(self, start, end):
+        # makes sure UTC timestamps in [start, end) can be looked up, extending by whole years
+        if self.covers(start, end):
+            return
+        if self.start < self.end:
+            start, end = min(start, self.start), max(end, self.end)
+        self._build(start - start % YEAR - YEAR, end - end % YEAR + 2*YEAR)
+
+    def utc_offset(self, ts):
+        if self.utclow <= ts < self.utchigh:
+            return self.utcoffset
+        self.cover(ts, ts + 1)
+        index = bisect_right(self.times, ts) - 1
+        self.utclow = self.times[index]
+        self.utchigh = self.times[index + 1] if index + 1 < len(self.times) else self.end
+        self.utcoffset = self.offsets[index]
+        return self.utcoffset
+
+    def to_local(self, ts):
+        return ts + self.utc_offset(ts)
+
+    def local_day(self, ts):
+        return self.to_local(ts) // DAY
+
+    def to_local_array(self, ts):
+        # to_local for a numpy array of UTC timestamps
+        if len(ts) == 0:
+            return ts
+        self.cover(int(ts.min()), int(ts.max()) + 1)
+        self._arrays()
+        return ts + self.offsetarray[self.timearray.searchsorted(ts, side="right") - 1]
+
+    def to_utc(self, local):
+        if self.locallow <= local < self.localhigh:
+            return local - self.localoffset
+        self.cover(local - MAX_OFFSET, local + MAX_OFFSET)
+        index = max(0, bisect_right(self.thresholds, local) - 1)
+        self.locallow = self.thresholds[index] if index else self.start + MAX_OFFSET
+        self.localhigh = self.thresholds[index + 1] if index + 1 < len(self.thresholds) else self.end - MAX_OFFSET
+        self.localoffset = self.offsets[index]
+        return local - self.localoffset
+
+    def to_utc_array(self, local):
+        # to_utc for a numpy array of local seconds
+        if len(local) == 0:
+            return local
+        self.cover(int(local.min()) - MAX_OFFSET, int(local.max()) + MAX_OFFSET)
+        self._arrays()
+        positions = (self.thresholdarray.searchsorted(local, side="right") - 1).clip(0)
+        return local - self.offsetarray[positions]
+
+
+# shared by all timers, built on first use
+localzone = TransitionTable()
@@ -0,0 +1,206 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from time import monotonic
+
+import perfstats
+
+# Write-behind access to a storage backend for the GUI. The backend is opened and only ever
+# used by a writer thread, so slow commits never block the Tk event loop. Mutations return
+# immediately and are applied in order, everything queued within COALESCE_DELAY goes into a
+# single transaction. Reads wait for the queued writes, so they always see them. The Tk thread
+# uses request() for them, which returns a Future right away instead of blocking on the writer.
+#   database = WriteBehind(lambda: storage.open_storage("sqlite"))
+#   database.set_last_clicked(12, time_int())  # queued
+#   database.load_stats()                      # waits for the writer
+#   database.request("load_stats")             # Future, done once the writer got to it
+#   database.close()                           # commits what is left and closes the backend
+
+log = logging.getLogger(__name__)
+
+# seconds the writer waits for more changes after the first one before committing
+COALESCE_DELAY = 0.05
+
+# storage methods that only change data, everything else is a read
+WRITE_METHODS = {"add_timer", "add_timers", "update_timer", "update_timers", "set_last_clicked",
+                 "set_last_clicked_many", "delete_timer", "delete_timers", "add_settings", "set_setting",
+                 "record_completion", "record_completions", "refresh_deadlines"}
+# writes only the last of which matters for the same first argument
+OVERWRITE_METHODS = {"set_last_clicked", "set_setting"}
+
+STOP = object()
+
+
+class WriteBehind:
+    def __init__(self, opener):
+        # opener() returns the storage backend, called on the writer thread
+        self.opener = opener
+        self.storage = None
+        self.queue = queue.Queue()
+        self.failures = queue.Queue()  # (exception, number of lost changes)
+        self.closed = False
+        # change counter after the last transaction, see track_changes()
+        self.counter = None
+        self.diverged = False  # something else changed the timers, or a write of ours got lost
+        self.thread = threading.Thread(target=self._run, name="database-writer", daemon=True)
+        self.thread.start()
+
+    def __getattr__(self, name):
+        # storage methods: writes are queued, reads wait for the result
+        if name in WRITE_METHODS:
+            return lambda *args: self.submit(name, *args)
+        return lambda *args: self.call(name, *args)
+
+    def submit(self, method, *args):
+        if self.closed:
+            raise ValueError("Database writer is closed")
+        self.queue.put((method, args, None))
+
+    def call(self, method, *args):
+        return self.request(method, *args).result()
+
+    def request(self, method, *args):
+        # read queued after the writes so far, returns its Future without waiting
+        if self.closed:
+            raise ValueError("Database writer is closed")
+        future = Future()
+        self.queue.put((method, args, future))
+        return future
+
+    def commit(self):
+        # the writer commits on its own, nothing to wait for
+        pass
+
+    def flush(self):
+        # waits until everything queued so far is committed
+        self.call("commit")
+
+    def track_changes(self):
+        # starts checking the change counter around every transaction, call before queuing any write
+        # returns the current value
+        self.counter = self.call("change_counter")
+        return self.counter
+
+    def synced_counter(self):
+        # change counter matching the data written through this writer, None if the database
+        # may hold anything else, e.g. changes made by the command line in the meantime
+        if self.counter is None or self.diverged or self.pending():
+            return None
+        return self.counter
+
+    def pending(self):
+        return self.queue.unfinished_tasks > 0
+
+    def errors(self):
+        # failed transactions since the last call
+        failed = []
+        while True:
+            try:
+                failed.append(self.failures.get_nowait())
+            except queue.Empty:
+                return failed
+
+    def close(self):
+        # commits the remaining changes, closes the backend and stops the writer
+        if self.closed:
+            return
+        if self.counter is not None:
+            # catches changes made by others since our last transaction
+            try:
+                self.diverged |= self.call("change_counter") != self.counter
+            except Exception:
+                self.diverged = True
+        self.closed = True
+        self.queue.put(STOP)
+        self.thread.join()
+
+    def _collect(self):
+        # one blocking get, then everything arriving until COALESCE_DELAY passed or a read shows up
+        batch = [self.queue.get()]
+        deadline = monotonic() + COALESCE_DELAY
+        while batch[-1] is not STOP and batch[-1][2] is None:
+            try:
+                batch.append(self.queue.get(timeout=max(0, deadline - monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _apply(self, writes):
+        # all writes in one transaction, earlier overwrites of the same key are skipped
+        seen = set()
+        kept = []
+        for method, args, future in reversed(writes):
+            if method in OVERWRITE_METHODS:
+                if (method, args[0]) in seen:
+                    continue
+                seen.add((method, args[0]))
+            kept.append((method, args))
+        kept.reverse()
+        perfstats.count("db.coalesced", len(writes) - len(kept))
+        if self._transaction(kept) or len(kept) == 1:
+            return
+        # replay the changes one transaction each, so only the failing ones are lost
+        for write in kept:
+            self._transaction([write])
+
+    def _transaction(self, writes):
+        # returns whether the writes were committed, failures are reported
+        try:
+            if self.counter is not None and self.storage.change_counter(lock=True) != self.counter:
+                self.diverged = True
+            for method, args in writes:
+                getattr(self.storage, method)(*args)
+            if self.counter is not None:
+                self.counter = self.storage.change_counter()
+            self.storage.commit()
+            return True
+        except Exception as error:
+            self.diverged = True
+            try:
+                self.storage.rollback()
+            except Exception:
+                pass
+            if len(writes) == 1:
+                log.error(f"Failed to write {writes[0][0]} to the database: {error}")
+                self.failures.put((error, 1))
+            return False
+
+    def _run(self):
+        try:
+            self.storage = self.opener()
+        except Exception as error:
+            # every call fails with the error, writes are reported as lost
+            self.storage = None
+            openerror = error
+        stopped = False
+        while not stopped:
+            batch = self._collect()
+            writes = []
+            for item in batch:
+                if item is STOP:
+                    stopped = True
+                    continue
+                method, args, future = item
+                if future is None:
+                    writes.append(item)
+                    continue
+                if self.storage is None:
+                    future.set_exception(openerror)
+                    continue
+                if writes:
+                    self._apply(writes)
+                    writes = []
+                try:
+                    future.set_result(getattr(self.storage, method)(*args))
+                except Exception as error:
+                    future.set_exception(error)
+            if writes:
+                if self.storage is None:
+                    self.failures.put((openerror, len(writes)))
+                else:
+                    self._apply(writes)
+            for item in batch:
+                self.queue.task_done()
+        if self.storage is not None:
+            self.storage.close()